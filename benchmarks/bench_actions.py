@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Measures --apply of a fragment with many target actions, with and without --persistent-shell.
+
+Generates a fragment whose every target has an after_apply action and
+applies it repeatedly, once starting a shell for every action and once
+running all of them in one persistent shell. Run from the repository root:
+
+    python benchmarks/bench_actions.py --targets 200 --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "src", "nastrajacz.py")
+
+
+def write_repository(path: str, targets: int, action: str) -> None:
+    home = os.path.join(path, "home")
+    fragment_dir = os.path.join(path, "repo", "fragments", "hooks")
+    os.makedirs(home)
+    os.makedirs(fragment_dir)
+
+    with open(os.path.join(path, "repo", "fragments.toml"), mode="w") as f:
+        f.write("[hooks]\ntargets = [\n")
+        for i in range(targets):
+            with open(os.path.join(fragment_dir, f".rc_{i}"), mode="w") as rc:
+                rc.write(f"{i}\n")
+            src = os.path.join(home, f".rc_{i}")
+            f.write(
+                f'    {{ src = "{src}", actions = {{ after_apply = "{action}" }} }},\n'
+            )
+        f.write("]\n")
+
+
+def time_runs(runs: int, command: list[str], cwd: str) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--action", type=str, default="test -f $TARGET_PATH")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_repository(tmp, args.targets, args.action)
+        repo = os.path.join(tmp, "repo")
+        command = [sys.executable, SCRIPT_PATH, "--apply"]
+        print(f"Applying {args.targets} targets with action: {args.action}")
+
+        print(f"{'':>18} {'median ms':>12} {'min ms':>12}")
+        results = {}
+        for name, argv in [
+            ("shell per action", command),
+            ("persistent shell", [*command, "--persistent-shell"]),
+        ]:
+            times = time_runs(args.runs, argv, repo)
+            results[name] = statistics.median(times)
+            print(
+                f"{name:>18} {statistics.median(times) * 1000:>12.2f} "
+                f"{min(times) * 1000:>12.2f}"
+            )
+
+        speedup = results["shell per action"] / results["persistent shell"]
+        print(f"Speedup {speedup:.1f}x.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Measures reading of a large fragments.toml with and without the config cache.
+
+Generates a configuration with many fragments and reads it repeatedly,
+once parsing it every time (cold) and once loading it from the cache
+written by the first read (warm). Run from the repository root:
+
+    python benchmarks/bench_config_cache.py --fragments 2000 --runs 20
+
+Add --cli to also time whole `nastrajacz --list` processes.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.nastrajacz import CONFIG_CACHE_PATH, read_fragments_config  # noqa: E402
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "src", "nastrajacz.py")
+
+
+def write_config(path: str, fragments: int) -> None:
+    with open(path, mode="w") as f:
+        for i in range(fragments):
+            f.write(f"[fragment_{i}]\n")
+            if i > 0:
+                f.write(f'depends_on = ["fragment_{i - 1}"]\n')
+            f.write(f'actions = {{ after_apply = "echo {i}" }}\n')
+            f.write("targets = [\n")
+            f.write(f'    {{ src = "~/.config/app_{i}", exclude = ["*.log"] }},\n')
+            f.write(f'    {{ src = "~/.app_{i}rc", dir = "rc", mode = "symlink" }},\n')
+            f.write("]\n\n")
+
+
+def time_runs(runs: int, run) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    print(
+        f"{name:>12} {statistics.median(times) * 1000:>12.2f} {min(times) * 1000:>12.2f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fragments", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--cli", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_config(os.path.join(tmp, "fragments.toml"), args.fragments)
+        cache_path = os.path.join(tmp, CONFIG_CACHE_PATH)
+        size = os.path.getsize(os.path.join(tmp, "fragments.toml"))
+        print(f"Reading {args.fragments} fragments ({size // 1024} KiB).")
+
+        print(f"{'':>12} {'median ms':>12} {'min ms':>12}")
+        cold = time_runs(
+            args.runs, lambda: read_fragments_config(tmp, write_cache=False)
+        )
+        report("cold", cold)
+
+        read_fragments_config(tmp)
+        warm = time_runs(args.runs, lambda: read_fragments_config(tmp))
+        report("warm", warm)
+        print(f"Speedup {statistics.median(cold) / statistics.median(warm):.1f}x.")
+
+        if args.cli:
+            command = [sys.executable, SCRIPT_PATH, "--list"]
+
+            def run_cli():
+                subprocess.run(command, cwd=tmp, stdout=subprocess.DEVNULL, check=True)
+
+            def run_cli_cold():
+                os.unlink(cache_path)
+                run_cli()
+
+            run_cli()
+            report("cli cold", time_runs(args.runs, run_cli_cold))
+            report("cli warm", time_runs(args.runs, run_cli))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Measures copy throughput of a directory target for different --jobs values.
+
+Creates a synthetic tree of small files and copies it into a fresh
+destination once per jobs value. Run from the repository root:
+
+    python benchmarks/bench_jobs.py --files 50000 --jobs 1,2,4,8,16
+
+Use --dir to place the tree on the filesystem you want to measure.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.nastrajacz import CopyStats, Options, copy_tree  # noqa: E402
+
+
+def create_tree(root: str, files: int, files_per_dir: int, size: int) -> None:
+    payload = os.urandom(size)
+    for i in range(files):
+        dir_path = os.path.join(root, f"dir_{i // files_per_dir}")
+        if i % files_per_dir == 0:
+            os.makedirs(dir_path)
+        with open(os.path.join(dir_path, f"file_{i}"), mode="wb") as f:
+            f.write(payload)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=50_000)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--size", type=int, default=512, help="bytes per file")
+    parser.add_argument("--jobs", type=str, default="1,2,4,8,16")
+    parser.add_argument("--dir", type=str, default=None)
+    args = parser.parse_args()
+
+    jobs_values = [int(j) for j in args.jobs.split(",")]
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        src = os.path.join(tmp, "src")
+        os.makedirs(src)
+
+        print(f"Creating {args.files} files of {args.size} bytes in {src}...")
+        create_tree(src, args.files, args.files_per_dir, args.size)
+
+        print(f"{'jobs':>6} {'seconds':>10} {'files/s':>12} {'MiB/s':>10}")
+        for jobs in jobs_values:
+            dst = os.path.join(tmp, f"dst_{jobs}")
+
+            start = time.perf_counter()
+            copy_tree(src, dst, Options(jobs=jobs), CopyStats(), {})
+            elapsed = time.perf_counter() - start
+
+            files_per_second = args.files / elapsed
+            mib_per_second = args.files * args.size / elapsed / 1024 / 1024
+            print(
+                f"{jobs:>6} {elapsed:>10.3f} {files_per_second:>12.0f} {mib_per_second:>10.2f}"
+            )
+
+            shutil.rmtree(dst)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Measures startup time of short nastrajacz commands.
+
+Runs --version, --list and --status as separate processes in a small
+generated repository and reports their wall-clock time, both for the script
+run directly and for bin/nastrajacz, which runs it from cached bytecode.
+Then runs each of them once with `-X importtime` and lists the modules that
+took the longest to import, including the modules they imported. Run from
+the repository root:
+
+    python benchmarks/bench_startup.py --runs 30 --top 10
+
+Bytecode is not cached when PYTHONDONTWRITEBYTECODE is set, which makes
+bin/nastrajacz compile the script on every run too.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "src", "nastrajacz.py")
+BIN_PATH = os.path.join(os.path.dirname(__file__), "..", "bin", "nastrajacz")
+
+COMMANDS = ["--version", "--list", "--status"]
+
+
+def write_repository(path: str, fragments: int) -> None:
+    home = os.path.join(path, "home")
+    with open(os.path.join(path, "fragments.toml"), mode="w") as f:
+        for i in range(fragments):
+            src = os.path.join(home, f".app_{i}rc")
+            f.write(f'[fragment_{i}]\ntargets = [{{ src = "{src}" }}]\n\n')
+
+            fragment_dir = os.path.join(path, "fragments", f"fragment_{i}")
+            os.makedirs(fragment_dir)
+            with open(os.path.join(fragment_dir, f".app_{i}rc"), mode="w") as rc:
+                rc.write(f"{i}\n")
+
+    # Copies the repository files to the system, so that --status finds
+    # them identical and runs through all of its checks.
+    os.makedirs(home)
+    for i in range(fragments):
+        with open(os.path.join(home, f".app_{i}rc"), mode="w") as rc:
+            rc.write(f"{i}\n")
+
+
+def run(
+    command: list[str], cwd: str, env: dict[str, str] | None = None
+) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        command,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def time_runs(runs: int, command: list[str], cwd: str) -> list[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(command, cwd)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(command: list[str], cwd: str) -> list[tuple[int, int, str]]:
+    """Returns self and cumulative microseconds of every module imported by command."""
+    result = run(command, cwd, {**os.environ, "PYTHONPROFILEIMPORTTIME": "1"})
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+    return modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fragments", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_repository(tmp, args.fragments)
+        # Writes the config cache, so that every measured run reads it.
+        run([sys.executable, SCRIPT_PATH, "--list"], tmp)
+
+        print(f"{'':>20} {'median ms':>12} {'min ms':>12} {'modules':>12}")
+        baseline = time_runs(args.runs, [sys.executable, "-c", "pass"], tmp)
+        print(
+            f"{'python':>20} {statistics.median(baseline) * 1000:>12.2f} "
+            f"{min(baseline) * 1000:>12.2f}"
+        )
+        breakdowns = {}
+        for command in COMMANDS:
+            for launcher, argv in [
+                ("script", [sys.executable, SCRIPT_PATH, command]),
+                ("bin", [BIN_PATH, command]),
+            ]:
+                name = f"{launcher} {command}"
+                times = time_runs(args.runs, argv, tmp)
+                breakdowns[name] = import_times(argv, tmp)
+                print(
+                    f"{name:>20} {statistics.median(times) * 1000:>12.2f} "
+                    f"{min(times) * 1000:>12.2f} {len(breakdowns[name]):>12}"
+                )
+
+        for command in COMMANDS:
+            modules = breakdowns[f"bin {command}"]
+            total = sum(self_us for self_us, _, _ in modules)
+            print(f"\nImports of {command}, {total / 1000:.2f} ms in total:")
+            print(f"{'self ms':>10} {'cumulative ms':>14}  module")
+            top = sorted(modules, key=lambda module: module[1], reverse=True)
+            for self_us, cumulative_us, name in top[: args.top]:
+                print(f"{self_us / 1000:>10.2f} {cumulative_us / 1000:>14.2f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
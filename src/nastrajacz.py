@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
 
 __version_info__ = ("1", "3", "0")
@@ -9,13 +11,100 @@ if sys.version_info < (3, 11):
     print("Python >=3.11 is required to run nastrajacz.")
     sys.exit(1)
 
+# Answered before anything else is imported, for tools polling the version.
+if __name__ == "__main__" and sys.argv[1:] == ["--version"]:
+    print(f"nastrajacz {__version__}")
+    sys.exit(0)
 
+# Modules needed only by some commands, like ctypes, shutil, socket,
+# subprocess, tarfile, tomllib or concurrent.futures, are imported where they
+# are used, so that short commands like --list don't pay for them. json and
+# pickle read the configuration cache, which every command but --version uses.
 import argparse
+import codecs
+import contextlib
+import dataclasses
+import errno
+import fnmatch
+import functools
+import glob
+import hashlib
+import io
+import json
 import os
-import shutil
-import subprocess
-import tomllib
-from dataclasses import dataclass
+import pickle
+import re
+import stat
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterator, TextIO
+
+if TYPE_CHECKING:
+    import ctypes
+    import socket
+    import tarfile
+    from concurrent.futures import Executor
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+try:
+    import pwd
+except ImportError:  # not available on Windows
+    pwd = None
+
+STATE_PATH = os.path.join(".", ".nastrajacz", "state")
+SOCKET_PATH = os.path.join(".", ".nastrajacz", "daemon.sock")
+STATE_VERSION = 1
+# Parsed fragments.toml, relative to the directory of the file.
+CONFIG_CACHE_PATH = os.path.join(".nastrajacz", "cache")
+# Fragments defined in each file included by fragments.toml.
+CONFIG_INDEX_PATH = os.path.join(".nastrajacz", "index")
+CONFIG_CACHE_VERSION = 3
+
+# ioctl request cloning a whole file on filesystems with copy-on-write support,
+# see ioctl_ficlone(2).
+FICLONE = 0x40049409
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+MODES = ["copy", "symlink", "hardlink"]
+
+# Range of uids of regular users, as in the defaults of login.defs(5).
+USER_UID_MIN = 1000
+USER_UID_MAX = 60000
+
+# Lines of context around changes in unified diffs, and the size of the block
+# in which a NUL byte marks a file as binary.
+DIFF_CONTEXT = 3
+DIFF_SNIFF_SIZE = 8192
+DIFF_BLOCK_SIZE = 64 * 1024
+DIFF_MAX_SIZE = 8 * 1024 * 1024
+
+# Flag of renameat2(2) atomically exchanging two paths.
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+# Events of inotify(7) that make watch mode fetch a path.
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = "iIII"
+
+# Seconds watch mode waits for events between checks whether it should stop,
+# waits for a burst of changes to end, and sleeps between polls without inotify.
+WATCH_TIMEOUT = 0.5
+WATCH_DEBOUNCE = 0.2
+WATCH_POLL_INTERVAL = 1.0
 
 HELP_APPLY = "apply configuration stored in the repository"
 HELP_FETCH = "fetch actual configuration and store it in the repository"
@@ -23,6 +112,53 @@ HELP_SELECT = (
     "comma separated list of fragments to operate on, or all fragments when omited"
 )
 HELP_LIST = "list fragments present in configuration file"
+HELP_STATUS = "report files that differ between the repository and the system"
+HELP_DIFF = (
+    "print unified diffs of files that differ between the repository and the system"
+)
+HELP_WATCH = "keep fetching files of the selected fragments as soon as they change"
+HELP_DAEMON = "keep running and serve commands sent with --connect over a unix socket"
+HELP_ROLLBACK = (
+    "restore files saved by --backup in the given run (default: the latest run)"
+)
+HELP_EXPORT_BUNDLE = (
+    "write the selected fragments and their configuration to a tar archive, "
+    "compressed when PATH ends with .gz or .xz"
+)
+HELP_FROM_BUNDLE = (
+    "with --apply, apply fragments from a tar archive made by --export-bundle"
+)
+HELP_ROOT = (
+    "with --apply, apply targets under PATH instead of /, "
+    "can be given multiple times to apply to many roots at once"
+)
+HELP_USERS = (
+    "with --apply, apply targets in home directories of the given comma-separated "
+    "users, owned by them"
+)
+HELP_ALL_USERS = "with --apply, apply targets in home directories of all regular users"
+HELP_CONNECT = "send the command to a running daemon instead of running it"
+HELP_SOCKET = f"path of the daemon's unix socket (default: {SOCKET_PATH})"
+HELP_BACKUP = "with --apply, save previous versions of overwritten files"
+HELP_DEEP = "with --status, compare hashes of all files that have the same size"
+HELP_INCREMENTAL = (
+    "only copy files whose size or modification time differ from the destination"
+)
+HELP_CHECKSUM = (
+    "like --incremental, but compare file contents instead of modification times"
+)
+HELP_JOBS = "number of files copied in parallel within a directory target"
+HELP_FRAGMENT_JOBS = "number of independent fragments processed in parallel"
+HELP_ATOMIC = "write every file to a temporary file and rename it into place"
+HELP_MODE = "how targets without their own mode are applied (default: copy)"
+HELP_DRY_RUN = "print what fetch or apply would do without changing any files"
+HELP_ZERO_COPY = (
+    "copy file contents inside the kernel using reflinks, copy_file_range or sendfile"
+)
+HELP_PERSISTENT_SHELL = (
+    "with --apply or --fetch, run actions in one long-lived shell instead of "
+    "starting a new one for every action"
+)
 
 
 class Term:
@@ -50,14 +186,285 @@ class TargetActions:
     after_fetch: str | None = None
 
 
+@dataclass
+class PathFilter:
+    """Include and exclude glob patterns of a target, compiled once.
+
+    Patterns containing a slash are matched against the path relative to
+    the target, other patterns against a single file or directory name.
+    A path is included when it or one of its parent directories matches.
+    """
+
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+
+    # Compiled on first use, so that loading a cached configuration doesn't
+    # compile patterns of targets the command never touches.
+    @functools.cached_property
+    def _include(self) -> tuple[re.Pattern | None, re.Pattern | None]:
+        return compile_patterns(self.include)
+
+    @functools.cached_property
+    def _exclude(self) -> tuple[re.Pattern | None, re.Pattern | None]:
+        return compile_patterns(self.exclude)
+
+    def excludes(self, rel_path: str) -> bool:
+        return matches_patterns(self._exclude, rel_path)
+
+    def includes(self, rel_path: str) -> bool:
+        if not self.include:
+            return True
+
+        while rel_path:
+            if matches_patterns(self._include, rel_path):
+                return True
+            rel_path = os.path.dirname(rel_path)
+        return False
+
+    def accepts(self, rel_path: str) -> bool:
+        return not self.excludes(rel_path) and self.includes(rel_path)
+
+    def excludes_tree(self, rel_path: str) -> bool:
+        """Returns whether rel_path or one of its parent directories is excluded."""
+        while rel_path:
+            if self.excludes(rel_path):
+                return True
+            rel_path = os.path.dirname(rel_path)
+        return False
+
+
+def compile_patterns(
+    patterns: list[str],
+) -> tuple[re.Pattern | None, re.Pattern | None]:
+    """Compiles glob patterns into one regex for names and one for paths."""
+    name_patterns = []
+    path_patterns = []
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            path_patterns.append(fnmatch.translate(pattern.lstrip("/")))
+        else:
+            name_patterns.append(fnmatch.translate(pattern))
+
+    def join(translated: list[str]) -> re.Pattern | None:
+        return re.compile("|".join(translated)) if translated else None
+
+    return join(name_patterns), join(path_patterns)
+
+
+def matches_patterns(
+    compiled: tuple[re.Pattern | None, re.Pattern | None], rel_path: str
+) -> bool:
+    name_regex, path_regex = compiled
+    if name_regex is not None and name_regex.match(os.path.basename(rel_path)):
+        return True
+    return path_regex is not None and bool(path_regex.match(rel_path))
+
+
+class GlobWalker:
+    """Matches glob patterns of target paths, listing every directory only once.
+
+    Listings are kept for the lifetime of the walker, so patterns of one
+    fragment looking into the same directories share them. Only directories
+    a pattern can match into are listed. Like filters, and unlike a shell,
+    wildcards match names starting with a dot.
+    """
+
+    def __init__(self):
+        self.listings: dict[str, dict[str, tuple[bool, bool]]] = {}
+
+    def list_dir(self, path: str) -> dict[str, tuple[bool, bool]]:
+        """Returns whether each entry of path is a directory and whether it is a link."""
+        listing = self.listings.get(path)
+        if listing is None:
+            listing = {}
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        listing[entry.name] = (entry.is_dir(), entry.is_symlink())
+            except OSError:
+                # Missing directories and files match nothing.
+                pass
+            self.listings[path] = listing
+        return listing
+
+    def glob(self, bases: list[str], parts: list[str]) -> list[str]:
+        """Returns sorted paths relative to any of bases matching parts of a pattern.
+
+        Paths inside of another matched directory are left out, as they are
+        copied with it. An empty path stands for a base itself.
+        """
+        matched = set()
+        for base in bases:
+            if os.path.lexists(base):
+                matched.update(self.match(base, "", parts))
+        if "" in matched:
+            return [""]
+
+        paths = []
+        for rel_path in sorted(matched, key=lambda path: path.split("/")):
+            parent = rel_path
+            while parent and (parent := os.path.dirname(parent)) not in matched:
+                pass
+            if not parent:
+                paths.append(rel_path)
+        return paths
+
+    def match(self, base: str, rel_path: str, parts: list[str]) -> Iterator[str]:
+        if not parts:
+            yield rel_path
+            return
+
+        part, rest = parts[0], parts[1:]
+        if part == "**" and not rest:
+            yield rel_path
+            return
+
+        listing = self.list_dir(os.path.join(base, rel_path) if rel_path else base)
+        if part == "**":
+            yield from self.match(base, rel_path, rest)
+            for name in sorted(listing):
+                is_dir, is_link = listing[name]
+                # Links are not followed, so that a link to a parent
+                # directory doesn't make the walk endless.
+                if is_dir and not is_link:
+                    yield from self.match(base, os.path.join(rel_path, name), parts)
+        elif glob.has_magic(part):
+            for name in sorted(fnmatch.filter(listing, part)):
+                if listing[name][0] or not rest:
+                    yield from self.match(base, os.path.join(rel_path, name), rest)
+        elif part in listing and (listing[part][0] or not rest):
+            yield from self.match(base, os.path.join(rel_path, part), rest)
+
+
+@dataclass
+class User:
+    name: str
+    home: str
+    uid: int
+    gid: int
+
+
+def read_users(names: str | None) -> list[User]:
+    """Looks up the comma-separated users, or all regular users without names.
+
+    Regular users are those with a uid in the range useradd(8) assigns by
+    default and an existing home directory. Raises KeyError for unknown names.
+    """
+    if names is not None:
+        entries = []
+        for name in names.split(","):
+            name = name.strip()
+            try:
+                entries.append(pwd.getpwnam(name))
+            except KeyError:
+                raise KeyError(name) from None
+    else:
+        entries = [
+            entry
+            for entry in pwd.getpwall()
+            if USER_UID_MIN <= entry.pw_uid <= USER_UID_MAX
+            and os.path.isdir(entry.pw_dir)
+        ]
+
+    return [
+        User(name=entry.pw_name, home=entry.pw_dir, uid=entry.pw_uid, gid=entry.pw_gid)
+        for entry in entries
+    ]
+
+
 @dataclass
 class Target:
     src: str
     dir: str | None
     actions: TargetActions
+    mode: str | None = None
+    link_files: bool = False
+    swap: bool = False
+    mirror: bool = False
+    path_filter: PathFilter | None = None
+    root: str | None = None
+    user: User | None = None
 
     def src_path(self) -> str:
-        return os.path.expanduser(self.src)
+        if self.user is not None and self.in_home():
+            path = self.user.home + self.src[1:]
+        else:
+            path = os.path.expanduser(self.src)
+        if self.root is not None:
+            path = resolve_in_root(self.root, path)
+        return path
+
+    def in_home(self) -> bool:
+        return self.src == "~" or self.src.startswith("~/")
+
+    def is_pattern(self) -> bool:
+        return glob.has_magic(self.src)
+
+    def split_pattern(self) -> tuple[str, list[str]]:
+        """Splits src into the path before its first wildcard and the parts after it."""
+        parts = self.src.split("/")
+        first = next(i for i, part in enumerate(parts) if glob.has_magic(part))
+        prefix = "/".join(parts[:first])
+        if not prefix:
+            # A pattern without a directory, like "*.toml", is relative.
+            prefix = "/" if self.src.startswith("/") else "."
+        return prefix, parts[first:]
+
+    def matched(self, prefix: str, rel_path: str) -> "Target":
+        """Returns the target of a path matched by the pattern in src.
+
+        Matched files are stored in the repository where a target with src
+        of prefix, the path before the first wildcard, would store them.
+        """
+        if not rel_path:
+            return dataclasses.replace(self, src=prefix)
+
+        if prefix == ".":
+            # Matched paths stay relative, stored like targets with those paths.
+            prefix_name, src = "", rel_path
+        else:
+            prefix_name = dataclasses.replace(self, src=prefix).src_basename()
+            src = f"{prefix.rstrip('/')}/{rel_path}"
+        rel_dir = os.path.dirname(os.path.join(prefix_name, rel_path))
+        if self.dir is not None:
+            rel_dir = os.path.join(self.dir, rel_dir)
+        return dataclasses.replace(self, src=src, dir=rel_dir or None)
+
+    def state_key(self) -> str:
+        """Returns the key of the target in the state, unique for every root and user."""
+        key = self.src
+        if self.user is not None:
+            key = f"~{self.user.name}:{key}"
+        if self.root is not None:
+            key = f"{self.root}:{key}"
+        return key
+
+    def rebased(self, roots: list[str], users: list[User]) -> list["Target"]:
+        """Returns the target placed under each of roots and in each user's home.
+
+        Only targets in the home directory are applied for every user.
+        """
+        targets = [self]
+        if users and self.in_home():
+            targets = [dataclasses.replace(self, user=user) for user in users]
+        if roots:
+            targets = [
+                dataclasses.replace(target, root=root)
+                for root in roots
+                for target in targets
+            ]
+        return targets
+
+    def describe(self, count: int) -> str:
+        """Describes the target applied to count roots or homes."""
+        if self.user is None:
+            return (
+                f'"{dataclasses.replace(self, root=None).src_path()}" in {count} roots'
+            )
+        if self.root is None:
+            return f'"{self.src}" for {count} users'
+        return f'"{self.src}" for {count} users and roots'
 
     def src_basename(self) -> str:
         return os.path.basename(self.src_path())
@@ -76,14 +483,100 @@ class Fragment:
     name: str
     targets: list[Target]
     actions: FragmentActions
+    depends_on: list[str] = field(default_factory=list)
 
     def path(self) -> str:
         return os.path.join(".", "fragments", self.name)
 
+    def target_path(self, target: Target) -> str:
+        """Returns where the target's file or directory is stored in the repository."""
+        fragment_path = self.path()
+        if target.dir is not None:
+            fragment_path = os.path.join(fragment_path, os.path.expanduser(target.dir))
+        return os.path.join(fragment_path, target.src_basename())
+
+    def expanded(self, system: bool = True, repository: bool = False) -> "Fragment":
+        """Returns the fragment with targets of paths matched by patterns in src.
+
+        Patterns are matched against paths on the system, files stored in
+        the repository, or both. Targets without patterns are kept as they are.
+        """
+        if not any(target.is_pattern() for target in self.targets):
+            return self
+
+        walker = GlobWalker()
+        targets = []
+        for target in self.targets:
+            if not target.is_pattern():
+                targets.append(target)
+                continue
+
+            prefix, parts = target.split_pattern()
+            prefix_target = dataclasses.replace(target, src=prefix)
+            bases = []
+            if system:
+                bases.append(prefix_target.src_path())
+            if repository:
+                bases.append(self.target_path(prefix_target))
+            for rel_path in walker.glob(bases, parts):
+                targets.append(target.matched(prefix, rel_path))
+        return dataclasses.replace(self, targets=targets)
+
+
+@dataclass
+class Options:
+    incremental: bool = False
+    checksum: bool = False
+    jobs: int = 1
+    fragment_jobs: int = 1
+    zero_copy: bool = False
+    mode: str = "copy"
+    atomic: bool = False
+    dry_run: bool = False
+    backup: "Backup | None" = None
+    roots: list[str] = field(default_factory=list)
+    users: list["User"] = field(default_factory=list)
+    shells: "ShellPool | None" = None
+    # Set for targets under a root or in a user's home, whose directories
+    # must not be entered through symbolic links.
+    confined: bool = False
+
+
+@dataclass
+class CopyStats:
+    copied: int = 0
+    skipped: int = 0
+    files: list[str] = field(default_factory=list)
+    dirs: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    methods: Counter = field(default_factory=Counter)
+    written: dict[str, dict] = field(default_factory=dict)
+    # Files that could not be copied, with the reason.
+    failed: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class Run:
+    """Data shared by all fragments processed by a single fetch or apply."""
+
+    state: dict
+    copy_methods: Counter = field(default_factory=Counter)
+    plan: Counter = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record_copy(self, stats: CopyStats) -> None:
+        with self.lock:
+            self.copy_methods.update(stats.methods)
+
+    def record_plan(self, plan: Counter) -> None:
+        with self.lock:
+            self.plan.update(plan)
+
 
 @dataclass
 class FragmentsConfig:
     fragments: dict[str, Fragment]
+    include: list[str] = field(default_factory=list)
 
     def names(self) -> list[str]:
         return sorted(self.fragments.keys())
@@ -92,13 +585,41 @@ class FragmentsConfig:
         return list(map(lambda name: self.fragments[name], self.names()))
 
 
-def main():
+def main() -> int:
     args = parse_args()
 
-    cwd = os.getcwd()
-    all_fragments_config = read_fragments_config(cwd)
+    if args.daemon:
+        return serve(args.socket)
+    if args.connect:
+        return send_command(args.socket, sys.argv[1:])
+
+    if args.from_bundle is not None or args.rollback is not None:
+        # The configuration is read from the bundle, and a rollback doesn't
+        # need it, so it works even after a broken configuration was pushed.
+        return run_command(args, None)
+
+    return run_command(
+        args,
+        read_fragments_config(
+            os.getcwd(),
+            write_cache=not args.dry_run,
+            # --list prints every fragment, not only the selected ones.
+            select=None if args.list else args.select,
+        ),
+    )
+
+
+def run_command(
+    args: argparse.Namespace, all_fragments_config: FragmentsConfig | None
+) -> int:
+    if args.from_bundle is not None:
+        return apply_bundle(args.from_bundle, args.select, options_from_args(args))
+
+    if args.rollback is not None:
+        return rollback_run(args.rollback or None)
+
     if all_fragments_config is None:
-        return
+        return 2
 
     selected_fragment_names = set(all_fragments_config.names())
     if args.select is not None:
@@ -106,7 +627,7 @@ def main():
 
     if len(selected_fragment_names) == 0:
         print("Cannot perform operations without selected fragments.")
-        return
+        return 2
 
     selected_fragments = {}
     for fragment_name in selected_fragment_names:
@@ -115,18 +636,67 @@ def main():
         ]
     selected_fragments_config = FragmentsConfig(selected_fragments)
 
+    options = options_from_args(args)
+
     if args.fetch:
-        fetch_fragments(selected_fragments_config)
+        fetch_fragments(selected_fragments_config, options)
     elif args.apply:
-        apply_fragments(selected_fragments_config)
+        apply_fragments(selected_fragments_config, options)
     elif args.list:
         list_fragments(all_fragments_config)
+    elif args.status:
+        return status_fragments(selected_fragments_config, args.deep)
+    elif args.diff:
+        return diff_fragments(selected_fragments_config)
+    elif args.watch:
+        watch_fragments(selected_fragments_config, options)
+    elif args.bundle is not None:
+        export_bundle(selected_fragments_config, args.bundle)
+
+    return 0
+
+
+def options_from_args(args: argparse.Namespace) -> Options:
+    return Options(
+        incremental=args.incremental,
+        checksum=args.checksum,
+        jobs=args.jobs,
+        fragment_jobs=args.fragment_jobs,
+        zero_copy=args.zero_copy,
+        mode=args.mode,
+        atomic=args.atomic,
+        dry_run=args.dry_run,
+        backup=Backup(run_id=new_run_id()) if args.backup else None,
+        roots=[os.path.abspath(root) for root in args.root],
+        users=args.users or [],
+        shells=ShellPool() if args.persistent_shell else None,
+    )
+
+
+def help_formatter(prog: str) -> argparse.HelpFormatter:
+    """Returns the default formatter of argparse, without importing shutil.
+
+    argparse asks shutil for the terminal width, and shutil imports bz2 and
+    lzma, so the width is found here the same way shutil.get_terminal_size
+    finds it.
+    """
+    try:
+        columns = int(os.environ["COLUMNS"])
+    except (KeyError, ValueError):
+        columns = 0
+    if columns <= 0:
+        try:
+            columns = os.get_terminal_size(sys.__stdout__.fileno()).columns
+        except (AttributeError, ValueError, OSError):
+            columns = 0
+    return argparse.HelpFormatter(prog, width=(columns or 80) - 2)
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog="nastrajacz",
         description="nastrajacz - a simple configuration manager.",
+        formatter_class=help_formatter,
     )
 
     parser.add_argument(
@@ -137,147 +707,335 @@ def parse_args() -> argparse.Namespace:
     group.add_argument("--apply", help=HELP_APPLY, action="store_true")
     group.add_argument("--fetch", help=HELP_FETCH, action="store_true")
     group.add_argument("--list", help=HELP_LIST, action="store_true")
+    group.add_argument("--status", help=HELP_STATUS, action="store_true")
+    group.add_argument("--diff", help=HELP_DIFF, action="store_true")
+    group.add_argument("--watch", help=HELP_WATCH, action="store_true")
+    group.add_argument("--daemon", help=HELP_DAEMON, action="store_true")
+    group.add_argument(
+        "--export-bundle", help=HELP_EXPORT_BUNDLE, metavar="PATH", dest="bundle"
+    )
+    group.add_argument(
+        "--rollback", help=HELP_ROLLBACK, nargs="?", const="", metavar="RUN_ID"
+    )
     group.required = True
 
     parser.add_argument("--select", help=HELP_SELECT, type=str)
+    parser.add_argument("--connect", help=HELP_CONNECT, action="store_true")
+    parser.add_argument("--socket", help=HELP_SOCKET, default=SOCKET_PATH)
+    parser.add_argument("--deep", help=HELP_DEEP, action="store_true")
+    parser.add_argument("--incremental", help=HELP_INCREMENTAL, action="store_true")
+    parser.add_argument("--checksum", help=HELP_CHECKSUM, action="store_true")
+    parser.add_argument("--jobs", help=HELP_JOBS, type=int, default=1, metavar="N")
+    parser.add_argument(
+        "--fragment-jobs", help=HELP_FRAGMENT_JOBS, type=int, default=1, metavar="N"
+    )
+    parser.add_argument("--zero-copy", help=HELP_ZERO_COPY, action="store_true")
+    parser.add_argument("--mode", help=HELP_MODE, choices=MODES, default="copy")
+    parser.add_argument("--atomic", help=HELP_ATOMIC, action="store_true")
+    parser.add_argument(
+        "--dry-run", "--plan", help=HELP_DRY_RUN, action="store_true", dest="dry_run"
+    )
+    parser.add_argument("--backup", help=HELP_BACKUP, action="store_true")
+    parser.add_argument("--from-bundle", help=HELP_FROM_BUNDLE, metavar="PATH")
+    parser.add_argument(
+        "--root", help=HELP_ROOT, action="append", default=[], metavar="PATH"
+    )
+    parser.add_argument("--users", help=HELP_USERS, type=str, metavar="USERS")
+    parser.add_argument("--all-users", help=HELP_ALL_USERS, action="store_true")
+    parser.add_argument(
+        "--persistent-shell", help=HELP_PERSISTENT_SHELL, action="store_true"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.connect and (args.daemon or args.watch):
+        parser.error("--connect cannot be used with --daemon or --watch")
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if args.fragment_jobs < 1:
+        parser.error("--fragment-jobs must be at least 1")
+
+    if args.dry_run and not (args.apply or args.fetch):
+        parser.error("--dry-run can only be used with --apply or --fetch")
+
+    if args.deep and not args.status:
+        parser.error("--deep can only be used with --status")
+
+    if args.backup and not args.apply:
+        parser.error("--backup can only be used with --apply")
+
+    if args.persistent_shell and not (args.apply or args.fetch):
+        parser.error("--persistent-shell can only be used with --apply or --fetch")
+
+    if args.root and (not args.apply or args.from_bundle is not None):
+        parser.error("--root can only be used with --apply")
 
-    args = parser.parse_args()
+    if args.users is not None or args.all_users:
+        if not args.apply or args.from_bundle is not None:
+            parser.error("--users and --all-users can only be used with --apply")
+        if args.users is not None and args.all_users:
+            parser.error("--users cannot be used with --all-users")
+        if pwd is None:
+            parser.error("--users and --all-users are not supported on this system")
+        try:
+            args.users = read_users(args.users)
+        except KeyError as e:
+            parser.error(f"unknown user: {e.args[0]}")
+
+    if args.from_bundle is not None:
+        if not args.apply:
+            parser.error("--from-bundle can only be used with --apply")
+        if args.dry_run or args.checksum or args.mode != "copy":
+            parser.error(
+                "--from-bundle cannot be used with --dry-run, --checksum or --mode"
+            )
+        # The archive is read as a stream, one file after another.
+        if args.jobs != 1 or args.fragment_jobs != 1 or args.zero_copy:
+            parser.error(
+                "--from-bundle cannot be used with --jobs, --fragment-jobs or --zero-copy"
+            )
 
     if args.select is not None:
         args.select = set([s.strip() for s in args.select.split(",")])
 
+    if args.checksum:
+        args.incremental = True
+
     return args
 
 
-def fetch_fragments(fragments: FragmentsConfig) -> None:
-    print(f"Performing fetch for {', '.join(fragments.names())} fragments.")
+def fetch_fragments(fragments: FragmentsConfig, options: Options) -> None:
+    print(
+        f"{'Planning' if options.dry_run else 'Performing'} fetch for {', '.join(fragments.names())} fragments."
+    )
 
-    mkdir("./fragments")
+    if not options.dry_run:
+        mkdir("./fragments")
+    run = Run(state=read_state())
+    run_fragments(
+        fragments,
+        options.fragment_jobs,
+        lambda fragment, out: fetch_fragment(fragment, options, run, out),
+    )
 
-    for fragment in fragments.as_list():
-        print(
-            f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}."
-        )
+    finish_run(run, options)
+
+
+def fetch_fragment(
+    fragment: Fragment, options: Options, run: Run, out: TextIO | None = None
+) -> bool:
+    print(
+        f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}.",
+        file=out,
+    )
 
+    if not options.dry_run:
         mkdir(fragment.path())
+    known_targets = state_targets(run.state, fragment.name)
+    recorded_targets = {}
+
+    if fragment.actions.before_fetch is not None:
+        success = run_action(
+            fragment_name=fragment.name,
+            action_name="before_fetch",
+            command=fragment.actions.before_fetch,
+            cwd=fragment.path(),
+            out=out,
+            dry_run=options.dry_run,
+            shells=options.shells,
+        )
+
+        # If this fragment's before_fetch script failed
+        # we must skip processing this fragment and move on to the next fragment.
+        if not success:
+            print(
+                f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                file=out,
+            )
+            return False
+
+    for target in fragment.expanded().targets:
+        target_path = fragment.path()
+
+        if target.dir is not None:
+            subdir = os.path.expanduser(target.dir)
+            target_path = os.path.join(target_path, subdir)
+
+        if os.path.isdir(target.src_path()):
+            target_path = os.path.join(target_path, target.src_basename())
+
+        if target.actions.before_fetch is not None:
+            # For fetch, destination is the target_path in fragments directory.
+            #   files: target_path is the directory, actual file will be target_path/basename.
+            #   directories: target_path already includes the basename.
+            if os.path.isdir(target.src_path()):
+                dest_path = target_path
+            else:
+                dest_path = os.path.join(target_path, target.src_basename())
 
-        if fragment.actions.before_fetch is not None:
             success = run_action(
-                fragment_name=fragment.name,
+                fragment_name=os.path.join(fragment.name, target.src_basename()),
                 action_name="before_fetch",
-                command=fragment.actions.before_fetch,
-                cwd=fragment.path(),
+                command=target.actions.before_fetch,
+                cwd=os.path.dirname(target_path),
+                target_path=dest_path,
+                out=out,
+                dry_run=options.dry_run,
+                shells=options.shells,
             )
 
-            # If this fragment's before_fetch script failed
-            # we must skip processing this fragment and move on to the next fragment.
+            # If this target's before_fetch script failed
+            # we must skip processing this target and move on to the next target.
             if not success:
                 print(
-                    f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}]."
+                    f"    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                    file=out,
                 )
                 continue
 
-        for target in fragment.targets:
-            target_path = fragment.path()
-
-            if target.dir is not None:
-                subdir = os.path.expanduser(target.dir)
-                target_path = os.path.join(target_path, subdir)
-
+        known_files = known_targets.get(target.src, {}).get("files", {})
+        if options.dry_run:
             if os.path.isdir(target.src_path()):
-                target_path = os.path.join(target_path, target.src_basename())
-
-            if target.actions.before_fetch is not None:
-                # For fetch, destination is the target_path in fragments directory.
-                #   files: target_path is the directory, actual file will be target_path/basename.
-                #   directories: target_path already includes the basename.
-                if os.path.isdir(target.src_path()):
-                    dest_path = target_path
-                else:
-                    dest_path = os.path.join(target_path, target.src_basename())
-
-                success = run_action(
-                    fragment_name=os.path.join(fragment.name, target.src_basename()),
-                    action_name="before_fetch",
-                    command=target.actions.before_fetch,
-                    cwd=os.path.dirname(target_path),
-                    target_path=dest_path,
-                )
-
-                # If this target's before_fetch script failed
-                # we must skip processing this target and move on to the next target.
-                if not success:
-                    print(
-                        f"    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}]."
-                    )
-                    continue
+                dest_path = target_path
+            else:
+                dest_path = os.path.join(target_path, target.src_basename())
 
+            plan = plan_copy(
+                target.src_path(),
+                dest_path,
+                options,
+                known_files,
+                out,
+                mirror=target.mirror,
+                path_filter=target.path_filter,
+            )
+            if plan is not None:
+                run.record_plan(plan)
+            stats = None
+        else:
             mkdir(target_path)
-            copy(target.src_path(), target_path)
-
-            if target.actions.after_fetch is not None:
-                # For fetch, destination is the target_path in fragments directory.
-                #   files: target_path is the directory, actual file will be target_path/basename.
-                #   directories: target_path already includes the basename.
-                if os.path.isdir(target.src_path()):
-                    dest_path = target_path
-                else:
-                    dest_path = os.path.join(target_path, target.src_basename())
+            stats = copy(
+                target.src_path(),
+                target_path,
+                options,
+                known_files,
+                out,
+                mirror=target.mirror,
+                path_filter=target.path_filter,
+            )
 
-                run_action(
-                    fragment_name=os.path.join(fragment.name, target.src_basename()),
-                    action_name="after_fetch",
-                    command=target.actions.after_fetch,
-                    cwd=os.path.dirname(target_path),
-                    target_path=dest_path,
-                )
+        if stats is not None:
+            run.record_copy(stats)
+            if os.path.isdir(target.src_path()):
+                recorded_path = target_path
+            else:
+                recorded_path = os.path.join(target_path, target.src_basename())
+            recorded_targets[target.src] = record_target_state(
+                recorded_path, stats.files, known_files
+            )
+
+        if target.actions.after_fetch is not None:
+            # For fetch, destination is the target_path in fragments directory.
+            #   files: target_path is the directory, actual file will be target_path/basename.
+            #   directories: target_path already includes the basename.
+            if os.path.isdir(target.src_path()):
+                dest_path = target_path
+            else:
+                dest_path = os.path.join(target_path, target.src_basename())
 
-        if fragment.actions.after_fetch is not None:
             run_action(
-                fragment_name=fragment.name,
+                fragment_name=os.path.join(fragment.name, target.src_basename()),
                 action_name="after_fetch",
-                command=fragment.actions.after_fetch,
-                cwd=fragment.path(),
+                command=target.actions.after_fetch,
+                cwd=os.path.dirname(target_path),
+                target_path=dest_path,
+                out=out,
+                dry_run=options.dry_run,
+                shells=options.shells,
             )
 
-        print(
-            f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}]."
+    if fragment.actions.after_fetch is not None:
+        run_action(
+            fragment_name=fragment.name,
+            action_name="after_fetch",
+            command=fragment.actions.after_fetch,
+            cwd=fragment.path(),
+            out=out,
+            dry_run=options.dry_run,
+            shells=options.shells,
         )
 
+    update_state(run.state, fragment.name, "fetch", recorded_targets)
 
-def apply_fragments(fragments: FragmentsConfig) -> None:
-    print(f"Performing apply for {', '.join(fragments.names())} fragments.")
+    print(
+        f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}].",
+        file=out,
+    )
+    return True
 
-    for fragment in fragments.as_list():
-        print(
-            f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}."
+
+def apply_fragments(fragments: FragmentsConfig, options: Options) -> None:
+    print(
+        f"{'Planning' if options.dry_run else 'Performing'} apply for {', '.join(fragments.names())} fragments."
+    )
+
+    run = Run(state=read_state())
+    if options.backup is not None:
+        options.backup.learn_hashes(run.state)
+    try:
+        run_fragments(
+            fragments,
+            options.fragment_jobs,
+            lambda fragment, out: apply_fragment(fragment, options, run, out),
         )
+    finally:
+        write_backup_index(options)
 
-        if fragment.actions.before_apply is not None:
-            success = run_action(
-                fragment_name=fragment.name,
-                action_name="before_apply",
-                command=fragment.actions.before_apply,
-                cwd=fragment.path(),
-            )
+    finish_run(run, options)
 
-            # If this fragment's before_apply script failed
-            # we must skip processing this fragment and move on to the next fragment.
-            if not success:
-                print(
-                    f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}]."
-                )
-                continue
 
-        for target in fragment.targets:
-            fragment_path = fragment.path()
+def apply_fragment(
+    fragment: Fragment, options: Options, run: Run, out: TextIO | None = None
+) -> bool:
+    print(
+        f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}.",
+        file=out,
+    )
+
+    known_targets = state_targets(run.state, fragment.name)
+    recorded_targets = {}
+
+    if fragment.actions.before_apply is not None:
+        success = run_action(
+            fragment_name=fragment.name,
+            action_name="before_apply",
+            command=fragment.actions.before_apply,
+            cwd=fragment.path(),
+            out=out,
+            dry_run=options.dry_run,
+            shells=options.shells,
+        )
 
-            if target.dir is not None:
-                subdir = os.path.expanduser(target.dir)
-                fragment_path = os.path.join(fragment_path, subdir)
+        # If this fragment's before_apply script failed
+        # we must skip processing this fragment and move on to the next fragment.
+        if not success:
+            print(
+                f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                file=out,
+            )
+            return False
 
-            target_path = os.path.join(fragment_path, target.src_basename())
+    # Patterns in src are matched against files stored in the repository.
+    for configured_target in fragment.expanded(system=False, repository=True).targets:
+        target_path = fragment.target_path(configured_target)
+        mode = configured_target.mode or options.mode
 
+        # With --root the target is applied under every root, and files of
+        # copied targets are read once for all of them.
+        targets = []
+        for target in configured_target.rebased(options.roots, options.users):
             if target.actions.before_apply is not None:
                 success = run_action(
                     fragment_name=os.path.join(fragment.name, target.src_basename()),
@@ -285,22 +1043,100 @@ def apply_fragments(fragments: FragmentsConfig) -> None:
                     command=target.actions.before_apply,
                     cwd=os.path.dirname(target_path),
                     target_path=target.src_path(),
+                    out=out,
+                    dry_run=options.dry_run,
+                    shells=options.shells,
                 )
 
                 # If this target's before_apply script failed
                 # we must skip processing this target and move on to the next target.
                 if not success:
                     print(
-                        f"    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}]."
+                        f"    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                        file=out,
                     )
                     continue
 
             src_parent_dir = os.path.dirname(target.src_path())
-            if src_parent_dir:
-                mkdir(src_parent_dir)
 
-            copy(target_path, target.src_path())
+            # Files in homes are written as root, so a link planted by a user
+            # could lead them to any file. Under a root links are resolved
+            # inside of it instead.
+            if target.user is not None and target.root is None:
+                checked_path = src_parent_dir
+                if mode == "copy" and os.path.isdir(target_path):
+                    checked_path = target.src_path()
+                link_path = find_link(target.user.home, checked_path)
+                if link_path is not None:
+                    print(
+                        f'    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} of user {target.user.name} because "{link_path}" is a symbolic link [{STATUS_SKIP}].',
+                        file=out,
+                    )
+                    continue
+
+            if src_parent_dir and not options.dry_run:
+                if target.user is not None:
+                    make_user_dirs(src_parent_dir, target.user)
+                else:
+                    mkdir(src_parent_dir)
+            targets.append(target)
+
+        known_files = {
+            target.state_key(): known_targets.get(target.state_key(), {}).get(
+                "files", {}
+            )
+            for target in targets
+        }
+        target_options = options
+        if options.roots or (options.users and configured_target.in_home()):
+            # Files are renamed over their destinations, so that a symbolic
+            # link found there is replaced instead of being written through.
+            target_options = dataclasses.replace(options, atomic=True, confined=True)
+        if (
+            mode == "copy"
+            and len(targets) > 1
+            and not configured_target.swap
+            and not options.dry_run
+        ):
+            try:
+                all_stats = copy_to_roots(
+                    target_path,
+                    targets[0].describe(len(targets)),
+                    [target.src_path() for target in targets],
+                    target_options,
+                    [known_files[target.state_key()] for target in targets],
+                    out,
+                    mirror=configured_target.mirror,
+                    path_filter=configured_target.path_filter,
+                )
+            except DestinationLinkError as e:
+                print(f" [{STATUS_FAIL}] ({e}).", file=out)
+                all_stats = [None for _ in targets]
+        else:
+            all_stats = [
+                apply_target(
+                    target_path,
+                    target,
+                    mode,
+                    target_options,
+                    run,
+                    known_files[target.state_key()],
+                    out,
+                )
+                for target in targets
+            ]
+
+        for target, stats in zip(targets, all_stats):
+            # Hard links share their owner with files in the repository.
+            if stats is not None and target.user is not None and mode != "hardlink":
+                chown_target(target.src_path(), stats, target.user)
+            if stats is not None:
+                run.record_copy(stats)
+                recorded_targets[target.state_key()] = record_target_state(
+                    target.src_path(), stats.files, known_files[target.state_key()]
+                )
 
+        for target in targets:
             if target.actions.after_apply is not None:
                 run_action(
                     fragment_name=os.path.join(fragment.name, target.src_basename()),
@@ -308,133 +1144,3303 @@ def apply_fragments(fragments: FragmentsConfig) -> None:
                     command=target.actions.after_apply,
                     cwd=os.path.dirname(target_path),
                     target_path=target.src_path(),
+                    out=out,
+                    dry_run=options.dry_run,
+                    shells=options.shells,
                 )
 
-        if fragment.actions.after_apply is not None:
-            run_action(
-                fragment_name=fragment.name,
-                action_name="after_apply",
-                command=fragment.actions.after_apply,
-                cwd=fragment.path(),
-            )
-
-        print(
-            f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}]."
+    if fragment.actions.after_apply is not None:
+        run_action(
+            fragment_name=fragment.name,
+            action_name="after_apply",
+            command=fragment.actions.after_apply,
+            cwd=fragment.path(),
+            out=out,
+            dry_run=options.dry_run,
+            shells=options.shells,
         )
 
+    update_state(run.state, fragment.name, "apply", recorded_targets)
 
-def list_fragments(fragments_config: FragmentsConfig) -> None:
-    fragments = ", ".join(sorted(fragments_config.names()))
-    print("Fragments defined in configuration file:")
-    print(fragments)
-
+    print(
+        f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}].",
+        file=out,
+    )
+    return True
 
-def read_fragments_config(working_dir_path: str) -> FragmentsConfig | None:
-    fragments_path = os.path.join(working_dir_path, "fragments.toml")
 
-    if not os.path.isfile(fragments_path):
-        print("There is no fragments file at this location.")
+def apply_target(
+    target_path: str,
+    target: Target,
+    mode: str,
+    options: Options,
+    run: Run,
+    known_files: dict[str, dict],
+    out: TextIO | None = None,
+) -> CopyStats | None:
+    """Copies or links a single target, or plans it with --dry-run."""
+    if options.dry_run:
+        if mode == "copy":
+            plan = plan_copy(
+                target_path,
+                target.src_path(),
+                options,
+                known_files,
+                out,
+                mirror=target.mirror,
+                path_filter=target.path_filter,
+            )
+        else:
+            plan = plan_link(
+                target_path,
+                target.src_path(),
+                mode,
+                target.link_files,
+                out,
+                target.path_filter,
+            )
+        if plan is not None:
+            run.record_plan(plan)
         return None
 
     try:
-        f = open(fragments_path, mode="rb")
-        data = tomllib.load(f)
+        if mode == "copy":
+            return copy(
+                target_path,
+                target.src_path(),
+                options,
+                known_files,
+                out,
+                swap=target.swap,
+                mirror=target.mirror,
+                path_filter=target.path_filter,
+            )
 
-        fragments = {}
-        fragment_names = set(data.keys())
-        for name in fragment_names:
-            targets = []
-            for target in data[name]["targets"]:
-                dir = None
-                actions = TargetActions()
+        return link(
+            target_path,
+            target.src_path(),
+            mode,
+            target.link_files,
+            out,
+            target.path_filter,
+            options.backup,
+            options.confined,
+        )
+    except DestinationLinkError as e:
+        print(f" [{STATUS_FAIL}] ({e}).", file=out)
+        return None
 
-                if "dir" in target:
-                    dir = target["dir"]
 
-                if "actions" in target:
-                    target_actions = target["actions"]
-                    if "before_apply" in target_actions:
-                        actions.before_apply = target_actions["before_apply"] or None
+def make_user_dirs(dir_path: str, user: User) -> None:
+    """Creates dir_path and its missing parents, owned by user."""
+    missing = []
+    while dir_path and not os.path.isdir(dir_path):
+        missing.append(dir_path)
+        dir_path = os.path.dirname(dir_path)
 
-                    if "after_apply" in target_actions:
-                        actions.after_apply = target_actions["after_apply"] or None
+    for missing_dir in reversed(missing):
+        os.mkdir(missing_dir)
+        os.chown(missing_dir, user.uid, user.gid)
 
-                    if "before_fetch" in target_actions:
-                        actions.before_fetch = target_actions["before_fetch"] or None
 
-                    if "after_fetch" in target_actions:
-                        actions.after_fetch = target_actions["after_fetch"] or None
+def chown_target(dst: str, stats: CopyStats, user: User) -> None:
+    """Gives user the ownership of all files and directories applied to dst.
 
-                targets.append(Target(src=target["src"], dir=dir, actions=actions))
+    Nothing inside a directory that is a symbolic link is handed over, since
+    the link could lead anywhere.
+    """
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        paths = [os.path.join(dst, rel_path) for rel_path in stats.dirs + stats.files]
+    else:
+        paths = [dst]
 
-            actions = FragmentActions()
-            if "actions" in data[name]:
-                data_actions = data[name]["actions"]
-                if "before_apply" in data_actions:
-                    actions.before_apply = data_actions["before_apply"] or None
+    # Directories are listed before the paths inside of them.
+    linked_paths = set()
+    for path in map(os.path.normpath, paths):
+        if os.path.dirname(path) in linked_paths:
+            linked_paths.add(path)
+            continue
+        path_stat = os.lstat(path)
+        if stat.S_ISLNK(path_stat.st_mode):
+            linked_paths.add(path)
+        if path_stat.st_uid != user.uid or path_stat.st_gid != user.gid:
+            os.lchown(path, user.uid, user.gid)
 
-                if "after_apply" in data_actions:
-                    actions.after_apply = data_actions["after_apply"] or None
 
-                if "before_fetch" in data_actions:
-                    actions.before_fetch = data_actions["before_fetch"] or None
+def finish_run(run: Run, options: Options) -> None:
+    if options.shells is not None:
+        options.shells.close()
 
-                if "after_fetch" in data_actions:
-                    actions.after_fetch = data_actions["after_fetch"] or None
+    if options.dry_run:
+        print(f"\nPlanned {format_plan(run.plan)} in total.")
+        return
 
-            fragment = Fragment(name=name, targets=targets, actions=actions)
-            fragments[name] = fragment
+    write_state(run.state)
+    print_copy_methods(run, options)
 
-        f.close()
-        return FragmentsConfig(fragments=fragments)
-    except Exception:
-        print("Could not read fragments config file.")
-        return None
+    backup = options.backup
+    if backup is not None and backup.files:
+        print(
+            f"\nSaved previous versions of {len(backup.files)} files as backup {backup.run_id}."
+        )
 
 
-def mkdir(dir_path: str) -> None:
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+def write_backup_index(options: Options) -> None:
+    """Writes the index of the files saved by the backup so far.
 
+    Called also when an apply fails, so the files it replaced before
+    failing can be rolled back.
+    """
+    if options.backup is not None and options.backup.files:
+        options.backup.write_index()
 
-def copy(src: str, dst: str) -> None:
-    print(f'  Copying "{src}" to "{dst}"', end="")
 
-    if os.path.isdir(src):
-        shutil.copytree(src, dst, dirs_exist_ok=True)
-        print(f" [{STATUS_DONE}].")
-    elif os.path.isfile(src):
-        shutil.copy2(src, dst)
-        print(f" [{STATUS_DONE}].")
-    else:
-        print(f" [{STATUS_SKIP}].")
+def print_copy_methods(run: Run, options: Options) -> None:
+    if not options.zero_copy or not run.copy_methods:
+        return
 
+    methods = ", ".join(
+        f"{method} {count}" for method, count in sorted(run.copy_methods.items())
+    )
+    print(f"\nCopied files using {methods}.")
 
-def run_action(
-    fragment_name: str,
+
+def run_fragments(
+    fragments: FragmentsConfig,
+    jobs: int,
+    process: Callable[[Fragment, TextIO | None], bool],
+    order: list[Fragment] | None = None,
+) -> None:
+    """Processes fragments so that each one starts after the fragments it depends on.
+
+    process returns False when the fragment was skipped, in which case fragments
+    depending on it are skipped as well. With more than one job independent
+    fragments are processed concurrently, and output of each fragment is
+    buffered and printed at once when it finishes so it is never interleaved.
+    A given order, which must respect dependencies, is used instead of the
+    computed one.
+    """
+    if order is None:
+        order = dependency_order(fragments)
+    if order is None:
+        print("Cannot perform operations because fragments depend on each other.")
+        return
+
+    selected_names = set(fragments.names())
+    succeeded = set()
+    failed = set()
+
+    def failed_dependency(fragment: Fragment) -> str | None:
+        for name in fragment.depends_on:
+            if name in failed:
+                return name
+        return None
+
+    def is_ready(fragment: Fragment) -> bool:
+        return all(
+            name in succeeded or name not in selected_names
+            for name in fragment.depends_on
+        )
+
+    def skip(fragment: Fragment, dependency: str) -> None:
+        print(
+            f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}."
+        )
+        print(
+            f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed dependency {Term.colored(dependency, Term.COLOR_FRAGMENT)} [{STATUS_SKIP}]."
+        )
+        failed.add(fragment.name)
+
+    if jobs == 1:
+        for fragment in order:
+            dependency = failed_dependency(fragment)
+            if dependency is not None:
+                skip(fragment, dependency)
+            elif process(fragment, None):
+                succeeded.add(fragment.name)
+            else:
+                failed.add(fragment.name)
+        return
+
+    def process_buffered(fragment: Fragment) -> tuple[bool, str]:
+        buffer = io.StringIO()
+        success = process(fragment, buffer)
+        return success, buffer.getvalue()
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    pending = list(order)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for fragment in list(pending):
+                dependency = failed_dependency(fragment)
+                if dependency is not None:
+                    skip(fragment, dependency)
+                    pending.remove(fragment)
+                elif is_ready(fragment) and len(running) < jobs:
+                    running[executor.submit(process_buffered, fragment)] = fragment
+                    pending.remove(fragment)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                fragment = running.pop(future)
+                success, output = future.result()
+                print(output, end="")
+                if success:
+                    succeeded.add(fragment.name)
+                else:
+                    failed.add(fragment.name)
+
+
+def dependency_order(fragments: FragmentsConfig) -> list[Fragment] | None:
+    """Orders fragments so that every fragment comes after its dependencies.
+
+    Fragments that are not ordered by dependencies keep alphabetical order.
+    Dependencies on fragments that were not selected are ignored.
+    Returns None when dependencies form a cycle.
+    """
+    remaining = {
+        fragment.name: set(fragment.depends_on) & set(fragments.names())
+        for fragment in fragments.as_list()
+    }
+
+    order = []
+    while remaining:
+        ready = sorted(name for name, deps in remaining.items() if not deps)
+        if not ready:
+            return None
+
+        name = ready[0]
+        order.append(fragments.fragments[name])
+        del remaining[name]
+        for deps in remaining.values():
+            deps.discard(name)
+
+    return order
+
+
+def watch_fragments(
+    fragments: FragmentsConfig,
+    options: Options,
+    stop: threading.Event | None = None,
+) -> None:
+    """Fetches files of the selected fragments whenever they change, until stopped.
+
+    Changes are reported by inotify, or found by polling where it is not
+    available. Changes are collected until none arrive for a moment, and
+    then only the changed files are copied. Removed files are removed from
+    the repository only for targets with mirror. Actions are not run.
+    """
+    print(f"Watching {', '.join(fragments.names())} fragments for changes.")
+
+    # Patterns in src are matched once, paths created later are not watched.
+    fragments = FragmentsConfig(
+        {fragment.name: fragment.expanded() for fragment in fragments.as_list()}
+    )
+    watcher = InotifyWatcher.create() or PollingWatcher(WATCH_POLL_INTERVAL)
+    for fragment in fragments.as_list():
+        for target in fragment.targets:
+            if os.path.isdir(target.src_path()):
+                watcher.watch_dir(target.src_path(), target.path_filter)
+            elif os.path.isdir(os.path.dirname(target.src_path())):
+                watcher.watch_file(target.src_path())
+
+    print(f"Using {watcher.name}, press Ctrl+C to stop.")
+
+    stop = stop or threading.Event()
+    try:
+        while not stop.is_set():
+            changed = watcher.changes(WATCH_TIMEOUT)
+            if not changed:
+                continue
+
+            # Editors and tools often write a file several times in a row,
+            # so the changes are fetched once they stop coming.
+            while more := watcher.changes(WATCH_DEBOUNCE):
+                changed |= more
+            fetch_changes(fragments, changed, options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+    print("\nStopped watching.")
+
+
+def fetch_changes(
+    fragments: FragmentsConfig, changed: set[str], options: Options
+) -> None:
+    for fragment in fragments.as_list():
+        target_paths = []
+        for target in fragment.targets:
+            src = target.src_path()
+            for path in sorted(changed):
+                if path == src or path.startswith(src + os.sep):
+                    target_paths.append((target, path))
+
+        if not target_paths:
+            continue
+
+        print(
+            f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}."
+        )
+        for target, path in target_paths:
+            fetch_change(fragment, target, path, options)
+        print(
+            f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}]."
+        )
+
+
+def fetch_change(
+    fragment: Fragment, target: Target, path: str, options: Options
+) -> None:
+    repo_path = fragment.target_path(target)
+    if path == target.src_path():
+        dst = repo_path
+    else:
+        rel_path = os.path.relpath(path, target.src_path())
+        if target.path_filter is not None:
+            if target.path_filter.excludes_tree(rel_path):
+                return
+            if os.path.isfile(path) and not target.path_filter.includes(rel_path):
+                return
+        dst = os.path.join(repo_path, rel_path)
+
+    if os.path.isdir(path):
+        # A whole directory appeared, its files could have been written before
+        # it was watched, so the target is fetched again.
+        mkdir(repo_path)
+        copy(
+            target.src_path(),
+            repo_path,
+            dataclasses.replace(options, incremental=True),
+            mirror=target.mirror,
+            path_filter=target.path_filter,
+        )
+    elif os.path.isfile(path):
+        mkdir(os.path.dirname(dst))
+        copy(path, dst, options)
+    elif target.mirror and os.path.lexists(dst):
+        remove_paths(os.path.dirname(dst), [os.path.basename(dst)])
+        print(f'  Removed "{dst}".')
+
+
+class InotifyWatcher:
+    """Reports changed paths using inotify(7), called through ctypes."""
+
+    name = "inotify"
+
+    def __init__(self, libc: ctypes.CDLL, fd: int):
+        self.libc = libc
+        self.fd = fd
+        # Watched directories by watch descriptor, with the root of the watched
+        # tree and its filter, or with names of single files watched in it.
+        self.dirs: dict[int, str] = {}
+        self.trees: dict[int, tuple[str, PathFilter | None]] = {}
+        self.files: dict[int, set[str]] = {}
+
+    @staticmethod
+    def create() -> "InotifyWatcher | None":
+        import ctypes
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return InotifyWatcher(libc, fd) if fd >= 0 else None
+
+    def add_watch(self, dir_path: str) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd >= 0:
+            self.dirs[wd] = dir_path
+        return wd
+
+    def watch_dir(
+        self, root: str, path_filter: PathFilter | None = None, rel_dir: str = "."
+    ) -> None:
+        start = os.path.normpath(os.path.join(root, rel_dir))
+        for dir_path, dir_names, _ in os.walk(start, followlinks=True):
+            if path_filter is not None:
+                dir_names[:] = [
+                    dir_name
+                    for dir_name in dir_names
+                    if not path_filter.excludes(
+                        os.path.relpath(os.path.join(dir_path, dir_name), root)
+                    )
+                ]
+            wd = self.add_watch(dir_path)
+            if wd >= 0:
+                self.trees[wd] = (root, path_filter)
+
+    def watch_file(self, path: str) -> None:
+        # The directory is watched instead of the file, because editors often
+        # replace files with new ones, which would end a watch of the file.
+        wd = self.add_watch(os.path.dirname(path))
+        if wd >= 0:
+            self.files.setdefault(wd, set()).add(os.path.basename(path))
+
+    def changes(self, timeout: float) -> set[str]:
+        import select
+        import struct
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from(INOTIFY_EVENT, data, offset)
+            name = os.fsdecode(data[offset + 16 : offset + 16 + length].rstrip(b"\0"))
+            offset += struct.calcsize(INOTIFY_EVENT) + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so everything watched is fetched again.
+                changed.update(root for root, _ in self.trees.values())
+                changed.update(
+                    os.path.join(self.dirs[wd], name)
+                    for wd, names in self.files.items()
+                    for name in names
+                )
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                self.trees.pop(wd, None)
+                self.files.pop(wd, None)
+                continue
+            if wd not in self.dirs:
+                continue
+
+            path = os.path.join(self.dirs[wd], name)
+            if wd in self.trees:
+                root, path_filter = self.trees[wd]
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    rel_dir = os.path.relpath(path, root)
+                    if path_filter is None or not path_filter.excludes_tree(rel_dir):
+                        self.watch_dir(root, path_filter, rel_dir)
+                changed.add(path)
+            elif name in self.files.get(wd, ()):
+                changed.add(path)
+
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Finds changed paths by comparing sizes and modification times periodically."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.name = f"polling every {interval:g}s"
+        self.trees: list[tuple[str, PathFilter | None]] = []
+        self.files: list[str] = []
+        self.snapshot: dict[str, tuple[int, int]] = {}
+
+    def watch_dir(self, root: str, path_filter: PathFilter | None = None) -> None:
+        self.trees.append((root, path_filter))
+        self.snapshot = self.scan()
+
+    def watch_file(self, path: str) -> None:
+        self.files.append(path)
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        paths = list(self.files)
+        for root, path_filter in self.trees:
+            if os.path.isdir(root):
+                files = walk_tree(root, path_filter)[1]
+                paths.extend(os.path.join(root, rel_file) for rel_file in files)
+
+        snapshot = {}
+        for path in paths:
+            try:
+                path_stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (path_stat.st_size, path_stat.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout: float) -> set[str]:
+        time.sleep(self.interval)
+        previous = self.snapshot
+        self.snapshot = self.scan()
+        return {
+            path
+            for path in previous.keys() | self.snapshot.keys()
+            if previous.get(path) != self.snapshot.get(path)
+        }
+
+    def close(self) -> None:
+        pass
+
+
+def serve(socket_path: str, stop: threading.Event | None = None) -> int:
+    """Runs commands sent by clients over a unix socket, one at a time, until stopped.
+
+    fragments.toml is parsed once and again only when its modification time
+    changes. Every request is a line of JSON with the command line arguments
+    of the command. The reply streams its output as lines of JSON with an
+    "output" key, followed by a line with its "exit_code".
+    """
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("Daemon mode is not supported on this system.")
+        return 2
+
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+            print(f'A daemon is already listening on "{socket_path}".')
+            return 2
+        except ConnectionRefusedError:
+            # Left behind by a daemon that did not exit cleanly.
+            os.unlink(socket_path)
+
+    # Anyone who can connect runs commands as this user, so the socket is
+    # created only accessible to them, without a moment in which it is not.
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen()
+    server.settimeout(WATCH_TIMEOUT)
+    print(f'Listening on "{socket_path}", press Ctrl+C to stop.', flush=True)
+
+    config = ConfigCache(os.path.join(os.getcwd(), "fragments.toml"))
+    stop = stop or threading.Event()
+    try:
+        while not stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except TimeoutError:
+                continue
+            with conn:
+                conn.settimeout(None)
+                handle_request(conn, config)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+    print("\nStopped daemon.")
+    return 0
+
+
+@dataclass
+class ConfigCache:
+    """Fragments config of a daemon, parsed again only when its files change."""
+
+    path: str
+    stamp: tuple | None = None
+    config: FragmentsConfig | None = None
+
+    def get(self) -> FragmentsConfig | None:
+        if self.stamp is None or self.current_stamp() != self.stamp:
+            self.config = read_fragments_config(os.path.dirname(self.path))
+            # A config that failed to read is read again by the next request,
+            # also when the cause was not in a file the stamp covers.
+            self.stamp = self.current_stamp() if self.config is not None else None
+        return self.config
+
+    def current_stamp(self) -> tuple | None:
+        """Returns mtime of fragments.toml with sizes and mtimes of included files."""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        include = self.config.include if self.config is not None else []
+        return mtime_ns, included_files(os.path.dirname(self.path), include)
+
+
+def handle_request(conn: socket.socket, config: ConfigCache) -> None:
+    def send(message: dict) -> None:
+        conn.sendall(json.dumps(message).encode() + b"\n")
+
+    try:
+        request = json.loads(conn.makefile("rb").readline())
+        argv = [str(arg) for arg in request["argv"]]
+    except (ValueError, KeyError, TypeError):
+        send({"output": "Invalid request.\n", "exit_code": 2})
+        return
+
+    with forwarded_output(lambda text: send({"output": text})):
+        try:
+            args = parse_args(argv)
+            if args.daemon or args.watch:
+                print("Daemon cannot run --daemon or --watch.")
+                exit_code = 2
+            else:
+                exit_code = run_command(args, config.get())
+        except SystemExit as e:
+            # Raised by argparse for invalid arguments and --help.
+            exit_code = e.code if isinstance(e.code, int) else 2
+        except Exception as e:
+            print(f"Command failed: {e}")
+            exit_code = 1
+
+    print(f"Finished {' '.join(argv)} with exit code {exit_code}.", flush=True)
+    try:
+        send({"exit_code": exit_code})
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def forwarded_output(send: Callable[[str], None]):
+    """Passes everything written to stdout and stderr to send, also by actions.
+
+    Both file descriptors are pointed to a pipe for the duration, so output of
+    child processes is forwarded as well, in the same order as it was written.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    saved_fds = [os.dup(1), os.dup(2)]
+
+    def forward() -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        connected = True
+        while data := os.read(read_fd, 64 * 1024):
+            text = decoder.decode(data)
+            if text and connected:
+                try:
+                    send(text)
+                except OSError:
+                    # The client went away, the output is still drained so
+                    # that the command can finish.
+                    connected = False
+        os.close(read_fd)
+
+    forwarder = threading.Thread(target=forward)
+    forwarder.start()
+    try:
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        with open(1, mode="w", buffering=1, closefd=False) as stdout:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+                yield
+    finally:
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+        forwarder.join()
+
+
+def send_command(socket_path: str, argv: list[str]) -> int:
+    """Runs the command in the daemon listening on socket_path and prints its output."""
+    import socket
+
+    argv = [arg for arg in argv if arg != "--connect"]
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+    except OSError:
+        print(f'There is no daemon listening on "{socket_path}".')
+        return 2
+
+    with client:
+        client.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        for line in client.makefile("rb"):
+            message = json.loads(line)
+            if "output" in message:
+                print(message["output"], end="", flush=True)
+            if "exit_code" in message:
+                return message["exit_code"]
+
+    print("Daemon closed the connection before the command finished.")
+    return 2
+
+
+def export_bundle(fragments: FragmentsConfig, bundle_path: str) -> None:
+    """Writes fragments and a configuration file describing them to a tar archive.
+
+    The archive is written as a stream, one file at a time, so memory use
+    doesn't depend on the size of the repository. The configuration comes
+    first, followed by fragments in the order they are applied in, each
+    with its targets in the order they are configured in.
+    """
+    print(f'Exporting {", ".join(fragments.names())} fragments to "{bundle_path}".')
+
+    order = dependency_order(fragments)
+    if order is None:
+        print("Cannot perform operations because fragments depend on each other.")
+        return
+
+    # The bundled configuration lists the files matched by patterns in src.
+    order = [fragment.expanded(system=False, repository=True) for fragment in order]
+
+    import tarfile
+
+    total = 0
+    with tarfile.open(
+        bundle_path, mode=bundle_mode(bundle_path), dereference=True
+    ) as tar:
+        config = format_fragments_config(order, set(fragments.names())).encode()
+        info = tarfile.TarInfo("fragments.toml")
+        info.size = len(config)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(config))
+
+        for fragment in order:
+            print(
+                f"  Adding fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}",
+                end="",
+            )
+            added = 0
+            for target in fragment.targets:
+                added += add_target_to_bundle(tar, fragment.target_path(target), target)
+            print(f" [{STATUS_DONE}] (files {added}).")
+            total += added
+
+    print(f"\nExported {total} files in total.")
+
+
+def bundle_mode(bundle_path: str) -> str:
+    if bundle_path.endswith((".gz", ".tgz")):
+        return "w|gz"
+    if bundle_path.endswith((".xz", ".txz")):
+        return "w|xz"
+    return "w|"
+
+
+def add_target_to_bundle(tar: tarfile.TarFile, target_path: str, target: Target) -> int:
+    """Adds files of a target stored in the repository and returns their count."""
+    arcname = os.path.relpath(target_path)
+    if os.path.isfile(target_path):
+        tar.add(target_path, arcname=arcname)
+        return 1
+    if not os.path.isdir(target_path):
+        return 0
+
+    dirs, files = walk_tree(target_path, target.path_filter)
+    # Sorting paths puts every directory right before its contents.
+    for rel_path in sorted(dirs + files):
+        tar.add(
+            os.path.join(target_path, rel_path),
+            arcname=os.path.normpath(os.path.join(arcname, rel_path)),
+            recursive=False,
+        )
+    return len(files)
+
+
+def format_fragments_config(fragments: list[Fragment], names: set[str]) -> str:
+    """Formats fragments as a fragments.toml file.
+
+    Fragment-level patterns are written to each of their targets, which they
+    were applied to when the configuration was read, and dependencies outside
+    of names are left out, so the result can be read on its own.
+    """
+    lines = []
+    for fragment in fragments:
+        key = format_toml_key(fragment.name)
+        lines.append(f"[{key}]")
+        depends_on = [name for name in fragment.depends_on if name in names]
+        if depends_on:
+            lines.append(f"depends_on = {format_toml_value(depends_on)}")
+        if not fragment.targets:
+            lines.append("targets = []")
+        lines.extend(format_toml_table(f"{key}.actions", vars(fragment.actions)))
+
+        for target in fragment.targets:
+            lines.append("")
+            lines.append(f"[[{key}.targets]]")
+            values = {
+                "src": target.src,
+                "dir": target.dir,
+                "mode": target.mode,
+                "link_files": target.link_files or None,
+                "swap": target.swap or None,
+                "mirror": target.mirror or None,
+            }
+            if target.path_filter is not None:
+                values["include"] = target.path_filter.include or None
+                values["exclude"] = target.path_filter.exclude or None
+            for name, value in values.items():
+                if value is not None:
+                    lines.append(f"{name} = {format_toml_value(value)}")
+            lines.extend(
+                format_toml_table(f"{key}.targets.actions", vars(target.actions))
+            )
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def format_toml_table(key: str, values: dict) -> list[str]:
+    lines = [
+        f"{name} = {format_toml_value(value)}"
+        for name, value in values.items()
+        if value is not None
+    ]
+    return ["", f"[{key}]", *lines] if lines else []
+
+
+def format_toml_key(key: str) -> str:
+    if re.fullmatch(r"[A-Za-z0-9_-]+", key):
+        return key
+    return json.dumps(key)
+
+
+def format_toml_value(value) -> str:
+    # JSON strings and arrays of them are valid TOML as well, as long as
+    # characters outside of the BMP are not escaped as surrogate pairs.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return json.dumps(value, ensure_ascii=False).replace("\x7f", "\\u007f")
+
+
+def apply_bundle(bundle_path: str, select: set[str] | None, options: Options) -> int:
+    """Applies fragments stored in a bundle without extracting it first.
+
+    The archive is read once, from start to end, and every file is written
+    straight to its destination. Fragments are processed in the order they
+    are listed in the bundle's configuration, which is the order their files
+    are stored in, so actions run right before and after the files they
+    belong to are written.
+    """
+    import tarfile
+    import tomllib
+
+    try:
+        tar = tarfile.open(bundle_path, mode="r|*")
+    except (OSError, tarfile.TarError):
+        print(f'Could not read bundle "{bundle_path}".')
+        return 2
+
+    with tar:
+        reader = BundleReader(tar)
+        try:
+            if reader.member is None or reader.member.name != "fragments.toml":
+                raise ValueError("Bundle does not start with fragments.toml")
+            config = parse_fragments_config(
+                tomllib.load(tar.extractfile(reader.member))
+            )
+        except Exception:
+            print("Could not read fragments config file.")
+            return 2
+
+        order = [
+            fragment
+            for fragment in config.fragments.values()
+            if select is None or fragment.name in select
+        ]
+        if not order:
+            print("Cannot perform operations without selected fragments.")
+            return 2
+
+        print(
+            f'Performing apply for {", ".join(sorted(f.name for f in order))} fragments from "{bundle_path}".'
+        )
+
+        for fragment in order:
+            for target in fragment.targets:
+                reader.pending[bundle_target_path(fragment, target)] = None
+        reader.advance()
+
+        run = Run(state=read_state())
+        if options.backup is not None:
+            options.backup.learn_hashes(run.state)
+        try:
+            run_fragments(
+                FragmentsConfig({fragment.name: fragment for fragment in order}),
+                1,
+                lambda fragment, out: apply_bundle_fragment(
+                    fragment, reader, options, run, out
+                ),
+                order,
+            )
+        finally:
+            write_backup_index(options)
+
+    finish_run(run, options)
+    return 0
+
+
+def bundle_target_path(fragment: Fragment, target: Target) -> str:
+    return os.path.relpath(fragment.target_path(target))
+
+
+class BundleReader:
+    """Walks members of a bundle read as a stream, one member at a time.
+
+    pending holds paths of targets that are yet to be applied, in the order
+    they are applied in. Members that belong to none of them, because their
+    fragment was not selected or was skipped, are passed over.
+    """
+
+    def __init__(self, tar: tarfile.TarFile):
+        self.tar = tar
+        self.member = tar.next()
+        self.pending: dict[str, None] = {}
+
+    def advance(self) -> None:
+        self.member = self.tar.next()
+
+    def is_pending(self, name: str) -> bool:
+        while name:
+            if name in self.pending:
+                return True
+            name = os.path.dirname(name)
+        return False
+
+    def members_of(self, target_path: str) -> Iterator[tuple[str, tarfile.TarInfo]]:
+        """Yields members stored under target_path with paths relative to it.
+
+        Stops at the first member of a target applied later, as the data of
+        a member can only be read before the next member is reached. Targets
+        that were to be applied before this one are not pending anymore.
+        """
+        while self.pending:
+            path = next(iter(self.pending))
+            del self.pending[path]
+            if path == target_path:
+                break
+        while self.member is not None:
+            name = self.member.name
+            if name == target_path:
+                yield ".", self.member
+            elif name.startswith(target_path + "/"):
+                yield name[len(target_path) + 1 :], self.member
+            elif self.is_pending(name):
+                return
+            self.advance()
+
+
+def apply_bundle_fragment(
+    fragment: Fragment,
+    reader: BundleReader,
+    options: Options,
+    run: Run,
+    out: TextIO | None = None,
+) -> bool:
+    print(
+        f"\nProcessing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}.",
+        file=out,
+    )
+
+    known_targets = state_targets(run.state, fragment.name)
+    recorded_targets = {}
+
+    # The fragment's directory is not extracted, so actions run in the
+    # current directory.
+    if fragment.actions.before_apply is not None:
+        success = run_action(
+            fragment_name=fragment.name,
+            action_name="before_apply",
+            command=fragment.actions.before_apply,
+            cwd=".",
+            out=out,
+            shells=options.shells,
+        )
+        if not success:
+            print(
+                f"  Skipping fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                file=out,
+            )
+            return False
+
+    for target in fragment.targets:
+        target_name = os.path.join(fragment.name, target.src_basename())
+        target_path = bundle_target_path(fragment, target)
+
+        if target.actions.before_apply is not None:
+            success = run_action(
+                fragment_name=target_name,
+                action_name="before_apply",
+                command=target.actions.before_apply,
+                cwd=".",
+                target_path=target.src_path(),
+                out=out,
+                shells=options.shells,
+            )
+            if not success:
+                print(
+                    f"    Skipping target {Term.colored(target.src_basename(), Term.COLOR_FRAGMENT)} because of failed before action [{STATUS_SKIP}].",
+                    file=out,
+                )
+                continue
+
+        src_parent_dir = os.path.dirname(target.src_path())
+        if src_parent_dir:
+            mkdir(src_parent_dir)
+
+        known_files = known_targets.get(target.src, {}).get("files", {})
+        stats = extract_target(reader, target_path, target, options, out)
+        if stats is not None:
+            recorded_targets[target.src] = record_target_state(
+                target.src_path(), stats.files, {**known_files, **stats.written}
+            )
+
+        if target.actions.after_apply is not None:
+            run_action(
+                fragment_name=target_name,
+                action_name="after_apply",
+                command=target.actions.after_apply,
+                cwd=".",
+                target_path=target.src_path(),
+                out=out,
+                shells=options.shells,
+            )
+
+    if fragment.actions.after_apply is not None:
+        run_action(
+            fragment_name=fragment.name,
+            action_name="after_apply",
+            command=fragment.actions.after_apply,
+            cwd=".",
+            out=out,
+            shells=options.shells,
+        )
+
+    update_state(run.state, fragment.name, "apply", recorded_targets)
+
+    print(
+        f"  Finished processing fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)} [{STATUS_DONE}].",
+        file=out,
+    )
+    return True
+
+
+def extract_target(
+    reader: BundleReader,
+    target_path: str,
+    target: Target,
+    options: Options,
+    out: TextIO | None = None,
+) -> CopyStats | None:
+    """Writes members of a target to the system, the way copy would copy them.
+
+    Targets are always copied, because there are no files in the repository
+    for links to point to. Files are hashed while they are written, so that
+    recording the state doesn't read them again.
+    """
+    dst = target.src_path()
+    print(f'  Extracting "{target_path}" to "{dst}"', end="", file=out)
+
+    stats = CopyStats()
+    for rel_path, member in reader.members_of(target_path):
+        path = dst if rel_path == "." else os.path.join(dst, rel_path)
+        if member.isdir():
+            mkdir(path)
+            stats.dirs.append(rel_path)
+        elif member.isfile():
+            written = extract_file(reader.tar, member, path, options)
+            if written is not None:
+                stats.copied += 1
+                stats.written[rel_path] = written
+            else:
+                stats.skipped += 1
+            stats.files.append(rel_path)
+
+    if not stats.dirs and not stats.files:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return None
+
+    if target.mirror and stats.dirs:
+        stats.removed.extend(
+            find_extras(dst, stats.dirs, stats.files, target.path_filter)
+        )
+        if options.backup is not None:
+            options.backup.save_tree(dst, stats.removed)
+        remove_paths(dst, stats.removed)
+
+    counts = []
+    if options.incremental:
+        counts.append(f"copied {stats.copied}, skipped {stats.skipped}")
+    if target.mirror:
+        counts.append(f"removed {len(stats.removed)}")
+
+    if counts:
+        print(f" [{STATUS_DONE}] ({', '.join(counts)}).", file=out)
+    else:
+        print(f" [{STATUS_DONE}].", file=out)
+
+    for rel_path in stats.removed:
+        print(f'    Removed "{os.path.join(dst, rel_path)}".', file=out)
+
+    return stats
+
+
+def extract_file(
+    tar: tarfile.TarFile, member: tarfile.TarInfo, dst: str, options: Options
+) -> dict | None:
+    """Writes a file member to dst unless --incremental finds it unchanged.
+
+    Returns the state of the written file, or None when it was not written.
+    """
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        dst_stat = None
+
+    if (
+        options.incremental
+        and dst_stat is not None
+        and stat.S_ISREG(dst_stat.st_mode)
+        and dst_stat.st_size == member.size
+        # Archives keep modification times in whole seconds.
+        and int(dst_stat.st_mtime) == int(member.mtime)
+    ):
+        return None
+
+    if options.backup is not None:
+        options.backup.save(dst)
+
+    if dst_stat is not None and stat.S_ISLNK(dst_stat.st_mode):
+        # Writing to dst would write to the file the link points to.
+        os.unlink(dst)
+
+    tmp_path = temp_sibling(dst) if options.atomic else dst
+    h = hashlib.sha256()
+    try:
+        with tar.extractfile(member) as fsrc, open(tmp_path, mode="wb") as fdst:
+            while chunk := fsrc.read(1024 * 1024):
+                h.update(chunk)
+                fdst.write(chunk)
+        os.chmod(tmp_path, member.mode)
+        os.utime(tmp_path, (member.mtime, member.mtime))
+        if options.atomic:
+            os.replace(tmp_path, dst)
+    except BaseException:
+        if options.atomic and os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    dst_stat = os.stat(dst)
+    return {
+        "size": dst_stat.st_size,
+        "mtime_ns": dst_stat.st_mtime_ns,
+        "hash": h.hexdigest(),
+    }
+
+
+def list_fragments(fragments_config: FragmentsConfig) -> None:
+    fragments = ", ".join(sorted(fragments_config.names()))
+    print("Fragments defined in configuration file:")
+    print(fragments)
+
+
+def status_fragments(fragments: FragmentsConfig, deep: bool) -> int:
+    """Reports files that differ between the repository and the system.
+
+    Returns 0 when every file is identical and 1 otherwise. Files are compared
+    by their metadata first and their contents are read only when that is not
+    enough. With deep, files of the same size are always compared by hashes
+    computed in a pool of processes.
+    """
+    print(f"Checking status of {', '.join(fragments.names())} fragments.")
+
+    counts = Counter()
+    if deep:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor()
+    else:
+        executor = None
+    try:
+        for fragment in fragments.as_list():
+            print(
+                f"\nChecking fragment {Term.colored(fragment.name, Term.COLOR_FRAGMENT)}."
+            )
+            for target in fragment.expanded(repository=True).targets:
+                counts.update(
+                    status_target(
+                        fragment.target_path(target),
+                        target.src_path(),
+                        target.path_filter,
+                        executor,
+                    )
+                )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    drifted = sum(counts.values()) - counts["identical"]
+    if drifted:
+        print(f"\nFound {drifted} files that differ.")
+        return 1
+
+    print("\nAll files are identical.")
+    return 0
+
+
+def status_target(
+    repo_path: str,
+    system_path: str,
+    path_filter: PathFilter | None = None,
+    executor: Executor | None = None,
+) -> Counter:
+    print(f'  Comparing "{repo_path}" with "{system_path}"', end="")
+
+    files = target_files(repo_path, system_path, path_filter)
+    if files is None:
+        print(f" [{STATUS_SKIP}].")
+        return Counter()
+    repo_files, system_files = files
+
+    def paths(rel_path: str) -> tuple[str, str]:
+        return target_file_paths(repo_path, system_path, rel_path)
+
+    statuses = {}
+    undecided = []
+    for rel_path in sorted(repo_files | system_files):
+        if rel_path not in system_files:
+            statuses[rel_path] = "missing on system"
+        elif rel_path not in repo_files:
+            statuses[rel_path] = "missing in repo"
+        else:
+            status = compare_stat(*paths(rel_path), executor is not None)
+            if status is None:
+                undecided.append(rel_path)
+            else:
+                statuses[rel_path] = status
+
+    if executor is not None:
+        repo_hashes = executor.map(hash_file, [paths(p)[0] for p in undecided])
+        system_hashes = executor.map(hash_file, [paths(p)[1] for p in undecided])
+        for rel_path, repo_hash, system_hash in zip(
+            undecided, repo_hashes, system_hashes
+        ):
+            statuses[rel_path] = "identical" if repo_hash == system_hash else "modified"
+    else:
+        for rel_path in undecided:
+            equal = same_contents(*paths(rel_path))
+            statuses[rel_path] = "identical" if equal else "modified"
+
+    counts = Counter(statuses.values())
+    print(
+        f" [{STATUS_DONE}] (identical {counts['identical']}, modified {counts['modified']}, "
+        f"missing on system {counts['missing on system']}, missing in repo {counts['missing in repo']})."
+    )
+    for rel_path, status in sorted(statuses.items()):
+        if status != "identical":
+            print(f'    {status.capitalize()} "{paths(rel_path)[1]}".')
+
+    return counts
+
+
+def target_files(
+    repo_path: str, system_path: str, path_filter: PathFilter | None = None
+) -> tuple[set[str], set[str]] | None:
+    """Returns files of a target stored in the repository and present on the system.
+
+    Paths are relative to the target, with "." standing for a target that is
+    a single file. Returns None when the target exists on neither side.
+    """
+    if os.path.isdir(repo_path) or os.path.isdir(system_path):
+        repo_files = set()
+        if os.path.isdir(repo_path):
+            repo_files.update(walk_tree(repo_path, path_filter)[1])
+        system_files = set()
+        if os.path.isdir(system_path):
+            system_files.update(walk_tree(system_path, path_filter)[1])
+        return repo_files, system_files
+
+    if os.path.exists(repo_path) or os.path.exists(system_path):
+        repo_files = {"."} if os.path.isfile(repo_path) else set()
+        system_files = {"."} if os.path.isfile(system_path) else set()
+        return repo_files, system_files
+
+    return None
+
+
+def target_file_paths(
+    repo_path: str, system_path: str, rel_path: str
+) -> tuple[str, str]:
+    if rel_path == ".":
+        return repo_path, system_path
+    return os.path.join(repo_path, rel_path), os.path.join(system_path, rel_path)
+
+
+def diff_fragments(fragments: FragmentsConfig) -> int:
+    """Prints unified diffs from files in the repository to files on the system.
+
+    Returns 0 when there are no differences and 1 otherwise, like diff(1).
+    """
+    differ = False
+    for fragment in fragments.as_list():
+        for target in fragment.expanded(repository=True).targets:
+            repo_path = fragment.target_path(target)
+            system_path = target.src_path()
+
+            files = target_files(repo_path, system_path, target.path_filter)
+            if files is None:
+                continue
+            repo_files, system_files = files
+
+            for rel_path in sorted(repo_files | system_files):
+                repo_file, system_file = target_file_paths(
+                    repo_path, system_path, rel_path
+                )
+                if rel_path not in system_files:
+                    status = "missing on system"
+                elif rel_path not in repo_files:
+                    status = "missing in repo"
+                else:
+                    status = compare_stat(repo_file, system_file, False)
+
+                if status == "missing on system":
+                    print(f"Only in repository: {repo_file}")
+                    differ = True
+                elif status == "missing in repo":
+                    print(f"Only on system: {system_file}")
+                    differ = True
+                elif status != "identical":
+                    differ |= diff_files(repo_file, system_file)
+
+    return 1 if differ else 0
+
+
+def diff_files(a: str, b: str) -> bool:
+    """Prints a unified diff of two files and returns whether they differ.
+
+    Lines both files start and end with are streamed past without being
+    kept in memory, except for the few needed as context, so only the part
+    of the files between the first and the last change is loaded and diffed.
+    When that part is larger than DIFF_MAX_SIZE in either file, only the fact
+    that the files differ is printed.
+    """
+    with open(a, mode="rb") as fa, open(b, mode="rb") as fb:
+        if is_binary(fa) or is_binary(fb):
+            if same_contents(a, b):
+                return False
+            print(f"Binary files {a} and {b} differ")
+            return True
+
+        before = deque(maxlen=DIFF_CONTEXT)
+        skipped = 0
+        while True:
+            offset = fa.tell()
+            line_a = fa.readline()
+            line_b = fb.readline()
+            if line_a != line_b:
+                break
+            if not line_a:
+                return False
+            before.append(line_a)
+            skipped += 1
+
+        size_a = os.fstat(fa.fileno()).st_size
+        size_b = os.fstat(fb.fileno()).st_size
+        suffix = common_suffix_length(fa, fb, size_a, size_b, offset)
+
+        # The common suffix has to start at the beginning of a line in both files,
+        # otherwise the partial line it starts with is moved to the changed part.
+        if not (
+            starts_line(fa, size_a, suffix, offset)
+            and starts_line(fb, size_b, suffix, offset)
+        ):
+            fa.seek(size_a - suffix)
+            suffix -= len(fa.readline())
+
+        if max(size_a, size_b) - offset - suffix > DIFF_MAX_SIZE:
+            print(f"Files {a} and {b} differ")
+            return True
+
+        fa.seek(offset)
+        changed_a = fa.read(size_a - offset - suffix).splitlines(keepends=True)
+        fb.seek(offset)
+        changed_b = fb.read(size_b - offset - suffix).splitlines(keepends=True)
+
+        fa.seek(size_a - suffix)
+        after = [line for _ in range(DIFF_CONTEXT) if (line := fa.readline())]
+
+    lines_a = [line.decode(errors="replace") for line in [*before, *changed_a, *after]]
+    lines_b = [line.decode(errors="replace") for line in [*before, *changed_b, *after]]
+    first_line = skipped - len(before)
+
+    import difflib
+
+    for line in difflib.unified_diff(
+        lines_a, lines_b, fromfile=a, tofile=b, n=DIFF_CONTEXT
+    ):
+        if line.startswith("@@"):
+            line = shift_hunk_header(line, first_line)
+        print(line, end="")
+        if not line.endswith("\n"):
+            print("\n\\ No newline at end of file")
+
+    return True
+
+
+def is_binary(f: io.BufferedReader) -> bool:
+    f.seek(0)
+    binary = b"\0" in f.read(DIFF_SNIFF_SIZE)
+    f.seek(0)
+    return binary
+
+
+def common_suffix_length(
+    fa: io.BufferedReader, fb: io.BufferedReader, size_a: int, size_b: int, start: int
+) -> int:
+    """Returns the number of bytes both files end with, reading them backwards."""
+    limit = min(size_a, size_b) - start
+    length = 0
+    while length < limit:
+        n = min(DIFF_BLOCK_SIZE, limit - length)
+        fa.seek(size_a - length - n)
+        block_a = fa.read(n)
+        fb.seek(size_b - length - n)
+        block_b = fb.read(n)
+        if block_a == block_b:
+            length += n
+            continue
+
+        i = n
+        while block_a[i - 1] == block_b[i - 1]:
+            i -= 1
+        return length + n - i
+    return length
+
+
+def starts_line(f: io.BufferedReader, size: int, suffix: int, start: int) -> bool:
+    if size - suffix == start:
+        return True
+    f.seek(size - suffix - 1)
+    return f.read(1) == b"\n"
+
+
+def shift_hunk_header(header: str, lines: int) -> str:
+    def shift(match: re.Match) -> str:
+        return f"{match.group(1)}{int(match.group(2)) + lines}"
+
+    return re.sub(r"([-+])(\d+)", shift, header, count=2)
+
+
+def compare_stat(repo_file: str, system_file: str, deep: bool) -> str | None:
+    """Compares two files by metadata, returns None when their contents must be compared.
+
+    A file that cannot be stat-ed, like a dangling symbolic link, is reported
+    as missing on its side.
+    """
+    try:
+        system_stat = os.stat(system_file)
+    except OSError:
+        return "missing on system"
+    try:
+        repo_stat = os.stat(repo_file)
+    except OSError:
+        return "missing in repo"
+
+    if (repo_stat.st_dev, repo_stat.st_ino) == (system_stat.st_dev, system_stat.st_ino):
+        return "identical"
+    if repo_stat.st_size != system_stat.st_size:
+        return "modified"
+    if not deep and repo_stat.st_mtime_ns == system_stat.st_mtime_ns:
+        return "identical"
+    return None
+
+
+def read_fragments_config(
+    working_dir_path: str, write_cache: bool = True, select: set[str] | None = None
+) -> FragmentsConfig | None:
+    """Reads fragments.toml and files it includes, or their form cached by a previous run.
+
+    The cache is used only when the size, mtime and hash of fragments.toml
+    and the size and mtime of every included file are the ones it was made
+    from. Otherwise the files are parsed and, unless write_cache is False,
+    the cache and the index of included files are written again. With
+    select, the returned configuration may lack fragments that were not
+    selected, see read_selected_fragments.
+    """
+    fragments_path = os.path.join(working_dir_path, "fragments.toml")
+
+    if not os.path.isfile(fragments_path):
+        print("There is no fragments file at this location.")
+        return None
+
+    try:
+        with open(fragments_path, mode="rb") as f:
+            contents = f.read()
+            file_stat = os.fstat(f.fileno())
+
+        cache_path = os.path.join(working_dir_path, CONFIG_CACHE_PATH)
+        index_path = os.path.join(working_dir_path, CONFIG_INDEX_PATH)
+        key = (
+            CONFIG_CACHE_VERSION,
+            __version__,
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+            hashlib.sha256(contents).hexdigest(),
+        )
+
+        if select is not None:
+            index = read_config_cache(index_path, key)
+            if index is not None and index.files:
+                config, updated_index = read_selected_fragments(
+                    working_dir_path, contents, index, select
+                )
+                if write_cache and updated_index != index:
+                    write_config_cache(index_path, key, updated_index)
+                return config
+
+        cached = read_config_cache(cache_path, key)
+        if cached is not None:
+            included, config = cached
+            if included_files(working_dir_path, config.include) == included:
+                return config
+
+        import tomllib
+
+        data = tomllib.loads(contents.decode())
+        include = read_include_patterns(data)
+        included = included_files(working_dir_path, include)
+        index = ConfigIndex(include=include, fragments=list(data))
+        for path, file_stamp in included.items():
+            included_data = read_included_file(working_dir_path, path)
+            index.files[path] = (file_stamp, list(included_data))
+            merge_fragments_data(data, included_data)
+
+        config = parse_fragments_config(data)
+        config.include = include
+        if write_cache:
+            write_config_cache(cache_path, key, (included, config))
+            if include:
+                write_config_cache(index_path, key, index)
+        return config
+    except Exception:
+        print("Could not read fragments config file.")
+        return None
+
+
+@dataclass
+class ConfigIndex:
+    """Names of fragments defined in fragments.toml and in each file it includes.
+
+    files maps paths of included files to their size and mtime, and to the
+    fragments they defined when they had them.
+    """
+
+    include: list[str]
+    fragments: list[str]
+    files: dict[str, tuple[tuple[int, int], list[str]]] = field(default_factory=dict)
+
+
+def read_selected_fragments(
+    working_dir_path: str, contents: bytes, index: ConfigIndex, select: set[str]
+) -> tuple[FragmentsConfig, ConfigIndex]:
+    """Parses only the files defining selected fragments and returns them.
+
+    Included files that did not change since the index was made are parsed
+    only when they define a selected fragment, and fragments.toml only when
+    it does. Changed and new files are always parsed, because the fragments
+    they define are not known, and are returned in the updated index.
+    Dependencies on fragments that were not parsed are checked against the
+    names in the index.
+    """
+    import tomllib
+
+    data = {}
+    if select & set(index.fragments):
+        data = tomllib.loads(contents.decode())
+        read_include_patterns(data)
+
+    files = {}
+    for path, file_stamp in included_files(working_dir_path, index.include).items():
+        indexed = index.files.get(path)
+        if indexed is not None and indexed[0] == file_stamp:
+            if not select & set(indexed[1]):
+                files[path] = indexed
+                continue
+        included_data = read_included_file(working_dir_path, path)
+        files[path] = (file_stamp, list(included_data))
+        merge_fragments_data(data, included_data)
+
+    fragment_names = [*index.fragments]
+    for _, names in files.values():
+        fragment_names.extend(names)
+    if len(set(fragment_names)) != len(fragment_names):
+        raise ValueError("A fragment is defined more than once")
+
+    config = parse_fragments_config(data, set(fragment_names))
+    config.include = index.include
+    return config, dataclasses.replace(index, files=files)
+
+
+def read_include_patterns(data: dict) -> list[str]:
+    """Removes patterns of included files from parsed fragments.toml and returns them.
+
+    A table named include is a fragment, not a list of patterns.
+    """
+    include = data.get("include")
+    if include is None or isinstance(include, dict):
+        return []
+    del data["include"]
+    return read_patterns(include)
+
+
+def included_files(
+    working_dir_path: str, include: list[str]
+) -> dict[str, tuple[int, int]]:
+    """Returns size and mtime of files matching include patterns, in the order they are read.
+
+    Paths are relative to working_dir_path. Files matched by an earlier
+    pattern come first and files matched by the same pattern are sorted.
+    """
+    files = {}
+    for pattern in include:
+        paths = glob.glob(pattern, root_dir=working_dir_path, recursive=True)
+        for path in sorted(paths):
+            path = os.path.normpath(path)
+            if path == "fragments.toml" or path in files:
+                continue
+            try:
+                file_stat = os.stat(os.path.join(working_dir_path, path))
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(file_stat.st_mode):
+                files[path] = (file_stat.st_size, file_stat.st_mtime_ns)
+    return files
+
+
+def read_included_file(working_dir_path: str, path: str) -> dict:
+    import tomllib
+
+    with open(os.path.join(working_dir_path, path), mode="rb") as f:
+        data = tomllib.load(f)
+    if read_include_patterns(data):
+        raise ValueError(f"Included file {path} includes other files")
+    return data
+
+
+def merge_fragments_data(data: dict, included_data: dict) -> None:
+    for name, fragment in included_data.items():
+        if name in data:
+            raise ValueError(f"Fragment {name} is defined more than once")
+        data[name] = fragment
+
+
+def read_config_cache(cache_path: str, key: tuple):
+    """Returns the value cached under key, or None.
+
+    The key is stored as a line of JSON in front of the pickle, and compared
+    before anything is unpickled, so a cache that was not written for this
+    very fragments.toml is never loaded. Unpickling could run any code.
+    """
+    try:
+        with open(cache_path, mode="rb") as f:
+            if json.loads(f.readline(4096)) != list(key):
+                return None
+            return pickle.load(f)
+    except Exception:
+        # A missing cache or one written by an incompatible version.
+        return None
+
+
+def write_config_cache(cache_path: str, key: tuple, value) -> None:
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, mode="wb") as f:
+            f.write(json.dumps(key).encode() + b"\n")
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # The cache only saves time, a read-only repository works without it.
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def parse_fragments_config(
+    data: dict, fragment_names: set[str] | None = None
+) -> FragmentsConfig:
+    """Builds fragments from a parsed fragments.toml, keeping their order.
+
+    Dependencies are checked against fragment_names, when data holds only
+    some of the fragments. Raises an exception when the configuration is
+    invalid.
+    """
+    fragments = {}
+    if fragment_names is None:
+        fragment_names = set(data.keys())
+    for name in data:
+        targets = []
+        for target in data[name]["targets"]:
+            dir = None
+            actions = TargetActions()
+
+            if "dir" in target:
+                dir = target["dir"]
+
+            if "actions" in target:
+                target_actions = target["actions"]
+                if "before_apply" in target_actions:
+                    actions.before_apply = target_actions["before_apply"] or None
+
+                if "after_apply" in target_actions:
+                    actions.after_apply = target_actions["after_apply"] or None
+
+                if "before_fetch" in target_actions:
+                    actions.before_fetch = target_actions["before_fetch"] or None
+
+                if "after_fetch" in target_actions:
+                    actions.after_fetch = target_actions["after_fetch"] or None
+
+            mode = target.get("mode")
+            if mode is not None and mode not in MODES:
+                raise ValueError(f"Unknown target mode: {mode}")
+
+            # Patterns set on the fragment apply to targets without their own.
+            include = read_patterns(
+                target.get("include", data[name].get("include", []))
+            )
+            exclude = read_patterns(
+                target.get("exclude", data[name].get("exclude", []))
+            )
+            path_filter = None
+            if include or exclude:
+                path_filter = PathFilter(include=include, exclude=exclude)
+
+            targets.append(
+                Target(
+                    src=target["src"],
+                    dir=dir,
+                    actions=actions,
+                    mode=mode,
+                    link_files=target.get("link_files", False),
+                    swap=target.get("swap", False),
+                    mirror=target.get("mirror", False),
+                    path_filter=path_filter,
+                )
+            )
+
+        actions = FragmentActions()
+        if "actions" in data[name]:
+            data_actions = data[name]["actions"]
+            if "before_apply" in data_actions:
+                actions.before_apply = data_actions["before_apply"] or None
+
+            if "after_apply" in data_actions:
+                actions.after_apply = data_actions["after_apply"] or None
+
+            if "before_fetch" in data_actions:
+                actions.before_fetch = data_actions["before_fetch"] or None
+
+            if "after_fetch" in data_actions:
+                actions.after_fetch = data_actions["after_fetch"] or None
+
+        depends_on = data[name].get("depends_on", [])
+        for dependency in depends_on:
+            if dependency not in fragment_names:
+                raise ValueError(f"Unknown fragment dependency: {dependency}")
+
+        fragment = Fragment(
+            name=name, targets=targets, actions=actions, depends_on=depends_on
+        )
+        fragments[name] = fragment
+
+    return FragmentsConfig(fragments=fragments)
+
+
+def read_patterns(value) -> list[str]:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"Expected a list of glob patterns: {value}")
+    return value
+
+
+def mkdir(dir_path: str) -> None:
+    os.makedirs(dir_path, exist_ok=True)
+
+
+class DestinationLinkError(OSError):
+    """Raised when a confined destination leads through a symbolic link."""
+
+
+def check_not_link(path: str) -> None:
+    if os.path.islink(path):
+        raise DestinationLinkError(f'"{path}" is a symbolic link')
+
+
+def find_link(base: str, path: str) -> str | None:
+    """Returns the first symbolic link among path and its parents below base."""
+    rel_path = os.path.relpath(path, base)
+    if rel_path == os.curdir or rel_path.startswith(os.pardir):
+        return None
+
+    for part in rel_path.split(os.sep):
+        base = os.path.join(base, part)
+        if os.path.islink(base):
+            return base
+    return None
+
+
+def resolve_in_root(root: str, path: str) -> str:
+    """Places path under root, resolving symbolic links in its directories inside root.
+
+    Links are followed as if root was the root directory, so absolute links
+    of an image, like /var/run -> /run, and ".." lead to paths inside of it,
+    never to the host. The last component of path is not resolved.
+    """
+    *dir_parts, name = path.strip(os.sep).split(os.sep)
+    pending = list(reversed(dir_parts))
+    resolved = []
+    links = 0
+    while pending:
+        part = pending.pop()
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+
+        part_path = os.path.join(root, *resolved, part)
+        if not os.path.islink(part_path):
+            resolved.append(part)
+            continue
+
+        links += 1
+        if links > 40:
+            raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+        link = os.readlink(part_path)
+        if link.startswith(os.sep):
+            resolved = []
+        pending.extend(reversed(link.split(os.sep)))
+
+    return os.path.join(root, *resolved, name)
+
+
+def copy(
+    src: str,
+    dst: str,
+    options: Options,
+    known_files: dict[str, dict] | None = None,
+    out: TextIO | None = None,
+    swap: bool = False,
+    mirror: bool = False,
+    path_filter: PathFilter | None = None,
+) -> CopyStats | None:
+    """Copies src file or directory to dst and returns what was copied.
+
+    known_files is the state recorded for this target by the previous run,
+    keyed by paths relative to the target. It lets --checksum treat files
+    that were not modified since then as equal without reading them.
+    With swap, a directory is copied into a staging directory first, which
+    then replaces dst in a single step. With mirror, files and directories
+    in dst that are not in src are removed. path_filter limits which files
+    of a directory are copied, and protects the files it leaves out from
+    being removed.
+    """
+    print(f'  Copying "{src}" to "{dst}"', end="", file=out)
+
+    stats = CopyStats()
+    known_files = known_files or {}
+
+    if os.path.isdir(src) and swap:
+        swap_tree(src, dst, options, stats, known_files, mirror, path_filter)
+    elif os.path.isdir(src):
+        copy_tree(src, dst, options, stats, known_files, path_filter)
+        if mirror:
+            stats.removed.extend(find_extras(dst, stats.dirs, stats.files, path_filter))
+            if options.backup is not None:
+                options.backup.save_tree(dst, stats.removed)
+            remove_paths(dst, stats.removed)
+        # Failed files are kept in files until now, so mirror doesn't remove them.
+        stats.files = [f for f in stats.files if f not in stats.failed]
+    elif os.path.isfile(src):
+        if os.path.isdir(dst) and not (options.confined and os.path.islink(dst)):
+            dst = os.path.join(dst, os.path.basename(src))
+        try:
+            method = copy_file(src, dst, options, known_files.get("."))
+        except DestinationLinkError:
+            raise
+        except OSError as e:
+            stats.failed["."] = e.strerror or str(e)
+        else:
+            if method is not None:
+                stats.copied += 1
+                stats.methods[method] += 1
+            else:
+                stats.skipped += 1
+            stats.files.append(".")
+    else:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return None
+
+    counts = []
+    if options.incremental:
+        counts.append(f"copied {stats.copied}, skipped {stats.skipped}")
+    if mirror:
+        counts.append(f"removed {len(stats.removed)}")
+    if stats.failed:
+        counts.append(f"failed {len(stats.failed)}")
+
+    status = STATUS_FAIL if stats.failed else STATUS_DONE
+    if counts:
+        print(f" [{status}] ({', '.join(counts)}).", file=out)
+    else:
+        print(f" [{status}].", file=out)
+
+    for rel_path in stats.removed:
+        print(f'    Removed "{os.path.join(dst, rel_path)}".', file=out)
+    print_failed(src, stats.failed, out)
+
+    return stats
+
+
+def link(
+    src: str,
+    dst: str,
+    mode: str,
+    link_files: bool,
+    out: TextIO | None = None,
+    path_filter: PathFilter | None = None,
+    backup: "Backup | None" = None,
+    confined: bool = False,
+) -> CopyStats | None:
+    """Links dst to src instead of copying it, stow-style.
+
+    Directories are linked as a whole with symlinks, unless link_files is set.
+    Hard links can only point to files, so in hardlink mode and with link_files
+    the directory structure is created and every file in it is linked.
+    A directory with a path_filter is linked file by file as well, because
+    a link to the whole directory would expose the files left out.
+    Links that are already correct are left untouched. When confined,
+    directories of dst reached through symbolic links are not linked into.
+    """
+    print(f'  Linking "{src}" to "{dst}"', end="", file=out)
+
+    stats = CopyStats()
+
+    if os.path.isdir(src) and (
+        mode == "hardlink" or link_files or path_filter is not None
+    ):
+        if os.path.islink(dst):
+            # dst links to a directory, most likely the one in the repository.
+            # Linking files inside of it would replace the files it points to.
+            if backup is not None:
+                backup.save(dst)
+            os.unlink(dst)
+
+        dirs, files = walk_tree(src, path_filter)
+        for rel_dir in dirs:
+            if confined:
+                check_not_link(os.path.normpath(os.path.join(dst, rel_dir)))
+            mkdir(os.path.join(dst, rel_dir))
+        for rel_file in files:
+            linked = link_file(
+                os.path.join(src, rel_file), os.path.join(dst, rel_file), mode, backup
+            )
+            if linked:
+                stats.copied += 1
+            else:
+                stats.skipped += 1
+        stats.files.extend(files)
+    elif os.path.exists(src):
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            print(f" [{STATUS_FAIL}] (destination is a directory).", file=out)
+            return None
+
+        if link_file(src, dst, mode, backup):
+            stats.copied += 1
+        else:
+            stats.skipped += 1
+
+        if os.path.isdir(src):
+            stats.files.extend(walk_tree(src)[1])
+        else:
+            stats.files.append(".")
+    else:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return None
+
+    print(
+        f" [{STATUS_DONE}] (linked {stats.copied}, skipped {stats.skipped}).",
+        file=out,
+    )
+
+    return stats
+
+
+def link_file(src: str, dst: str, mode: str, backup: "Backup | None" = None) -> bool:
+    """Points dst to src, replacing whatever dst was. Returns whether dst changed."""
+    if link_is_current(src, dst, mode):
+        return False
+
+    if backup is not None:
+        backup.save(dst)
+
+    # The link is created next to dst and renamed over it, so dst is replaced
+    # in a single step and never goes missing.
+    tmp_path = temp_sibling(dst)
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), tmp_path)
+    else:
+        os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return True
+
+
+def link_is_current(src: str, dst: str, mode: str) -> bool:
+    if mode == "symlink":
+        return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    return (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino)
+
+
+def temp_sibling(path: str) -> str:
+    dir_path, name = os.path.split(path)
+    return os.path.join(dir_path, f".{name}.nastrajacz-{os.urandom(4).hex()}")
+
+
+def plan_copy(
+    src: str,
+    dst: str,
+    options: Options,
+    known_files: dict[str, dict] | None = None,
+    out: TextIO | None = None,
+    mirror: bool = False,
+    path_filter: PathFilter | None = None,
+) -> Counter | None:
+    """Prints what copy would do with the same arguments, without writing anything.
+
+    Only metadata of files is read. Files are compared by size and modification
+    time, and with --checksum by the state recorded for them, so a file with
+    unchanged metadata but different contents is reported as skipped.
+    """
+    print(f'  Would copy "{src}" to "{dst}"', end="", file=out)
+
+    plan = Counter()
+    lines = []
+    known_files = known_files or {}
+
+    if os.path.isdir(src):
+        dirs, files = walk_tree(src, path_filter)
+        for rel_file in sorted(files):
+            plan_file(
+                os.path.join(src, rel_file),
+                os.path.join(dst, rel_file),
+                options,
+                known_files.get(rel_file),
+                plan,
+                lines,
+            )
+        if mirror and os.path.isdir(dst):
+            for rel_path in find_extras(dst, dirs, files, path_filter):
+                plan["remove"] += 1
+                lines.append(f'Remove "{os.path.join(dst, rel_path)}".')
+    elif os.path.isfile(src):
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        plan_file(src, dst, options, known_files.get("."), plan, lines)
+    else:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return None
+
+    print_plan(plan, lines, out)
+    return plan
+
+
+def plan_file(
+    src: str,
+    dst: str,
+    options: Options,
+    known: dict | None,
+    plan: Counter,
+    lines: list[str],
+) -> None:
+    try:
+        src_stat = os.stat(src)
+    except OSError as e:
+        # Like copy, a file that can't be read, e.g. a dangling symbolic link,
+        # is reported and doesn't stop the rest of the plan.
+        plan["fail"] += 1
+        lines.append(f'Cannot copy "{src}" ({e.strerror or e}).')
+        return
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        dst_stat = None
+
+    if dst_stat is None:
+        action = "create"
+    elif (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        action = "skip"
+    elif not options.incremental or src_stat.st_size != dst_stat.st_size:
+        action = "overwrite"
+    elif options.checksum and known is not None:
+        unchanged = matches_state(src_stat, known) and matches_state(dst_stat, known)
+        action = "skip" if unchanged else "overwrite"
+    elif src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        action = "skip"
+    else:
+        action = "overwrite"
+
+    plan[action] += 1
+    if action != "skip":
+        plan["bytes"] += src_stat.st_size
+        lines.append(f'{action.capitalize()} "{dst}" ({src_stat.st_size} bytes).')
+
+
+def plan_link(
+    src: str,
+    dst: str,
+    mode: str,
+    link_files: bool,
+    out: TextIO | None = None,
+    path_filter: PathFilter | None = None,
+) -> Counter | None:
+    """Prints what link would do with the same arguments, without writing anything."""
+    print(f'  Would link "{src}" to "{dst}"', end="", file=out)
+
+    if os.path.isdir(src) and (
+        mode == "hardlink" or link_files or path_filter is not None
+    ):
+        files = walk_tree(src, path_filter)[1]
+        pairs = [(os.path.join(src, f), os.path.join(dst, f)) for f in files]
+    elif os.path.exists(src):
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            print(f" [{STATUS_FAIL}] (destination is a directory).", file=out)
+            return None
+        pairs = [(src, dst)]
+    else:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return None
+
+    plan = Counter()
+    lines = []
+    for src_path, dst_path in pairs:
+        if link_is_current(src_path, dst_path, mode):
+            plan["skip"] += 1
+        elif os.path.lexists(dst_path):
+            plan["overwrite"] += 1
+            lines.append(f'Overwrite "{dst_path}" with a link.')
+        else:
+            plan["create"] += 1
+            lines.append(f'Create "{dst_path}" as a link.')
+
+    print_plan(plan, lines, out)
+    return plan
+
+
+def print_plan(plan: Counter, lines: list[str], out: TextIO | None) -> None:
+    print(f" ({format_plan(plan)}).", file=out)
+    for line in lines:
+        print(f"    {line}", file=out)
+
+
+def format_plan(plan: Counter) -> str:
+    text = (
+        f"create {plan['create']}, overwrite {plan['overwrite']}, "
+        f"skip {plan['skip']}, remove {plan['remove']}, {plan['bytes']} bytes"
+    )
+    if plan["fail"]:
+        text += f", fail {plan['fail']}"
+    return text
+
+
+def copy_tree(
+    src: str,
+    dst: str,
+    options: Options,
+    stats: CopyStats,
+    known_files: dict[str, dict],
+    path_filter: PathFilter | None = None,
+) -> None:
+    import shutil
+
+    dirs, files = walk_tree(src, path_filter)
+    stats.files.extend(files)
+    stats.dirs.extend(dirs)
+
+    # Directories are created up front so that files can be copied in any order.
+    # Their metadata is copied afterwards, deepest first, because writing files
+    # into a directory changes its modification time.
+    touched_dirs = set()
+    for rel_dir in dirs:
+        dst_dir = os.path.join(dst, rel_dir)
+        if options.confined:
+            check_not_link(os.path.normpath(dst_dir))
+        if not os.path.isdir(dst_dir):
+            os.makedirs(dst_dir)
+            touched_dirs.add(rel_dir)
+
+    def copy_one(rel_file: str) -> str | OSError | None:
+        try:
+            return copy_file(
+                os.path.join(src, rel_file),
+                os.path.join(dst, rel_file),
+                options,
+                known_files.get(rel_file),
+            )
+        except DestinationLinkError:
+            raise
+        except OSError as e:
+            # Like with shutil.copytree, a file that can't be copied, e.g.
+            # a dangling symbolic link, doesn't stop the rest of the tree.
+            return e
+
+    if options.jobs > 1 and len(files) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=options.jobs) as executor:
+            results = list(executor.map(copy_one, files))
+    else:
+        results = list(map(copy_one, files))
+
+    for rel_file, method in zip(files, results):
+        if isinstance(method, OSError):
+            stats.failed[rel_file] = method.strerror or str(method)
+        elif method is not None:
+            stats.copied += 1
+            stats.methods[method] += 1
+            touched_dirs.add(os.path.dirname(rel_file) or ".")
+        else:
+            stats.skipped += 1
+
+    for rel_dir in reversed(dirs):
+        if not options.incremental or rel_dir in touched_dirs:
+            shutil.copystat(os.path.join(src, rel_dir), os.path.join(dst, rel_dir))
+
+
+def print_failed(src: str, failed: dict[str, str], out: TextIO | None = None) -> None:
+    for rel_file, error in sorted(failed.items()):
+        path = os.path.normpath(os.path.join(src, rel_file))
+        print(f'    Failed to copy "{path}" ({error}).', file=out)
+
+
+def copy_file(
+    src: str, dst: str, options: Options, known: dict | None = None
+) -> str | None:
+    """Copies a single file unless --incremental finds it unchanged.
+
+    Returns the name of the method used to copy the file, or None when it
+    was not copied. Safe to call from worker threads.
+    """
+    if options.incremental and files_equal(src, dst, options, known):
+        return None
+
+    try:
+        if os.path.samefile(src, dst):
+            # dst links to src, e.g. a target applied with the symlink mode.
+            return None
+    except FileNotFoundError:
+        pass
+
+    if options.backup is not None:
+        options.backup.save(dst)
+
+    return put_file(src, dst, options)
+
+
+def put_file(src: str, dst: str, options: Options) -> str:
+    """Writes src to dst, through a temporary file with --atomic."""
+    if not options.atomic:
+        return write_file(src, dst, options)
+
+    # Readers of dst see either the old or the new file, never a partially
+    # written one, because the new file replaces dst only when it is complete.
+    tmp_path = temp_sibling(dst)
+    try:
+        method = write_file(src, tmp_path, options)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return method
+
+
+def copy_to_roots(
+    src: str,
+    destinations: str,
+    dsts: list[str],
+    options: Options,
+    known_files: list[dict[str, dict]],
+    out: TextIO | None = None,
+    mirror: bool = False,
+    path_filter: PathFilter | None = None,
+) -> list[CopyStats | None]:
+    """Copies src file or directory to each of dsts, reading every file once.
+
+    Works like copy for every destination, with src walked only once and
+    the contents of each file read once and written to every destination
+    that needs it. destinations describes dsts in the output.
+    """
+    import shutil
+
+    print(f'  Copying "{src}" to {destinations}', end="", file=out)
+
+    all_stats = [CopyStats() for _ in dsts]
+
+    if os.path.isdir(src):
+        dirs, files = walk_tree(src, path_filter)
+        for dst, stats in zip(dsts, all_stats):
+            stats.files.extend(files)
+            stats.dirs.extend(dirs)
+            for rel_dir in dirs:
+                if options.confined:
+                    check_not_link(os.path.normpath(os.path.join(dst, rel_dir)))
+                mkdir(os.path.join(dst, rel_dir))
+
+        def copy_one(rel_file: str) -> list[str | None] | OSError:
+            try:
+                return copy_file_to_roots(
+                    os.path.join(src, rel_file),
+                    [os.path.join(dst, rel_file) for dst in dsts],
+                    options,
+                    [known.get(rel_file) for known in known_files],
+                )
+            except DestinationLinkError:
+                raise
+            except OSError as e:
+                return e
+
+        if options.jobs > 1 and len(files) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=options.jobs) as executor:
+                results = list(executor.map(copy_one, files))
+        else:
+            results = list(map(copy_one, files))
+
+        failed = {}
+        for rel_file, methods in zip(files, results):
+            if isinstance(methods, OSError):
+                failed[rel_file] = methods.strerror or str(methods)
+                continue
+            for stats, method in zip(all_stats, methods):
+                if method is not None:
+                    stats.copied += 1
+                    stats.methods[method] += 1
+                else:
+                    stats.skipped += 1
+
+        for dst, stats in zip(dsts, all_stats):
+            for rel_dir in reversed(dirs):
+                shutil.copystat(os.path.join(src, rel_dir), os.path.join(dst, rel_dir))
+            if mirror:
+                stats.removed.extend(find_extras(dst, dirs, files, path_filter))
+                if options.backup is not None:
+                    options.backup.save_tree(dst, stats.removed)
+                remove_paths(dst, stats.removed)
+            stats.files = [f for f in stats.files if f not in failed]
+            stats.failed = failed
+    elif os.path.isfile(src):
+        dsts = [
+            (
+                os.path.join(dst, os.path.basename(src))
+                if os.path.isdir(dst) and not (options.confined and os.path.islink(dst))
+                else dst
+            )
+            for dst in dsts
+        ]
+        try:
+            methods = copy_file_to_roots(
+                src, dsts, options, [known.get(".") for known in known_files]
+            )
+        except DestinationLinkError:
+            raise
+        except OSError as e:
+            for stats in all_stats:
+                stats.failed["."] = e.strerror or str(e)
+            methods = []
+        for stats, method in zip(all_stats, methods):
+            if method is not None:
+                stats.copied += 1
+                stats.methods[method] += 1
+            else:
+                stats.skipped += 1
+            stats.files.append(".")
+    else:
+        print(f" [{STATUS_SKIP}].", file=out)
+        return [None for _ in dsts]
+
+    counts = []
+    if options.incremental:
+        copied = sum(stats.copied for stats in all_stats)
+        skipped = sum(stats.skipped for stats in all_stats)
+        counts.append(f"copied {copied}, skipped {skipped}")
+    if mirror:
+        counts.append(f"removed {sum(len(stats.removed) for stats in all_stats)}")
+    failed = all_stats[0].failed if all_stats else {}
+    if failed:
+        counts.append(f"failed {len(failed)}")
+
+    status = STATUS_FAIL if failed else STATUS_DONE
+    if counts:
+        print(f" [{status}] ({', '.join(counts)}).", file=out)
+    else:
+        print(f" [{status}].", file=out)
+
+    for dst, stats in zip(dsts, all_stats):
+        for rel_path in stats.removed:
+            print(f'    Removed "{os.path.join(dst, rel_path)}".', file=out)
+    print_failed(src, failed, out)
+
+    return all_stats
+
+
+def copy_file_to_roots(
+    src: str, dsts: list[str], options: Options, knowns: list[dict | None]
+) -> list[str | None]:
+    """Copies a single file to every dst that --incremental doesn't find unchanged.
+
+    Returns the method used for each dst, or None where it was not copied.
+    Safe to call from worker threads.
+    """
+    methods = [None] * len(dsts)
+    needed = []
+    for i, (dst, known) in enumerate(zip(dsts, knowns)):
+        if options.incremental and files_equal(src, dst, options, known):
+            continue
+        try:
+            if os.path.samefile(src, dst):
+                continue
+        except FileNotFoundError:
+            pass
+        if options.backup is not None:
+            options.backup.save(dst)
+        needed.append(i)
+
+    if len(needed) > 1 and not options.zero_copy:
+        write_file_to_many(src, [dsts[i] for i in needed], options)
+        for i in needed:
+            methods[i] = "fan-out"
+    else:
+        # Kernel copies don't pass data through this process, so there is
+        # nothing to gain from reading the file only once.
+        for i in needed:
+            methods[i] = put_file(src, dsts[i], options)
+    return methods
+
+
+def write_file_to_many(src: str, dsts: list[str], options: Options) -> None:
+    """Writes src to all of dsts, reading it once, through temporary files with --atomic."""
+    import shutil
+
+    paths = [temp_sibling(dst) if options.atomic else dst for dst in dsts]
+    try:
+        with contextlib.ExitStack() as stack:
+            fsrc = stack.enter_context(open(src, mode="rb"))
+            fdsts = [stack.enter_context(open(path, mode="wb")) for path in paths]
+            while chunk := fsrc.read(1024 * 1024):
+                for fdst in fdsts:
+                    fdst.write(chunk)
+
+        for path in paths:
+            shutil.copystat(src, path)
+        if options.atomic:
+            for path, dst in zip(paths, dsts):
+                os.replace(path, dst)
+    except BaseException:
+        if options.atomic:
+            for path in paths:
+                if os.path.lexists(path):
+                    os.unlink(path)
+        raise
+
+
+def write_file(src: str, dst: str, options: Options) -> str:
+    import shutil
+
+    if options.zero_copy:
+        method = copy_file_data(src, dst)
+        shutil.copystat(src, dst)
+        return method
+
+    shutil.copy2(src, dst)
+    return "copy2"
+
+
+def swap_tree(
+    src: str,
+    dst: str,
+    options: Options,
+    stats: CopyStats,
+    known_files: dict[str, dict],
+    mirror: bool = False,
+    path_filter: PathFilter | None = None,
+) -> None:
+    """Copies src into a staging directory next to dst and swaps it with dst.
+
+    The staging directory starts as a hard linked clone of dst, so files
+    present only in dst are kept like with copy_tree, and files are written
+    to it atomically so the originals shared with dst are never modified.
+    With mirror the staging directory starts empty instead, unless
+    path_filter protects some files of dst, which are then kept.
+    """
+    import shutil
+
+    stage = temp_sibling(dst)
+    cloned = os.path.isdir(dst) and (not mirror or path_filter is not None)
+    stage_options = dataclasses.replace(options, atomic=True)
+    if options.backup is not None:
+        stage_options.backup = options.backup.relocated(stage, dst)
+    try:
+        if cloned:
+            clone_tree(dst, stage)
+        copy_tree(src, stage, stage_options, stats, known_files, path_filter)
+        if stats.failed:
+            # dst is replaced as a whole or not at all, so it is left as it was.
+            shutil.rmtree(stage)
+            stats.copied = stats.skipped = 0
+            stats.methods.clear()
+            stats.written.clear()
+            stats.files.clear()
+            return
+        if mirror and os.path.isdir(dst):
+            stats.removed.extend(find_extras(dst, stats.dirs, stats.files, path_filter))
+            if options.backup is not None:
+                options.backup.save_tree(dst, stats.removed)
+            if cloned:
+                remove_paths(stage, stats.removed)
+
+        if not os.path.lexists(dst):
+            os.rename(stage, dst)
+        elif exchange_paths(stage, dst):
+            shutil.rmtree(stage)
+        else:
+            # Without renameat2 there is a short moment in which dst does not exist.
+            old = temp_sibling(dst)
+            os.rename(dst, old)
+            os.rename(stage, dst)
+            shutil.rmtree(old)
+    except BaseException:
+        shutil.rmtree(stage, ignore_errors=True)
+        raise
+
+
+def find_extras(
+    root: str,
+    dirs: list[str],
+    files: list[str],
+    path_filter: PathFilter | None = None,
+) -> list[str]:
+    """Returns paths under root, relative to it, that are not in dirs or files.
+
+    Directories missing from dirs are returned as a whole, without looking
+    inside of them. Paths left out by path_filter are never returned, so
+    with include patterns such directories are looked into instead.
+    """
+    dir_set = set(dirs)
+    file_set = set(files)
+    extras = []
+
+    def scan(rel_dir: str) -> None:
+        with os.scandir(os.path.join(root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.normpath(os.path.join(rel_dir, entry.name))
+                if path_filter is not None and path_filter.excludes(rel_path):
+                    continue
+                if rel_path in dir_set and entry.is_dir():
+                    scan(rel_path)
+                elif rel_path in file_set:
+                    continue
+                elif path_filter is None or path_filter.includes(rel_path):
+                    extras.append(rel_path)
+                elif entry.is_dir(follow_symlinks=False):
+                    scan(rel_path)
+
+    scan(".")
+    return sorted(extras)
+
+
+def remove_paths(root: str, rel_paths: list[str]) -> None:
+    import shutil
+
+    for rel_path in rel_paths:
+        path = os.path.join(root, rel_path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
+
+def clone_tree(src: str, dst: str) -> None:
+    """Recreates src at dst with hard links instead of copies of its files."""
+    import shutil
+
+    for dir_path, dir_names, file_names in os.walk(src):
+        rel_dir = os.path.relpath(dir_path, src)
+        dst_dir = os.path.normpath(os.path.join(dst, rel_dir))
+        os.makedirs(dst_dir, exist_ok=True)
+        shutil.copystat(dir_path, dst_dir)
+
+        for name in dir_names + file_names:
+            path = os.path.join(dir_path, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(dst_dir, name))
+            elif name in file_names:
+                try:
+                    os.link(path, os.path.join(dst_dir, name))
+                except OSError:
+                    shutil.copy2(path, os.path.join(dst_dir, name))
+
+
+def exchange_paths(a: str, b: str) -> bool:
+    """Atomically swaps two paths with renameat2(2). Returns False when unsupported."""
+    import ctypes
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+
+    result = renameat2(
+        AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE
+    )
+    return result == 0
+
+
+def copy_file_data(src: str, dst: str) -> str:
+    """Copies contents of src to dst, keeping the data inside the kernel if possible.
+
+    Tries a reflink first, which on copy-on-write filesystems (btrfs, XFS)
+    shares data blocks instead of copying them, then copy_file_range and
+    sendfile, and falls back to copying through userspace buffers.
+    Returns the name of the method that was used.
+    """
+    import shutil
+
+    with open(src, mode="rb") as fsrc, open(dst, mode="wb") as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return "reflink"
+            except OSError:
+                pass
+
+        size = os.fstat(src_fd).st_size
+
+        for method, copy_range in [
+            ("copy_file_range", getattr(os, "copy_file_range", None)),
+            ("sendfile", sendfile_range if hasattr(os, "sendfile") else None),
+        ]:
+            if copy_range is None:
+                continue
+            try:
+                offset = 0
+                while True:
+                    copied = copy_range(
+                        src_fd, dst_fd, KERNEL_COPY_CHUNK, offset, offset
+                    )
+                    if copied == 0:
+                        break
+                    offset += copied
+                # Some filesystems (e.g. procfs) report no data at all,
+                # reading them the usual way is the only way to copy them.
+                if offset == 0 and size > 0:
+                    continue
+                return method
+            except OSError:
+                os.ftruncate(dst_fd, 0)
+
+        os.lseek(dst_fd, 0, os.SEEK_SET)
+        shutil.copyfileobj(fsrc, fdst)
+        return "userspace"
+
+
+def sendfile_range(
+    src_fd: int, dst_fd: int, count: int, src_offset: int, dst_offset: int
+) -> int:
+    # Same signature as os.copy_file_range. sendfile writes at the current
+    # position of dst_fd, which advances by exactly what was sent before.
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, src_offset, count)
+
+
+def walk_tree(
+    root: str, path_filter: PathFilter | None = None
+) -> tuple[list[str], list[str]]:
+    """Returns directories and files found under root, as paths relative to it.
+
+    Directories are listed parents first and include root itself as ".".
+    Symbolic links are followed, the same way shutil.copytree does it.
+    Excluded directories are pruned before they are entered, so nothing
+    inside of them is ever listed or stat-ed. With include patterns only
+    directories leading to an included file are returned.
+    """
+    dirs = []
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root, followlinks=True):
+        rel_dir = os.path.relpath(dir_path, root)
+        dirs.append(rel_dir)
+        if path_filter is not None:
+            dir_names[:] = [
+                dir_name
+                for dir_name in dir_names
+                if not path_filter.excludes(
+                    os.path.normpath(os.path.join(rel_dir, dir_name))
+                )
+            ]
+        for file_name in file_names:
+            rel_file = os.path.normpath(os.path.join(rel_dir, file_name))
+            if path_filter is None or path_filter.accepts(rel_file):
+                files.append(rel_file)
+
+    if path_filter is not None and path_filter.include:
+        needed = {"."}
+        for rel_file in files:
+            rel_dir = os.path.dirname(rel_file)
+            while rel_dir and rel_dir not in needed:
+                needed.add(rel_dir)
+                rel_dir = os.path.dirname(rel_dir)
+        dirs = [rel_dir for rel_dir in dirs if rel_dir in needed]
+
+    return dirs, files
+
+
+def files_equal(
+    src: str, dst: str, options: Options, known: dict | None = None
+) -> bool:
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    src_stat = os.stat(src)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+
+    if options.checksum:
+        # Both sides still look exactly like they did when the previous run
+        # recorded them, so their contents are equal as well.
+        if known is not None and matches_state(src_stat, known):
+            if matches_state(dst_stat, known):
+                return True
+        return same_contents(src, dst)
+
+    return src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def same_contents(a: str, b: str, chunk_size: int = 1024 * 1024) -> bool:
+    with open(a, mode="rb") as fa, open(b, mode="rb") as fb:
+        while True:
+            chunk_a = fa.read(chunk_size)
+            chunk_b = fb.read(chunk_size)
+            if chunk_a != chunk_b:
+                return False
+            if not chunk_a:
+                return True
+
+
+def state_dir() -> str:
+    base = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+    return os.path.join(base, "nastrajacz")
+
+
+def host_state_path() -> str:
+    # One host may manage several repositories, so the host-side copy of
+    # the state is keyed by the absolute path of the repository.
+    repo_id = hashlib.sha256(os.path.abspath(".").encode()).hexdigest()[:16]
+    return os.path.join(state_dir(), "repos", f"{repo_id}.json")
+
+
+def read_state() -> dict:
+    for path in [STATE_PATH, host_state_path()]:
+        try:
+            with open(path, mode="rb") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                return state
+        except (OSError, ValueError):
+            continue
+
+    return {"version": STATE_VERSION, "fragments": {}}
+
+
+def write_state(state: dict) -> None:
+    state["repository"] = os.path.abspath(".")
+    for path in [STATE_PATH, host_state_path()]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, mode="w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+def state_targets(state: dict, fragment_name: str) -> dict[str, dict]:
+    return state["fragments"].get(fragment_name, {}).get("targets", {})
+
+
+def update_state(
+    state: dict, fragment_name: str, operation: str, targets: dict[str, dict]
+) -> None:
+    state["fragments"][fragment_name] = {
+        "operation": operation,
+        "time": time.time(),
+        "targets": targets,
+    }
+
+
+def record_target_state(
+    path: str, rel_files: list[str], known_files: dict[str, dict]
+) -> dict:
+    """Records size, mtime, mode and content hash of every copied file.
+
+    Hashes of files whose size and mtime match the previous state are reused,
+    so only files that actually changed are read.
+    """
+    files = {}
+    for rel_file in rel_files:
+        file_path = path if rel_file == "." else os.path.join(path, rel_file)
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+
+        known = known_files.get(rel_file)
+        if known is not None and matches_state(file_stat, known):
+            file_hash = known["hash"]
+        else:
+            file_hash = hash_file(file_path)
+
+        files[rel_file] = {
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+            "mode": stat.S_IMODE(file_stat.st_mode),
+            "hash": file_hash,
+        }
+
+    return {"path": os.path.abspath(path), "files": files}
+
+
+def matches_state(file_stat: os.stat_result, known: dict) -> bool:
+    return (
+        file_stat.st_size == known["size"]
+        and file_stat.st_mtime_ns == known["mtime_ns"]
+    )
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def new_run_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(2).hex()}"
+
+
+@dataclass
+class Backup:
+    """Previous versions of files replaced by an apply.
+
+    Contents go to a content-addressed store shared by all runs, so a
+    version that was saved before is not stored again, and each run lists
+    the versions it saved in its own index. Files that did not exist are
+    listed without a hash, so that restoring the run removes them.
+    """
+
+    run_id: str
+    files: dict[str, dict] = field(default_factory=dict)
+    known_hashes: dict[str, dict] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    relocation: tuple[str, str] | None = None
+
+    def learn_hashes(self, state: dict) -> None:
+        """Remembers hashes of files written by the previous apply."""
+        for fragment_state in state["fragments"].values():
+            if fragment_state.get("operation") != "apply":
+                continue
+            for target_state in fragment_state["targets"].values():
+                for rel_file, known in target_state["files"].items():
+                    path = target_state["path"]
+                    if rel_file != ".":
+                        path = os.path.join(path, rel_file)
+                    self.known_hashes[os.path.abspath(path)] = known
+
+    def relocated(self, stage: str, dst: str) -> "Backup":
+        """Returns a view of the backup that saves files in stage as files in dst.
+
+        A staging directory is either empty or a hard linked clone of dst,
+        so the previous version of a staged file is always the one in dst.
+        """
+        return dataclasses.replace(self, relocation=(stage, dst))
+
+    def save(self, path: str) -> None:
+        """Saves the current version of path, unless this run saved it already."""
+        if self.relocation is not None:
+            stage, dst = self.relocation
+            path = os.path.join(dst, os.path.relpath(path, stage))
+        path = os.path.abspath(path)
+
+        with self.lock:
+            if path in self.files:
+                return
+            # Claimed right away, so that other threads don't save it as well.
+            self.files[path] = {}
+
+        try:
+            path_stat = os.lstat(path)
+        except FileNotFoundError:
+            self.files[path] = {"hash": None}
+            return
+
+        if stat.S_ISLNK(path_stat.st_mode):
+            self.files[path] = {"link": os.readlink(path)}
+        elif stat.S_ISREG(path_stat.st_mode):
+            self.files[path] = {
+                "hash": self.stored_hash(path, path_stat) or self.store(path),
+                "mode": stat.S_IMODE(path_stat.st_mode),
+                "mtime_ns": path_stat.st_mtime_ns,
+            }
+        else:
+            self.files[path] = {"hash": None}
+
+    def save_tree(self, root: str, rel_paths: list[str]) -> None:
+        """Saves paths relative to root, with all files of directories among them."""
+        for rel_path in rel_paths:
+            path = os.path.join(root, rel_path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                for rel_file in walk_tree(path)[1]:
+                    self.save(os.path.join(path, rel_file))
+            else:
+                self.save(path)
+
+    def stored_hash(self, path: str, path_stat: os.stat_result) -> str | None:
+        """Returns the hash of a file unchanged since the previous apply, if stored."""
+        known = self.known_hashes.get(path)
+        if known is None or not matches_state(path_stat, known):
+            return None
+        if not os.path.exists(object_path(known["hash"])):
+            return None
+        return known["hash"]
+
+    def store(self, path: str) -> str:
+        """Adds contents of path to the store and returns their hash."""
+        # The file is hashed while it is copied into the store, so it is read
+        # only once, and the copy is dropped if the store already has it.
+        objects_dir = os.path.join(state_dir(), "objects")
+        os.makedirs(objects_dir, mode=0o700, exist_ok=True)
+        tmp_path = os.path.join(objects_dir, f".tmp-{os.urandom(8).hex()}")
+        h = hashlib.sha256()
+        try:
+            with open(path, mode="rb") as fsrc, open(tmp_path, mode="wb") as fdst:
+                while chunk := fsrc.read(1024 * 1024):
+                    h.update(chunk)
+                    fdst.write(chunk)
+
+            file_hash = h.hexdigest()
+            stored_path = object_path(file_hash)
+            if os.path.exists(stored_path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(stored_path), mode=0o700, exist_ok=True)
+                os.replace(tmp_path, stored_path)
+        except BaseException:
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return file_hash
+
+    def write_index(self) -> None:
+        index_path = run_index_path(self.run_id)
+        os.makedirs(os.path.dirname(index_path), mode=0o700, exist_ok=True)
+        index = {
+            "id": self.run_id,
+            "time": time.time(),
+            "repository": os.path.abspath("."),
+            # A file whose save failed was not replaced, and an empty entry
+            # would make rollback remove it.
+            "files": {path: entry for path, entry in self.files.items() if entry},
+        }
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, mode="w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+
+
+def object_path(file_hash: str) -> str:
+    return os.path.join(state_dir(), "objects", file_hash[:2], file_hash[2:])
+
+
+def run_index_path(run_id: str) -> str:
+    return os.path.join(state_dir(), "runs", f"{run_id}.json")
+
+
+def read_run_index(run_id: str | None) -> dict | None:
+    """Reads the index of run_id, or of the latest run applied from this repository."""
+    if run_id is not None:
+        try:
+            with open(run_index_path(run_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    try:
+        index_names = os.listdir(os.path.join(state_dir(), "runs"))
+    except FileNotFoundError:
+        return None
+
+    # Run ids start with the time of the run, so the names sort chronologically.
+    repository = os.path.abspath(".")
+    for index_name in sorted(index_names, reverse=True):
+        if not index_name.endswith(".json"):
+            continue
+        with open(os.path.join(state_dir(), "runs", index_name)) as f:
+            index = json.load(f)
+        if index["repository"] == repository:
+            return index
+    return None
+
+
+def rollback_run(run_id: str | None) -> int:
+    """Restores files saved by a run to the versions they had before it."""
+    index = read_run_index(run_id)
+    if index is None:
+        if run_id is None:
+            print("There are no backups of this repository.")
+        else:
+            print(f'There is no backup "{run_id}".')
+        return 2
+
+    print(f"Rolling back backup {index['id']}.\n")
+
+    failed = 0
+    for path, entry in sorted(index["files"].items()):
+        try:
+            result = restore_file(path, entry)
+        except OSError as e:
+            print(f'  Restoring "{path}" [{STATUS_FAIL}] ({e.strerror}).')
+            failed += 1
+            continue
+        if result is not None:
+            print(f'  {result} "{path}".')
+
+    if failed:
+        print(f"\nFailed to restore {failed} files.")
+        return 1
+
+    print(f"\nRolled back backup {index['id']} [{STATUS_DONE}].")
+    return 0
+
+
+def restore_file(path: str, entry: dict) -> str | None:
+    """Puts the saved version of path back in place and returns what was done.
+
+    Contents are reflinked out of the store when the filesystem supports
+    it, which takes no time regardless of the size of the file, and copied
+    otherwise. They are never hard linked, because the restored file would
+    share its mode, mtime and any later in-place edit with the stored object.
+    """
+    if "link" in entry:
+        mkdir(os.path.dirname(path))
+        tmp_path = temp_sibling(path)
+        os.symlink(entry["link"], tmp_path)
+        os.replace(tmp_path, path)
+        return "Restored link"
+
+    if entry.get("hash") is None:
+        # The file did not exist before the run.
+        if not os.path.lexists(path):
+            return None
+        os.unlink(path)
+        return "Removed"
+
+    mkdir(os.path.dirname(path))
+    tmp_path = temp_sibling(path)
+    try:
+        copy_file_data(object_path(entry["hash"]), tmp_path)
+        os.chmod(tmp_path, entry["mode"])
+        os.utime(tmp_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return "Restored"
+
+
+def run_action(
+    fragment_name: str,
     action_name: str,
     command: str,
     cwd: str,
     target_path: str | None = None,
+    out: TextIO | None = None,
+    dry_run: bool = False,
+    shells: ShellPool | None = None,
 ) -> bool:
+    if dry_run:
+        print(
+            f'  Would run {action_name} for {Term.colored(fragment_name, Term.COLOR_FRAGMENT)}: "{command}".',
+            file=out,
+        )
+        return True
+
+    # Flushed, so that the output of the command is printed after this line.
     print(
         f"  Running {action_name} for {Term.colored(fragment_name, Term.COLOR_FRAGMENT)}",
         end="",
+        file=out,
+        flush=True,
     )
 
-    env = os.environ.copy()
-    if target_path is not None:
-        env["TARGET_PATH"] = target_path
+    if shells is not None:
+        returncode, output = shells.get().run(
+            command, cwd, target_path, capture=out is not None
+        )
+        if out is not None:
+            out.write(output)
+    else:
+        import subprocess
+
+        env = os.environ.copy()
+        if target_path is not None:
+            env["TARGET_PATH"] = target_path
 
-    result = subprocess.run(command, shell=True, cwd=cwd, env=env)
-    success = result.returncode == 0
+        if out is None:
+            result = subprocess.run(command, shell=True, cwd=cwd, env=env)
+        else:
+            # Output of the command is captured so that it stays together
+            # with the rest of the output written to out.
+            result = subprocess.run(
+                command,
+                shell=True,
+                cwd=cwd,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            out.write(result.stdout)
+        returncode = result.returncode
+
+    success = returncode == 0
 
     print(
-        f" [{STATUS_DONE if result.returncode == 0 else STATUS_FAIL}] (exit code {result.returncode})."
+        f" [{STATUS_DONE if returncode == 0 else STATUS_FAIL}] (exit code {returncode}).",
+        file=out,
     )
 
     return success
 
 
+class ActionShell:
+    """A long-lived sh(1) running actions sent to it over a pipe.
+
+    Every action runs in a subshell, which the shell forks without starting
+    a new program, so that changes an action makes to its directory,
+    variables or options don't leak into the next one, and `exit` ends only
+    the action. After the subshell ends the shell writes its exit code to a
+    FIFO, so exit codes never mix with the output of actions. Actions read
+    their input from /dev/null, since the shell's input is the pipe commands
+    are sent over, and the FIFO is closed for them, so that neither they nor
+    processes they leave in the background can write to it or keep it open.
+    """
+
+    def __init__(self):
+        import shlex
+        import subprocess
+        import tempfile
+
+        # Holds the FIFO and the output of actions captured for --fragment-jobs.
+        self.dir = tempfile.mkdtemp(prefix="nastrajacz-")
+        self.output_path = os.path.join(self.dir, "output")
+        status_path = os.path.join(self.dir, "status")
+        os.mkfifo(status_path, 0o600)
+
+        self.process = subprocess.Popen(["/bin/sh"], stdin=subprocess.PIPE)
+        self.send(f"exec 3>{shlex.quote(status_path)}\n")
+        # Waits until the shell opens the other end.
+        self.status = open(status_path, mode="rb")
+
+    def send(self, script: str) -> None:
+        self.process.stdin.write(script.encode())
+        self.process.stdin.flush()
+
+    def run(
+        self, command: str, cwd: str, target_path: str | None, capture: bool
+    ) -> tuple[int, str]:
+        """Runs command in cwd and returns its exit code and, with capture, its output."""
+        import shlex
+
+        if target_path is not None:
+            env = f"export TARGET_PATH={shlex.quote(target_path)}"
+        else:
+            env = "unset TARGET_PATH"
+        redirect = "</dev/null 3>&-"
+        if capture:
+            redirect += f" >{shlex.quote(self.output_path)} 2>&1"
+
+        try:
+            self.send(
+                f"(cd {shlex.quote(cwd)} && {env} && eval {shlex.quote(command)})"
+                f" {redirect}\nprintf '%d\\n' \"$?\" >&3\n"
+            )
+            line = self.status.readline()
+        except BrokenPipeError:
+            line = b""
+
+        if not line:
+            # An action ended the shell itself, e.g. with kill $$.
+            self.close()
+            return self.process.returncode, ""
+
+        output = ""
+        if capture:
+            with open(self.output_path, mode="r", errors="replace") as f:
+                output = f.read()
+        return int(line), output
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self) -> None:
+        import shutil
+
+        with contextlib.suppress(OSError):
+            self.process.stdin.close()
+        self.process.wait()
+        self.status.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class ShellPool:
+    """Persistent shells for --persistent-shell, one for every thread running actions.
+
+    With --fragment-jobs fragments are processed by several threads at once,
+    each with a shell of its own, so their actions don't wait for each other.
+    """
+
+    def __init__(self):
+        self.shells: dict[int, ActionShell] = {}
+        self.lock = threading.Lock()
+
+    def get(self) -> ActionShell:
+        thread_id = threading.get_ident()
+        with self.lock:
+            shell = self.shells.get(thread_id)
+            if shell is None or not shell.alive():
+                shell = self.shells[thread_id] = ActionShell()
+        return shell
+
+    def close(self) -> None:
+        with self.lock:
+            for shell in self.shells.values():
+                shell.close()
+            self.shells.clear()
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
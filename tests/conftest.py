@@ -2,6 +2,13 @@ import pyte
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def state_home(tmp_path, monkeypatch):
+    state_home = tmp_path / "state"
+    monkeypatch.setenv("XDG_STATE_HOME", str(state_home))
+    return state_home
+
+
 @pytest.fixture
 def terminal(capsys):
     class VirtualTerminal:
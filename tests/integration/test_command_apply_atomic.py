@@ -0,0 +1,161 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+from src.nastrajacz import main
+
+
+def test_apply_atomic_replaces_files(tmp_path, monkeypatch, terminal):
+    """--apply --atomic replaces existing files with new ones instead of rewriting them."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("old_content")
+    old_inode = (home / ".testrc").stat().st_ino
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / ".testrc").write_text("applied_content")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--atomic"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / ".testrc").read_text() == "applied_content"
+    assert (home / ".testrc").stat().st_ino != old_inode
+    assert os.listdir(home) == [".testrc"]
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_atomic_keeps_original_when_copy_fails(tmp_path, monkeypatch):
+    """--apply --atomic leaves the original file intact and no temporary files when copying fails."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("old_content")
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / ".testrc").write_text("applied_content")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    def interrupted_copy2(src, dst):
+        with open(dst, mode="w") as f:
+            f.write("applied_")
+        raise KeyboardInterrupt
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--atomic"])
+    monkeypatch.setattr(shutil, "copy2", interrupted_copy2)
+
+    # When
+    with pytest.raises(KeyboardInterrupt):
+        main()
+
+    # Then
+    assert (home / ".testrc").read_text() == "old_content"
+    assert os.listdir(home) == [".testrc"]
+
+
+def test_apply_swaps_staged_directory(tmp_path, monkeypatch, terminal):
+    """--apply with swap stages a directory target next to it and swaps it in."""
+
+    # Given
+    home = tmp_path / "home"
+    system_dir = home / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "settings.json").write_text("old")
+    (system_dir / "local.json").write_text("local")
+    old_inode = system_dir.stat().st_ino
+    old_settings_inode = (system_dir / "settings.json").stat().st_ino
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    (fragments_dir / "subdir").mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("new")
+    (fragments_dir / "subdir" / "nested.txt").write_text("nested")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", swap = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert system_dir.stat().st_ino != old_inode
+    assert (system_dir / "settings.json").read_text() == "new"
+    assert (system_dir / "settings.json").stat().st_ino != old_settings_inode
+    assert (system_dir / "subdir" / "nested.txt").read_text() == "nested"
+    assert (system_dir / "local.json").read_text() == "local"
+    assert os.listdir(home) == ["testapp"]
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_swap_creates_missing_directory(tmp_path, monkeypatch, terminal):
+    """--apply with swap moves the staged directory into place when the target does not exist."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("new")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp", swap = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / "testapp" / "settings.json").read_text() == "new"
+    assert os.listdir(home) == ["testapp"]
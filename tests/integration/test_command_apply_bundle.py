@@ -0,0 +1,235 @@
+import os
+import sys
+
+import pytest
+
+from src.nastrajacz import main
+
+
+@pytest.fixture
+def bundle(tmp_path, monkeypatch, capsys):
+    """Exports fragments of a repository with the given config to a bundle."""
+
+    def export(config, files):
+        repo = tmp_path / "repo"
+        for rel_path, contents in files.items():
+            (repo / rel_path).parent.mkdir(parents=True, exist_ok=True)
+            (repo / rel_path).write_text(contents)
+        (repo / "fragments.toml").write_text(config)
+
+        monkeypatch.chdir(repo)
+        monkeypatch.setattr(
+            sys, "argv", ["nastrajacz", "--export-bundle", str(tmp_path / "bundle.tar.gz")]
+        )
+        main()
+        capsys.readouterr()
+
+        host = tmp_path / "host"
+        host.mkdir()
+        monkeypatch.chdir(host)
+        return tmp_path / "bundle.tar.gz"
+
+    return export
+
+
+def test_apply_from_bundle_writes_files_and_runs_actions(
+    tmp_path, monkeypatch, bundle, terminal
+):
+    """--apply --from-bundle writes files to the system and runs actions around them."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    bundle_path = bundle(
+        f'''
+[test_fragment_1]
+actions = {{ before_apply = "test ! -e {home}/.testrc" }}
+targets = [{{ src = "{home}/.testrc", actions = {{ after_apply = "cp $TARGET_PATH {home}/.copyrc" }} }}]
+''',
+        {"fragments/test_fragment_1/.testrc": "applied"},
+    )
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--apply", "--from-bundle", str(bundle_path)]
+    )
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    assert (home / ".testrc").read_text() == "applied"
+    assert (home / ".copyrc").read_text() == "applied"
+    assert os.listdir(tmp_path / "host") == [".nastrajacz"]
+
+    terminal.assert_lines(
+        [
+            f'Performing apply for test_fragment_1 fragments from "{bundle_path}".',
+            "",
+            "Processing fragment test_fragment_1.",
+            "Running before_apply for test_fragment_1 [ DONE] (exit code 0).",
+            f'Extracting "fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE].',
+            "Running after_apply for test_fragment_1/.testrc [ DONE] (exit code 0).",
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_from_bundle_mirrors_directories(tmp_path, bundle, monkeypatch, capsys):
+    """--from-bundle writes whole directories and removes extra files of mirrored targets."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "stale.txt").write_text("stale")
+    (system_dir / "debug.log").write_text("log")
+
+    bundle_path = bundle(
+        f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", mirror = true, exclude = ["*.log"] }}]
+''',
+        {
+            "fragments/test_fragment_1/testapp/settings.json": "{}",
+            "fragments/test_fragment_1/testapp/subdir/nested.txt": "nested",
+        },
+    )
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--apply", "--from-bundle", str(bundle_path)]
+    )
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert sorted(os.listdir(system_dir)) == ["debug.log", "settings.json", "subdir"]
+    assert (system_dir / "subdir" / "nested.txt").read_text() == "nested"
+
+
+def test_apply_from_bundle_skips_fragments(tmp_path, bundle, monkeypatch, capsys):
+    """--from-bundle passes over files of skipped and unselected fragments."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    bundle_path = bundle(
+        f'''
+[test_fragment_1]
+actions = {{ before_apply = "exit 1" }}
+targets = [{{ src = "{home}/.firstrc" }}]
+
+[test_fragment_2]
+targets = [{{ src = "{home}/.secondrc" }}]
+
+[test_fragment_3]
+targets = [{{ src = "{home}/.thirdrc" }}]
+''',
+        {
+            "fragments/test_fragment_1/.firstrc": "first",
+            "fragments/test_fragment_2/.secondrc": "second",
+            "fragments/test_fragment_3/.thirdrc": "third",
+        },
+    )
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "nastrajacz",
+            "--apply",
+            "--from-bundle",
+            str(bundle_path),
+            "--select",
+            "test_fragment_1,test_fragment_3",
+        ],
+    )
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert os.listdir(home) == [".thirdrc"]
+
+
+def test_apply_from_bundle_incremental_skips_unchanged_files(
+    tmp_path, bundle, monkeypatch, capsys, terminal
+):
+    """--from-bundle --incremental leaves files with the archived size and mtime."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    bundle_path = bundle(
+        f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp" }}]
+''',
+        {
+            "fragments/test_fragment_1/testapp/a.conf": "a",
+            "fragments/test_fragment_1/testapp/b.conf": "b",
+        },
+    )
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["nastrajacz", "--apply", "--from-bundle", str(bundle_path), "--incremental"],
+    )
+    main()
+    (home / "testapp" / "b.conf").write_text("changed")
+    capsys.readouterr()
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / "testapp" / "b.conf").read_text() == "b"
+    assert (
+        f'Extracting "fragments/test_fragment_1/testapp" to "{home}/testapp" [ DONE] (copied 1, skipped 1).'
+        in terminal.lines
+    )
+
+
+def test_from_bundle_requires_apply(tmp_path, monkeypatch, capsys):
+    """--from-bundle is rejected without --apply."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--status", "--from-bundle", "bundle.tar"]
+    )
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert "--from-bundle can only be used with --apply" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    "option", [["--jobs", "4"], ["--fragment-jobs", "4"], ["--zero-copy"]]
+)
+def test_from_bundle_rejects_parallel_and_zero_copy(
+    tmp_path, monkeypatch, capsys, option
+):
+    """--from-bundle is rejected with options it cannot honor while streaming the archive."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--apply", "--from-bundle", "bundle.tar", *option]
+    )
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert (
+        "--from-bundle cannot be used with --jobs, --fragment-jobs or --zero-copy"
+        in capsys.readouterr().err
+    )
@@ -0,0 +1,197 @@
+import re
+import sys
+
+from src.nastrajacz import main
+
+
+def test_apply_processes_dependencies_first(tmp_path, monkeypatch, terminal):
+    """--apply processes fragments after the fragments listed in their depends_on."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    for name in ["test_fragment_1", "test_fragment_2"]:
+        (repo / "fragments" / name).mkdir(parents=True)
+        (repo / "fragments" / name / f".{name}").write_text(name)
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.test_fragment_1" }}]
+depends_on = ["test_fragment_2"]
+
+[test_fragment_2]
+targets = [{{ src = "{home}/.test_fragment_2" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1, test_fragment_2 fragments.",
+            "",
+            "Processing fragment test_fragment_2.",
+            f'Copying "./fragments/test_fragment_2/.test_fragment_2" to "{home}/.test_fragment_2" [ DONE].',
+            "Finished processing fragment test_fragment_2 [ DONE].",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/.test_fragment_1" to "{home}/.test_fragment_1" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_skips_fragment_when_dependency_failed(tmp_path, monkeypatch, terminal):
+    """--apply skips fragments whose dependency was skipped because of a failed before action."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / ".testrc").write_text("content")
+    (repo / "fragments" / "test_fragment_2").mkdir(parents=True)
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+depends_on = ["test_fragment_2"]
+
+[test_fragment_2]
+targets = []
+
+[test_fragment_2.actions]
+before_apply = "exit 1"
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not (home / ".testrc").exists()
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1, test_fragment_2 fragments.",
+            "",
+            "Processing fragment test_fragment_2.",
+            "Running before_apply for test_fragment_2 [󰚌 FAIL] (exit code 1).",
+            "Skipping fragment test_fragment_2 because of failed before action [ SKIP].",
+            "",
+            "Processing fragment test_fragment_1.",
+            "Skipping fragment test_fragment_1 because of failed dependency test_fragment_2 [ SKIP].",
+        ]
+    )
+
+
+def test_apply_refuses_dependency_cycle(tmp_path, monkeypatch, terminal):
+    """--apply does not process anything when fragments depend on each other."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("""
+[test_fragment_1]
+targets = []
+depends_on = ["test_fragment_2"]
+
+[test_fragment_2]
+targets = []
+depends_on = ["test_fragment_1"]
+""")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1, test_fragment_2 fragments.",
+            "Cannot perform operations because fragments depend on each other.",
+        ]
+    )
+
+
+def test_error_unknown_dependency(tmp_path, monkeypatch, terminal):
+    """Shows error when a fragment depends on a fragment that is not defined."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("""
+[test_fragment_1]
+targets = []
+depends_on = ["nonexistent"]
+""")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Could not read fragments config file.",
+        ]
+    )
+
+
+def test_apply_with_fragment_jobs_keeps_output_grouped(tmp_path, monkeypatch, capsys):
+    """--apply --fragment-jobs runs fragments concurrently and prints each fragment's output together."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    names = [f"test_fragment_{i}" for i in range(1, 7)]
+    config = ""
+    for name in names:
+        (repo / "fragments" / name).mkdir(parents=True)
+        (repo / "fragments" / name / f".{name}").write_text(name)
+        config += f'''
+[{name}]
+targets = [{{ src = "{home}/.{name}" }}]
+depends_on = {'["test_fragment_1"]' if name == "test_fragment_6" else "[]"}
+
+[{name}.actions]
+before_apply = "sleep 0.1 && echo before {name}"
+'''
+    (repo / "fragments.toml").write_text(config)
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--fragment-jobs", "6"])
+
+    # When
+    main()
+    output = re.sub(r"\x1b\[\d+m", "", capsys.readouterr().out)
+
+    # Then
+    for name in names:
+        assert (home / f".{name}").read_text() == name
+
+    blocks = output.split("\n\n")[1:]
+    assert len(blocks) == len(names)
+    for block in blocks:
+        name = re.match(r"Processing fragment (\w+)\.", block).group(1)
+        assert f"before {name}" in block
+        assert f'to "{home}/.{name}"' in block
+        assert f"Finished processing fragment {name}" in block
+
+    block_names = [re.match(r"Processing fragment (\w+)\.", b).group(1) for b in blocks]
+    assert block_names.index("test_fragment_1") < block_names.index("test_fragment_6")
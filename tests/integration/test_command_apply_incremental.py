@@ -0,0 +1,146 @@
+import os
+import sys
+
+from src.nastrajacz import main
+
+
+def test_apply_incremental_skips_unchanged_files(tmp_path, monkeypatch, terminal):
+    """--apply --incremental copies only files whose size or mtime differ."""
+
+    # Given
+    system_dir = tmp_path / "home" / ".config" / "testapp"
+    system_dir.mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "unchanged.txt").write_text("same")
+    (fragments_dir / "changed.txt").write_text("new_content")
+    (fragments_dir / "added.txt").write_text("added")
+
+    (system_dir / "unchanged.txt").write_text("same")
+    (system_dir / "changed.txt").write_text("old_content")
+    unchanged_stat = (fragments_dir / "unchanged.txt").stat()
+    os.utime(
+        system_dir / "unchanged.txt",
+        ns=(unchanged_stat.st_atime_ns, unchanged_stat.st_mtime_ns),
+    )
+    unchanged_ctime = (system_dir / "unchanged.txt").stat().st_ctime_ns
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--incremental"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (system_dir / "unchanged.txt").read_text() == "same"
+    assert (system_dir / "unchanged.txt").stat().st_ctime_ns == unchanged_ctime
+    assert (system_dir / "changed.txt").read_text() == "new_content"
+    assert (system_dir / "added.txt").read_text() == "added"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE] (copied 2, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_incremental_second_run_copies_nothing(
+    tmp_path, monkeypatch, capsys, terminal
+):
+    """Repeated --apply --incremental does not rewrite any file."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp" / "subdir").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / "testapp" / "subdir" / "nested.txt").write_text("nested")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/testapp" }},
+    {{ src = "{home}/.testrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--incremental"])
+    main()
+    capsys.readouterr()
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / "testapp" / "subdir" / "nested.txt").read_text() == "nested"
+    assert (home / ".testrc").read_text() == "testrc"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{home}/testapp" [ DONE] (copied 0, skipped 2).',
+            f'Copying "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE] (copied 0, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_checksum_compares_file_contents(tmp_path, monkeypatch, terminal):
+    """--apply --checksum copies files with same size and mtime but different content."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("repo")
+    (home / ".testrc").write_text("host")
+    repo_stat = (fragments_dir / ".testrc").stat()
+    os.utime(home / ".testrc", ns=(repo_stat.st_atime_ns, repo_stat.st_mtime_ns))
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--checksum"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / ".testrc").read_text() == "repo"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE] (copied 1, skipped 0).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
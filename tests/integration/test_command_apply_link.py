@@ -0,0 +1,279 @@
+import os
+import sys
+
+from src.nastrajacz import main
+
+
+def test_apply_symlinks_file(tmp_path, monkeypatch, capsys, terminal):
+    """--apply with symlink mode links a file and leaves a correct link untouched."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("applied_content")
+    (home / ".testrc").write_text("old_content")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc", mode = "symlink" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+    main()
+    first_output = capsys.readouterr().out
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.readlink(home / ".testrc") == str(fragments_dir / ".testrc")
+    assert (home / ".testrc").read_text() == "applied_content"
+    assert "(linked 1, skipped 0)" in first_output
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Linking "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE] (linked 0, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_symlinks_directory(tmp_path, monkeypatch, terminal):
+    """--apply with symlink mode links a whole directory."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / ".config").mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.config/testapp", mode = "symlink" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.readlink(home / ".config" / "testapp") == str(fragments_dir)
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Linking "./fragments/test_fragment_1/testapp" to "{home}/.config/testapp" [ DONE] (linked 1, skipped 0).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_symlink_refuses_to_replace_directory(tmp_path, monkeypatch, terminal):
+    """--apply with symlink mode does not replace an existing directory with a link."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / "testapp").mkdir(parents=True)
+    (home / "testapp" / "local.json").write_text("local")
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1" / "testapp").mkdir(parents=True)
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp", mode = "symlink" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not os.path.islink(home / "testapp")
+    assert (home / "testapp" / "local.json").read_text() == "local"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Linking "./fragments/test_fragment_1/testapp" to "{home}/testapp" [󰚌 FAIL] (destination is a directory).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_symlinks_each_file_with_link_files(tmp_path, monkeypatch, terminal):
+    """--apply with symlink mode and link_files creates directories and links every file."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / "testapp").mkdir(parents=True)
+    (home / "testapp" / "local.json").write_text("local")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    (fragments_dir / "subdir").mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+    (fragments_dir / "subdir" / "nested.txt").write_text("nested")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp", mode = "symlink", link_files = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    system_dir = home / "testapp"
+    assert not os.path.islink(system_dir / "subdir")
+    assert os.readlink(system_dir / "settings.json") == str(fragments_dir / "settings.json")
+    assert os.readlink(system_dir / "subdir" / "nested.txt") == str(
+        fragments_dir / "subdir" / "nested.txt"
+    )
+    assert (system_dir / "local.json").read_text() == "local"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Linking "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE] (linked 2, skipped 0).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_hardlinks_with_global_mode(tmp_path, monkeypatch, terminal):
+    """--apply --mode hardlink hard links every file of targets without their own mode."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/testapp" }},
+    {{ src = "{home}/.testrc", mode = "copy" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--mode", "hardlink"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    settings = home / "testapp" / "settings.json"
+    assert settings.stat().st_ino == (fragments_dir / "testapp" / "settings.json").stat().st_ino
+    assert (home / ".testrc").stat().st_ino != (fragments_dir / ".testrc").stat().st_ino
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Linking "./fragments/test_fragment_1/testapp" to "{home}/testapp" [ DONE] (linked 1, skipped 0).',
+            f'Copying "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_fetch_of_linked_target_copies_nothing(tmp_path, monkeypatch, capsys, terminal):
+    """--fetch of a symlinked target leaves the repository untouched."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp", mode = "symlink" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+    main()
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--incremental"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (fragments_dir / "settings.json").read_text() == "{}"
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{home}/testapp" to "./fragments/test_fragment_1/testapp" [ DONE] (copied 0, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_error_unknown_target_mode(tmp_path, monkeypatch, terminal):
+    """Shows error when a target uses an unknown mode."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("""
+[test_fragment_1]
+targets = [{ src = "~/.testrc", mode = "teleport" }]
+""")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Could not read fragments config file.",
+        ]
+    )
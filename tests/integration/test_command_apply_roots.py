@@ -0,0 +1,242 @@
+import builtins
+import os
+import sys
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_apply_to_multiple_roots(tmp_path, monkeypatch, terminal):
+    """--root applies targets under every given root."""
+
+    # Given
+    roots = [tmp_path / "image_1", tmp_path / "image_2"]
+    for root in roots:
+        root.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp" / "subdir").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / "testapp" / "subdir" / "nested.txt").write_text("nested")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [
+    { src = "/etc/testapp" },
+    { src = "/etc/.testrc" },
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["nastrajacz", "--apply", "--root", str(roots[0]), "--root", str(roots[1])],
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    for root in roots:
+        assert (root / "etc" / "testapp" / "settings.json").read_text() == "{}"
+        assert (root / "etc" / "testapp" / "subdir" / "nested.txt").read_text() == (
+            "nested"
+        )
+        assert (root / "etc" / ".testrc").read_text() == "testrc"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            'Copying "./fragments/test_fragment_1/testapp" to "/etc/testapp" in 2 roots [ DONE].',
+            'Copying "./fragments/test_fragment_1/.testrc" to "/etc/.testrc" in 2 roots [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_apply_to_roots_reads_files_once(tmp_path, monkeypatch, capsys, atomic):
+    """--root reads every file of the repository once, whatever the number of roots."""
+
+    # Given
+    roots = [tmp_path / f"image_{i}" for i in range(3)]
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "a.conf").write_text("a")
+    (fragments_dir / "b.conf").write_text("b")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "/etc/testapp" }]
+''')
+
+    opened = []
+
+    def recording_open(file, mode="r", *args, **kwargs):
+        if "r" in mode and str(file).startswith("./fragments"):
+            opened.append(os.path.basename(file))
+        return builtins.open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(src.nastrajacz, "open", recording_open, raising=False)
+    monkeypatch.chdir(repo)
+    argv = ["nastrajacz", "--apply"]
+    for root in roots:
+        argv.extend(["--root", str(root)])
+    if atomic:
+        argv.append("--atomic")
+    monkeypatch.setattr(sys, "argv", argv)
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    for root in roots:
+        assert sorted(os.listdir(root / "etc" / "testapp")) == ["a.conf", "b.conf"]
+    assert sorted(opened) == ["a.conf", "b.conf"]
+
+
+def test_apply_to_roots_incremental_and_mirror(tmp_path, monkeypatch, capsys, terminal):
+    """--root copies only files that differ in each root and mirrors each of them."""
+
+    # Given
+    roots = [tmp_path / "image_1", tmp_path / "image_2"]
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "a.conf").write_text("a")
+    (fragments_dir / "b.conf").write_text("b")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "/etc/testapp", mirror = true }]
+''')
+
+    monkeypatch.chdir(repo)
+    argv = ["nastrajacz", "--apply", "--incremental"]
+    for root in roots:
+        argv.extend(["--root", str(root)])
+    monkeypatch.setattr(sys, "argv", argv)
+    main()
+    (roots[0] / "etc" / "testapp" / "a.conf").write_text("changed")
+    (roots[1] / "etc" / "testapp" / "stale.conf").write_text("stale")
+    capsys.readouterr()
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (roots[0] / "etc" / "testapp" / "a.conf").read_text() == "a"
+    assert not (roots[1] / "etc" / "testapp" / "stale.conf").exists()
+    assert terminal.lines[3:5] == [
+        'Copying "./fragments/test_fragment_1/testapp" to "/etc/testapp" in 2 roots [ DONE] (copied 1, skipped 3, removed 1).',
+        f'Removed "{roots[1]}/etc/testapp/stale.conf".',
+    ]
+
+
+def test_apply_resolves_absolute_links_inside_root(tmp_path, monkeypatch, capsys):
+    """--root follows absolute links of the image inside the root, never to the host."""
+
+    # Given
+    host = tmp_path / "host"
+    (host / "run").mkdir(parents=True)
+    (host / "resolv.conf").write_text("host")
+
+    root = tmp_path / "image"
+    (root / "etc").mkdir(parents=True)
+    (root / "var").mkdir()
+    (root / "etc" / "resolv.conf").symlink_to(host / "resolv.conf")
+    (root / "var" / "run").symlink_to(host / "run")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "resolv.conf").write_text("image")
+    (fragments_dir / "app.pid").write_text("1")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [
+    { src = "/etc/resolv.conf" },
+    { src = "/var/run/app.pid" },
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--root", str(root)])
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert (host / "resolv.conf").read_text() == "host"
+    assert os.listdir(host / "run") == []
+    assert not (root / "etc" / "resolv.conf").is_symlink()
+    assert (root / "etc" / "resolv.conf").read_text() == "image"
+    assert (root / str(host / "run").lstrip(os.sep) / "app.pid").read_text() == "1"
+
+
+def test_apply_does_not_enter_linked_directories_of_root(
+    tmp_path, monkeypatch, terminal
+):
+    """--root fails a directory target instead of writing into a linked directory in it."""
+
+    # Given
+    host = tmp_path / "host"
+    host.mkdir()
+
+    root = tmp_path / "image"
+    (root / "etc" / "testapp").mkdir(parents=True)
+    (root / "etc" / "testapp" / "conf.d").symlink_to(host)
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    (fragments_dir / "conf.d").mkdir(parents=True)
+    (fragments_dir / "conf.d" / "a.conf").write_text("a")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "/etc/testapp" }]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--root", str(root)])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.listdir(host) == []
+    assert terminal.lines[3] == (
+        f'Copying "./fragments/test_fragment_1/testapp" to "{root}/etc/testapp" '
+        f'[󰚌 FAIL] ("{root}/etc/testapp/conf.d" is a symbolic link).'
+    )
+
+
+def test_root_requires_apply(tmp_path, monkeypatch, capsys):
+    """--root is rejected without --apply."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--root", "/mnt"])
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert "--root can only be used with --apply" in capsys.readouterr().err
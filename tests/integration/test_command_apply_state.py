@@ -0,0 +1,146 @@
+import hashlib
+import json
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_apply_records_state_of_applied_files(
+    tmp_path, monkeypatch, state_home, terminal
+):
+    """--apply records size, mtime, mode and hash of applied files in the repo and on the host."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/testapp" }},
+    {{ src = "{home}/.testrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    state = json.loads((repo / ".nastrajacz" / "state").read_text())
+    fragment_state = state["fragments"]["test_fragment_1"]
+    assert fragment_state["operation"] == "apply"
+
+    settings = home / "testapp" / "settings.json"
+    dir_target = fragment_state["targets"][f"{home}/testapp"]
+    assert dir_target["path"] == str(home / "testapp")
+    assert dir_target["files"]["settings.json"] == {
+        "size": settings.stat().st_size,
+        "mtime_ns": settings.stat().st_mtime_ns,
+        "mode": settings.stat().st_mode & 0o7777,
+        "hash": hashlib.sha256(b"{}").hexdigest(),
+    }
+
+    file_target = fragment_state["targets"][f"{home}/.testrc"]
+    assert file_target["path"] == str(home / ".testrc")
+    assert file_target["files"]["."]["hash"] == hashlib.sha256(b"testrc").hexdigest()
+
+    host_states = list((state_home / "nastrajacz" / "repos").iterdir())
+    assert len(host_states) == 1
+    assert json.loads(host_states[0].read_text()) == state
+
+
+def test_fetch_records_state_of_fetched_files(tmp_path, monkeypatch, terminal):
+    """--fetch records fetched files in the state and keeps other fragments' state."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".config1").write_text("config1")
+    (home / ".config2").write_text("config2")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.config1" }}]
+
+[test_fragment_2]
+targets = [{{ src = "{home}/.config2" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+    main()
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--fetch", "--select", "test_fragment_2"]
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    state = json.loads((repo / ".nastrajacz" / "state").read_text())
+    assert set(state["fragments"].keys()) == {"test_fragment_1", "test_fragment_2"}
+
+    target = state["fragments"]["test_fragment_2"]["targets"][f"{home}/.config2"]
+    assert target["path"] == str(repo / "fragments" / "test_fragment_2" / ".config2")
+    assert target["files"]["."]["hash"] == hashlib.sha256(b"config2").hexdigest()
+
+
+def test_apply_checksum_uses_state_instead_of_reading_files(
+    tmp_path, monkeypatch, capsys, terminal
+):
+    """Repeated --apply --checksum decides from stat and state without reading file contents."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+    (fragments_dir / "other.json").write_text("[]")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--checksum"])
+    main()
+    capsys.readouterr()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file contents should not be read")
+
+    monkeypatch.setattr(src.nastrajacz, "same_contents", fail)
+    monkeypatch.setattr(src.nastrajacz, "hash_file", fail)
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{home}/testapp" [ DONE] (copied 0, skipped 2).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
@@ -0,0 +1,192 @@
+import os
+import pwd
+import sys
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch):
+    """Creates home directories of fake users and makes pwd return them."""
+    entries = {}
+    for i, name in enumerate(["alice", "bob"]):
+        home = tmp_path / "home" / name
+        home.mkdir(parents=True)
+        uid = 2000 + i if os.geteuid() == 0 else os.getuid()
+        gid = 2000 + i if os.geteuid() == 0 else os.getgid()
+        entries[name] = pwd.struct_passwd(
+            (name, "x", uid, gid, "", str(home), "/bin/sh")
+        )
+
+    def getpwnam(name):
+        return entries[name]
+
+    monkeypatch.setattr(src.nastrajacz.pwd, "getpwnam", getpwnam)
+    monkeypatch.setattr(src.nastrajacz.pwd, "getpwall", lambda: list(entries.values()))
+    return entries
+
+
+@pytest.mark.parametrize("users_args", [["--users", "alice,bob"], ["--all-users"]])
+def test_apply_to_users(tmp_path, monkeypatch, users, terminal, users_args):
+    """--users applies targets in the home directory to every user."""
+
+    # Given
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [
+    { src = "~/.config/testapp" },
+    { src = "~/.testrc" },
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", *users_args])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    for entry in users.values():
+        home = tmp_path / "home" / entry.pw_name
+        applied = [
+            home / ".config",
+            home / ".config" / "testapp",
+            home / ".config" / "testapp" / "settings.json",
+            home / ".testrc",
+        ]
+        assert (home / ".testrc").read_text() == "testrc"
+        for path in applied:
+            assert (path.stat().st_uid, path.stat().st_gid) == (
+                entry.pw_uid,
+                entry.pw_gid,
+            )
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            'Copying "./fragments/test_fragment_1/testapp" to "~/.config/testapp" for 2 users [ DONE].',
+            'Copying "./fragments/test_fragment_1/.testrc" to "~/.testrc" for 2 users [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_to_users_applies_other_targets_once(
+    tmp_path, monkeypatch, users, terminal
+):
+    """--users applies targets outside of the home directory only once."""
+
+    # Given
+    etc = tmp_path / "etc"
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "testapp.conf").write_text("conf")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{etc}/testapp.conf" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--users", "alice"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (etc / "testapp.conf").read_text() == "conf"
+    assert (etc / "testapp.conf").stat().st_uid == os.getuid()
+    assert (
+        f'Copying "./fragments/test_fragment_1/testapp.conf" to "{etc}/testapp.conf" [ DONE].'
+        in terminal.lines
+    )
+
+
+def test_apply_to_users_does_not_follow_links_in_homes(
+    tmp_path, monkeypatch, users, terminal
+):
+    """--users replaces links planted in homes and skips targets behind linked directories."""
+
+    # Given
+    secret = tmp_path / "secret"
+    secret.write_text("secret")
+    secret.chmod(0o600)
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+
+    alice_home = tmp_path / "home" / "alice"
+    (alice_home / ".testrc").symlink_to(secret)
+    (alice_home / ".config").symlink_to(elsewhere)
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [
+    { src = "~/.config/testapp" },
+    { src = "~/.testrc" },
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--users", "alice,bob"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert secret.read_text() == "secret"
+    assert secret.stat().st_mode & 0o777 == 0o600
+    assert os.listdir(elsewhere) == []
+    assert not (alice_home / ".testrc").is_symlink()
+    assert (alice_home / ".testrc").read_text() == "testrc"
+
+    bob_home = tmp_path / "home" / "bob"
+    assert (bob_home / ".config" / "testapp" / "settings.json").read_text() == "{}"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Skipping target testapp of user alice because "{alice_home}/.config" is a symbolic link [ SKIP].',
+            f'Copying "./fragments/test_fragment_1/testapp" to "{bob_home}/.config/testapp" [ DONE].',
+            'Copying "./fragments/test_fragment_1/.testrc" to "~/.testrc" for 2 users [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_users_rejects_unknown_users(tmp_path, monkeypatch, users, capsys):
+    """--users fails for users that don't exist."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--users", "alice,eve"])
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert "unknown user: eve" in capsys.readouterr().err
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def read_index(state_home):
+    runs_dir = state_home / "nastrajacz" / "runs"
+    (index_name,) = os.listdir(runs_dir)
+    return json.loads((runs_dir / index_name).read_text())
+
+
+def stored_objects(state_home):
+    objects_dir = state_home / "nastrajacz" / "objects"
+    return sorted(
+        os.path.join(os.path.basename(dir_path), name)
+        for dir_path, _, names in os.walk(objects_dir)
+        if dir_path != str(objects_dir)
+        for name in names
+    )
+
+
+def test_apply_backup_saves_overwritten_files(
+    tmp_path, monkeypatch, state_home, terminal
+):
+    """--apply --backup stores previous contents of overwritten files in a run index."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("previous")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("applied")
+    (fragments_dir / ".newrc").write_text("new")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/.testrc" }},
+    {{ src = "{home}/.newrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (home / ".testrc").read_text() == "applied"
+
+    index = read_index(state_home)
+    previous = index["files"][str(home / ".testrc")]
+    assert index["files"][str(home / ".newrc")] == {"hash": None}
+
+    object_path = state_home / "nastrajacz" / "objects" / previous["hash"][:2]
+    assert (object_path / previous["hash"][2:]).read_text() == "previous"
+
+    assert terminal.lines[-1] == (
+        f"Saved previous versions of 2 files as backup {index['id']}."
+    )
+
+
+def test_apply_backup_stores_identical_contents_once(
+    tmp_path, monkeypatch, state_home, capsys
+):
+    """--backup keeps a single object for equal contents saved by different runs."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / "testapp").mkdir(parents=True)
+    (home / "testapp" / "a.conf").write_text("same")
+    (home / "testapp" / "b.conf").write_text("same")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "a.conf").write_text("applied")
+    (fragments_dir / "b.conf").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+
+    # When
+    main()
+    (home / "testapp" / "a.conf").write_text("same")
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert len(os.listdir(state_home / "nastrajacz" / "runs")) == 2
+    assert len(stored_objects(state_home)) == 2
+
+
+def test_apply_backup_reuses_hashes_of_applied_files(
+    tmp_path, monkeypatch, state_home, capsys
+):
+    """--backup does not read stored files that are unchanged since the previous apply."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    main()
+    main()
+    capsys.readouterr()
+
+    def failing_store(self, path):
+        raise AssertionError(f"{path} was read")
+
+    monkeypatch.setattr(src.nastrajacz.Backup, "store", failing_store)
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert (home / ".testrc").read_text() == "applied"
+    assert len(stored_objects(state_home)) == 1
+
+
+@pytest.mark.parametrize("swap", ["false", "true"])
+def test_apply_backup_saves_files_removed_by_mirror(
+    tmp_path, monkeypatch, state_home, capsys, swap
+):
+    """--backup saves files that mirror removes, also when the target is swapped."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    (system_dir / "old").mkdir(parents=True)
+    (system_dir / "settings.json").write_text("previous")
+    (system_dir / "old" / "stale.txt").write_text("stale")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", mirror = true, swap = {swap} }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    assert os.listdir(system_dir) == ["settings.json"]
+
+    files = read_index(state_home)["files"]
+    assert sorted(files) == [
+        str(system_dir / "old" / "stale.txt"),
+        str(system_dir / "settings.json"),
+    ]
+    assert len(stored_objects(state_home)) == 2
+
+
+def test_backup_requires_apply(tmp_path, monkeypatch, capsys):
+    """--backup is rejected without --apply."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--backup"])
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert "--backup can only be used with --apply" in capsys.readouterr().err
@@ -0,0 +1,129 @@
+import os
+import pickle
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_list_uses_cached_config(tmp_path, monkeypatch, capsys, terminal):
+    """The parsed configuration is cached and reused while the file is unchanged."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "~/.testrc" }]
+''')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+    main()
+    capsys.readouterr()
+
+    def failing_parse(data):
+        raise AssertionError("configuration was parsed")
+
+    monkeypatch.setattr(src.nastrajacz, "parse_fragments_config", failing_parse)
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (tmp_path / ".nastrajacz" / "cache").exists()
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "test_fragment_1",
+        ]
+    )
+
+
+def test_cached_config_is_invalidated_by_changed_contents(
+    tmp_path, monkeypatch, capsys, terminal
+):
+    """A change of contents invalidates the cache, even with the same size and mtime."""
+
+    # Given
+    config_path = tmp_path / "fragments.toml"
+    config_path.write_text('[fragment_a]\ntargets = [{ src = "~/.testrc" }]\n')
+    os.utime(config_path, ns=(0, 0))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+    main()
+    capsys.readouterr()
+
+    config_path.write_text('[fragment_b]\ntargets = [{ src = "~/.testrc" }]\n')
+    os.utime(config_path, ns=(0, 0))
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "fragment_b",
+        ]
+    )
+
+
+def test_corrupted_cache_is_ignored(tmp_path, monkeypatch, terminal):
+    """An unreadable cache is replaced by parsing the configuration again."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "~/.testrc" }]
+''')
+    (tmp_path / ".nastrajacz").mkdir()
+    (tmp_path / ".nastrajacz" / "cache").write_bytes(b"not a pickle")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "test_fragment_1",
+        ]
+    )
+
+
+def test_cache_is_not_unpickled_without_matching_key(tmp_path, monkeypatch, terminal):
+    """A cache that was not written for the current fragments.toml is never unpickled."""
+
+    # Given
+    marker = tmp_path / "unpickled"
+
+    class Payload:
+        def __reduce__(self):
+            return os.mkdir, (str(marker),)
+
+    (tmp_path / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "~/.testrc" }]
+''')
+    (tmp_path / ".nastrajacz").mkdir()
+    (tmp_path / ".nastrajacz" / "cache").write_bytes(
+        pickle.dumps((("planted",), Payload()))
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not marker.exists()
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "test_fragment_1",
+        ]
+    )
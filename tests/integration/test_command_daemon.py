@@ -0,0 +1,229 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src.nastrajacz import main
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "src", "nastrajacz.py")
+
+
+@pytest.fixture
+def daemon(tmp_path, state_home):
+    processes = []
+
+    def start(repo):
+        process = subprocess.Popen(
+            [sys.executable, SCRIPT_PATH, "--daemon"],
+            cwd=repo,
+            env={**os.environ, "XDG_STATE_HOME": str(state_home)},
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        processes.append(process)
+
+        socket_path = repo / ".nastrajacz" / "daemon.sock"
+        deadline = time.monotonic() + 5
+        while not socket_path.exists():
+            assert time.monotonic() < deadline, "daemon did not start"
+            time.sleep(0.02)
+        return process
+
+    yield start
+
+    for process in processes:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_daemon_runs_commands_sent_with_connect(
+    tmp_path, monkeypatch, daemon, terminal
+):
+    """--connect runs the command in the daemon and prints its output."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("testrc")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+actions = {{ after_fetch = "echo fetched" }}
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+    daemon(repo)
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--connect", "--fetch"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    assert (repo / "fragments" / "test_fragment_1" / ".testrc").read_text() == (
+        "testrc"
+    )
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{home}/.testrc" to "./fragments/test_fragment_1" [ DONE].',
+            "Running after_fetch for test_fragment_1fetched",
+            "[ DONE] (exit code 0).",
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_daemon_returns_exit_code_and_reloads_config(
+    tmp_path, monkeypatch, daemon, capsys, terminal
+):
+    """The daemon returns exit codes of commands and rereads a modified config."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("changed")
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / ".testrc").write_text("testrc")
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+    daemon(repo)
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--connect", "--status"])
+    status_exit_code = main()
+    capsys.readouterr()
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+
+[test_fragment_2]
+targets = [{{ src = "{home}/.otherrc" }}]
+''')
+    os.utime(repo / "fragments.toml", ns=(0, 0))
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--connect", "--list"])
+
+    # When
+    list_exit_code = main()
+    terminal.render()
+
+    # Then
+    assert status_exit_code == 1
+    assert list_exit_code == 0
+
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "test_fragment_1, test_fragment_2",
+        ]
+    )
+
+
+def test_daemon_rereads_config_that_failed_to_read(
+    tmp_path, monkeypatch, daemon, capsys, terminal
+):
+    """The daemon reads a config that failed to read again, also when fragments.toml is unchanged."""
+
+    # Given
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text('''
+include = ["extra.toml"]
+
+[test_fragment_1]
+targets = []
+''')
+    (repo / "extra.toml").write_text("[test_fragment_2")
+    daemon(repo)
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--connect", "--list"])
+    broken_exit_code = main()
+    capsys.readouterr()
+
+    (repo / "extra.toml").write_text("[test_fragment_2]\ntargets = []\n")
+
+    # When
+    fixed_exit_code = main()
+    terminal.render()
+
+    # Then
+    assert broken_exit_code != 0
+    assert fixed_exit_code == 0
+
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "test_fragment_1, test_fragment_2",
+        ]
+    )
+
+
+def test_daemon_socket_is_private(tmp_path, daemon):
+    """The daemon creates its socket, and the directory of it, accessible only to the user."""
+
+    # Given
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text("")
+
+    # When
+    daemon(repo)
+
+    # Then
+    assert (repo / ".nastrajacz").stat().st_mode & 0o777 == 0o700
+    assert (repo / ".nastrajacz" / "daemon.sock").stat().st_mode & 0o777 == 0o600
+
+
+def test_daemon_removes_socket_when_stopped(tmp_path, daemon):
+    """The daemon stops on SIGINT and removes its socket."""
+
+    # Given
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text("")
+    process = daemon(repo)
+
+    # When
+    process.send_signal(signal.SIGINT)
+    output, _ = process.communicate(timeout=5)
+
+    # Then
+    assert process.returncode == 0
+    assert not (repo / ".nastrajacz" / "daemon.sock").exists()
+    assert output.splitlines()[-1] == "Stopped daemon."
+
+
+def test_connect_without_daemon(tmp_path, monkeypatch, terminal):
+    """--connect reports a missing daemon."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--connect", "--list"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 2
+    terminal.assert_lines(
+        ['There is no daemon listening on "./.nastrajacz/daemon.sock".']
+    )
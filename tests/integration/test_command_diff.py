@@ -0,0 +1,234 @@
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_diff_prints_unified_diff_of_changed_files(tmp_path, monkeypatch, terminal):
+    """--diff prints diffs from the repository to the system and returns 1."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "settings.conf").write_text("a = 1\nb = 3\nc = 3\n")
+    (system_dir / "same.conf").write_text("same\n")
+    (system_dir / "extra.conf").write_text("extra\n")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.conf").write_text("a = 1\nb = 2\nc = 3\n")
+    (fragments_dir / "same.conf").write_text("same\n")
+    (fragments_dir / "new.conf").write_text("new\n")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            f"Only on system: {system_dir}/extra.conf",
+            "Only in repository: ./fragments/test_fragment_1/testapp/new.conf",
+            "--- ./fragments/test_fragment_1/testapp/settings.conf",
+            f"+++ {system_dir}/settings.conf",
+            "@@ -1,3 +1,3 @@",
+            "a = 1",
+            "-b = 2",
+            "+b = 3",
+            "c = 3",
+        ]
+    )
+
+
+def test_diff_numbers_lines_after_skipped_prefix(tmp_path, monkeypatch, terminal):
+    """--diff reports line numbers of the whole file for a change deep inside of it."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    lines = [f'  "key_{i}": {i},\n' for i in range(1000)]
+    (home / "generated.json").write_text("".join(lines))
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    lines[500] = '  "key_500": "changed",\n'
+    (fragments_dir / "generated.json").write_text("".join(lines))
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/generated.json" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            "--- ./fragments/test_fragment_1/generated.json",
+            f"+++ {home}/generated.json",
+            "@@ -498,7 +498,7 @@",
+            '"key_497": 497,',
+            '"key_498": 498,',
+            '"key_499": 499,',
+            '-  "key_500": "changed",',
+            '+  "key_500": 500,',
+            '"key_501": 501,',
+            '"key_502": 502,',
+            '"key_503": 503,',
+        ]
+    )
+
+
+def test_diff_skips_binary_files(tmp_path, monkeypatch, terminal):
+    """--diff does not print contents of binary files."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / "image.bin").write_bytes(b"\0\1\2host")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "image.bin").write_bytes(b"\0\1\2repo")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/image.bin" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            f"Binary files ./fragments/test_fragment_1/image.bin and {home}/image.bin differ",
+        ]
+    )
+
+
+def test_diff_prints_nothing_without_differences(tmp_path, monkeypatch, terminal):
+    """--diff returns 0 and prints nothing for files with equal contents."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("testrc")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    assert terminal.lines == [""]
+
+
+def test_diff_reports_dangling_links_as_missing(tmp_path, monkeypatch, terminal):
+    """--diff reports a dangling symbolic link as a missing file instead of failing."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "settings.conf").symlink_to(tmp_path / "nowhere")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.conf").write_text("a = 1\n")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            "Only in repository: ./fragments/test_fragment_1/testapp/settings.conf",
+        ]
+    )
+
+
+def test_diff_does_not_load_large_changes(tmp_path, monkeypatch, terminal):
+    """--diff only reports that files differ when their changed part is too large."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / "data.json").write_text('{"a": 1, "b": 3, "c": 3}')
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "data.json").write_text('{"a": 1, "b": 2, "c": 3}')
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/data.json" }}]
+''')
+
+    monkeypatch.setattr(src.nastrajacz, "DIFF_MAX_SIZE", 16)
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--diff"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            f"Files ./fragments/test_fragment_1/data.json and {home}/data.json differ",
+        ]
+    )
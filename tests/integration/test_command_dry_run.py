@@ -0,0 +1,239 @@
+import os
+import sys
+
+from src.nastrajacz import main
+
+
+def test_apply_dry_run_plans_without_writing(tmp_path, monkeypatch, terminal):
+    """--apply --dry-run lists creates, overwrites and removals without changing files."""
+
+    # Given
+    home = tmp_path / "home"
+    system_dir = home / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "settings.json").write_text("old")
+    (system_dir / "stale.txt").write_text("stale")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / "testapp" / "theme.toml").write_text("theme")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", mirror = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--dry-run"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert sorted(os.listdir(system_dir)) == ["settings.json", "stale.txt"]
+    assert (system_dir / "settings.json").read_text() == "old"
+    assert not (system_dir / "theme.toml").exists()
+    assert not (repo / ".nastrajacz").exists()
+
+    terminal.assert_lines(
+        [
+            "Planning apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Would copy "./fragments/test_fragment_1/testapp" to "{system_dir}" (create 1, overwrite 1, skip 0, remove 1, 7 bytes).',
+            f'Overwrite "{system_dir}/settings.json" (2 bytes).',
+            f'Create "{system_dir}/theme.toml" (5 bytes).',
+            f'Remove "{system_dir}/stale.txt".',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+            "",
+            "Planned create 1, overwrite 1, skip 0, remove 1, 7 bytes in total.",
+        ]
+    )
+
+
+def test_fetch_plan_skips_unchanged_files(tmp_path, monkeypatch, capsys, terminal):
+    """--fetch --incremental --plan counts files with unchanged size and mtime as skipped."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    config_dir.mkdir(parents=True)
+    (config_dir / "settings.json").write_text("{}")
+    (config_dir / "other.json").write_text("[]")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+    main()
+    capsys.readouterr()
+
+    (config_dir / "settings.json").write_text('{"key": "value"}')
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--fetch", "--incremental", "--plan"]
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    assert (fetched_dir / "settings.json").read_text() == "{}"
+
+    terminal.assert_lines(
+        [
+            "Planning fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Would copy "{config_dir}" to "./fragments/test_fragment_1/testapp" (create 0, overwrite 1, skip 1, remove 0, 16 bytes).',
+            'Overwrite "./fragments/test_fragment_1/testapp/settings.json" (16 bytes).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+            "",
+            "Planned create 0, overwrite 1, skip 1, remove 0, 16 bytes in total.",
+        ]
+    )
+
+
+def test_fetch_dry_run_does_not_create_fragments_directory(
+    tmp_path, monkeypatch, terminal
+):
+    """--fetch --dry-run does not create directories in the repository nor run actions."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("testrc")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+actions = {{ before_fetch = "touch fetched" }}
+targets = [{{ src = "{home}/.testrc", dir = "rc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--dry-run"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.listdir(repo) == ["fragments.toml"]
+
+    terminal.assert_lines(
+        [
+            "Planning fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            'Would run before_fetch for test_fragment_1: "touch fetched".',
+            f'Would copy "{home}/.testrc" to "./fragments/test_fragment_1/rc/.testrc" (create 1, overwrite 0, skip 0, remove 0, 6 bytes).',
+            'Create "./fragments/test_fragment_1/rc/.testrc" (6 bytes).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+            "",
+            "Planned create 1, overwrite 0, skip 0, remove 0, 6 bytes in total.",
+        ]
+    )
+
+
+def test_apply_dry_run_plans_links(tmp_path, monkeypatch, capsys, terminal):
+    """--apply --mode symlink --dry-run skips links that are already correct."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("testrc")
+    (fragments_dir / ".otherrc").write_text("otherrc")
+    (home / ".otherrc").write_text("otherrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/.testrc" }},
+    {{ src = "{home}/.otherrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    (home / ".testrc").symlink_to(fragments_dir / ".testrc")
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--apply", "--mode", "symlink", "--dry-run"]
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not (home / ".otherrc").is_symlink()
+
+    terminal.assert_lines(
+        [
+            "Planning apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Would link "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" (create 0, overwrite 0, skip 1, remove 0, 0 bytes).',
+            f'Would link "./fragments/test_fragment_1/.otherrc" to "{home}/.otherrc" (create 0, overwrite 1, skip 0, remove 0, 0 bytes).',
+            f'Overwrite "{home}/.otherrc" with a link.',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+            "",
+            "Planned create 0, overwrite 1, skip 1, remove 0, 0 bytes in total.",
+        ]
+    )
+
+
+def test_apply_dry_run_reports_dangling_link(tmp_path, monkeypatch, terminal):
+    """--apply --dry-run reports a dangling link in the repository and plans the other files."""
+
+    # Given
+    home = tmp_path / "home"
+    system_dir = home / "testapp"
+    system_dir.mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "broken.txt").symlink_to(tmp_path / "nonexistent")
+    (fragments_dir / "testapp" / "theme.toml").write_text("theme")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--dry-run"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.listdir(system_dir) == []
+
+    terminal.assert_lines(
+        [
+            "Planning apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Would copy "./fragments/test_fragment_1/testapp" to "{system_dir}" (create 1, overwrite 0, skip 0, remove 0, 5 bytes, fail 1).',
+            'Cannot copy "./fragments/test_fragment_1/testapp/broken.txt" (No such file or directory).',
+            f'Create "{system_dir}/theme.toml" (5 bytes).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+            "",
+            "Planned create 1, overwrite 0, skip 0, remove 0, 5 bytes, fail 1 in total.",
+        ]
+    )
@@ -0,0 +1,117 @@
+import sys
+import tarfile
+
+import pytest
+
+from src.nastrajacz import main, read_fragments_config
+
+
+def test_export_bundle_writes_selected_fragments(tmp_path, monkeypatch, terminal):
+    """--export-bundle writes the configuration and files of selected fragments."""
+
+    # Given
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments"
+    (fragments_dir / "test_fragment_1" / "testapp" / "subdir").mkdir(parents=True)
+    (fragments_dir / "test_fragment_1" / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / "test_fragment_1" / "testapp" / "debug.log").write_text("log")
+    (fragments_dir / "test_fragment_1" / "testapp" / "subdir" / "nested.txt").write_text("nested")
+    (fragments_dir / "test_fragment_2").mkdir()
+    (fragments_dir / "test_fragment_2" / ".testrc").write_text("testrc")
+    (fragments_dir / "test_fragment_3").mkdir()
+    (fragments_dir / "test_fragment_3" / ".otherrc").write_text("otherrc")
+
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+depends_on = ["test_fragment_2", "test_fragment_3"]
+targets = [{ src = "~/.config/testapp", exclude = ["*.log"], mirror = true }]
+
+[test_fragment_2]
+actions = { after_apply = "echo applied" }
+targets = [{ src = "~/.testrc", actions = { before_apply = "echo before" } }]
+
+[test_fragment_3]
+targets = [{ src = "~/.otherrc" }]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "nastrajacz",
+            "--export-bundle",
+            "bundle.tar.gz",
+            "--select",
+            "test_fragment_1,test_fragment_2",
+        ],
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    with tarfile.open(repo / "bundle.tar.gz") as tar:
+        names = tar.getnames()
+        config = tar.extractfile("fragments.toml").read()
+
+    assert names == [
+        "fragments.toml",
+        "fragments/test_fragment_2/.testrc",
+        "fragments/test_fragment_1/testapp",
+        "fragments/test_fragment_1/testapp/settings.json",
+        "fragments/test_fragment_1/testapp/subdir",
+        "fragments/test_fragment_1/testapp/subdir/nested.txt",
+    ]
+
+    (tmp_path / "fragments.toml").write_bytes(config)
+    exported = read_fragments_config(str(tmp_path))
+    expected = read_fragments_config(str(repo))
+    assert exported.names() == ["test_fragment_1", "test_fragment_2"]
+    assert exported.fragments["test_fragment_1"].depends_on == ["test_fragment_2"]
+    assert exported.fragments["test_fragment_1"].targets == (
+        expected.fragments["test_fragment_1"].targets
+    )
+    assert exported.fragments["test_fragment_2"] == (
+        expected.fragments["test_fragment_2"]
+    )
+
+    terminal.assert_lines(
+        [
+            'Exporting test_fragment_1, test_fragment_2 fragments to "bundle.tar.gz".',
+            "Adding fragment test_fragment_2 [ DONE] (files 1).",
+            "Adding fragment test_fragment_1 [ DONE] (files 2).",
+            "",
+            "Exported 3 files in total.",
+        ]
+    )
+
+
+@pytest.mark.parametrize("bundle_name", ["bundle.tar", "bundle.tar.xz"])
+def test_export_bundle_compression(tmp_path, monkeypatch, capsys, bundle_name):
+    """--export-bundle compresses the archive according to its extension."""
+
+    # Given
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1" / "rc").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / "rc" / ".testrc").write_text("testrc")
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "~/.testrc", dir = "rc" }]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--export-bundle", bundle_name])
+
+    # When
+    main()
+    capsys.readouterr()
+
+    # Then
+    compression = "xz" if bundle_name.endswith(".xz") else ""
+    with tarfile.open(repo / bundle_name, mode=f"r:{compression}") as tar:
+        assert tar.getnames() == [
+            "fragments.toml",
+            "fragments/test_fragment_1/rc/.testrc",
+        ]
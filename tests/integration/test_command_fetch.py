@@ -344,3 +344,48 @@ targets = [{{ src = "{home}/.config3" }}]
             "Finished processing fragment test_fragment_3 [ DONE].",
         ]
     )
+
+
+def test_fetch_copies_rest_of_directory_past_dangling_link(
+    tmp_path, monkeypatch, terminal
+):
+    """--fetch copies the other files of a directory with a dangling link and reports the link."""
+
+    # Given
+    home = tmp_path / "home"
+    config_dir = home / ".config" / "testapp"
+    config_dir.mkdir(parents=True)
+    (config_dir / "a.txt").write_text("a")
+    (config_dir / "b.txt").symlink_to(tmp_path / "nonexistent")
+    (config_dir / "c.txt").write_text("c")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    assert (fetched_dir / "a.txt").read_text() == "a"
+    assert (fetched_dir / "c.txt").read_text() == "c"
+    assert not (fetched_dir / "b.txt").exists()
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}" to "./fragments/test_fragment_1/testapp" [󰚌 FAIL] (failed 1).',
+            f'Failed to copy "{config_dir}/b.txt" (No such file or directory).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
@@ -0,0 +1,91 @@
+import sys
+
+from src.nastrajacz import main
+
+
+def test_fetch_incremental_skips_unchanged_files(
+    tmp_path, monkeypatch, capsys, terminal
+):
+    """Repeated --fetch --incremental does not rewrite files in the repository."""
+
+    # Given
+    home = tmp_path / "home"
+    config_dir = home / ".config" / "testapp"
+    config_dir.mkdir(parents=True)
+    (config_dir / "settings.json").write_text('{"key": "value"}')
+    (config_dir / "other.json").write_text("{}")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--incremental"])
+    main()
+    capsys.readouterr()
+
+    fetched = repo / "fragments" / "test_fragment_1" / "testapp" / "other.json"
+    fetched_ctime = fetched.stat().st_ctime_ns
+    (config_dir / "settings.json").write_text('{"key": "changed"}')
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    assert (fetched_dir / "settings.json").read_text() == '{"key": "changed"}'
+    assert fetched.stat().st_ctime_ns == fetched_ctime
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}" to "./fragments/test_fragment_1/testapp" [ DONE] (copied 1, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_fetch_incremental_single_file(tmp_path, monkeypatch, capsys, terminal):
+    """--fetch --incremental skips an unchanged single file target."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("config_content")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--incremental"])
+    main()
+    capsys.readouterr()
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert (repo / "fragments" / "test_fragment_1" / ".testrc").read_text() == (
+        "config_content"
+    )
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{home}/.testrc" to "./fragments/test_fragment_1" [ DONE] (copied 0, skipped 1).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
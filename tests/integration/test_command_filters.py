@@ -0,0 +1,227 @@
+import os
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_fetch_excludes_matching_files_and_directories(
+    tmp_path, monkeypatch, terminal
+):
+    """--fetch skips files and whole directories matching exclude patterns."""
+
+    # Given
+    config_dir = tmp_path / "home" / "nvim"
+    (config_dir / "lua" / "__pycache__").mkdir(parents=True)
+    (config_dir / "lua" / "__pycache__" / "mod.pyc").write_text("pyc")
+    (config_dir / "lua" / "init.lua").write_text("init")
+    (config_dir / ".git" / "objects").mkdir(parents=True)
+    (config_dir / ".git" / "HEAD").write_text("ref")
+    (config_dir / "build").mkdir()
+    (config_dir / "build" / "out.so").write_text("so")
+    (config_dir / "init.lua").write_text("init")
+    (config_dir / "debug.log").write_text("log")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{config_dir}", exclude = [".git", "__pycache__", "/build", "*.log"] }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "nvim"
+    assert sorted(os.listdir(fetched_dir)) == ["init.lua", "lua"]
+    assert os.listdir(fetched_dir / "lua") == ["init.lua"]
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}" to "./fragments/test_fragment_1/nvim" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_excluded_directories_are_not_entered(tmp_path, monkeypatch, terminal):
+    """Excluded directories are pruned during the walk instead of being listed."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    (config_dir / "node_modules" / "package").mkdir(parents=True)
+    (config_dir / "node_modules" / "package" / "index.js").write_text("js")
+    (config_dir / "settings.json").write_text("{}")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}", exclude = ["node_modules"] }}]
+''')
+
+    walked = []
+    original_walk = os.walk
+
+    def recording_walk(top, *args, **kwargs):
+        for entry in original_walk(top, *args, **kwargs):
+            walked.append(entry[0])
+            yield entry
+
+    monkeypatch.setattr(src.nastrajacz.os, "walk", recording_walk)
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not any("node_modules" in path for path in walked)
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    assert os.listdir(fetched_dir) == ["settings.json"]
+
+
+def test_fragment_patterns_apply_to_targets_without_their_own(
+    tmp_path, monkeypatch, terminal
+):
+    """Fragment level include patterns are used by targets that do not set include."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / "app1" / "themes").mkdir(parents=True)
+    (home / "app1" / "themes" / "dark.toml").write_text("dark")
+    (home / "app1" / "config.toml").write_text("config")
+    (home / "app1" / "history").write_text("history")
+    (home / "app1" / "empty").mkdir()
+    (home / "app2").mkdir()
+    (home / "app2" / "config.toml").write_text("config")
+    (home / "app2" / "history").write_text("history")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+include = ["*.toml"]
+targets = [
+    {{ src = "{home}/app1" }},
+    {{ src = "{home}/app2", include = ["history"] }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fragment_dir = repo / "fragments" / "test_fragment_1"
+    assert sorted(os.listdir(fragment_dir / "app1")) == ["config.toml", "themes"]
+    assert os.listdir(fragment_dir / "app1" / "themes") == ["dark.toml"]
+    assert os.listdir(fragment_dir / "app2") == ["history"]
+
+
+def test_apply_mirror_keeps_excluded_files(tmp_path, monkeypatch, terminal):
+    """--apply with mirror does not remove files left out by filters."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    (system_dir / "cache").mkdir(parents=True)
+    (system_dir / "cache" / "blob").write_text("blob")
+    (system_dir / "stale.json").write_text("stale")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{system_dir}", mirror = true, swap = true, exclude = ["cache"] }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert sorted(os.listdir(system_dir)) == ["cache", "settings.json"]
+    assert (system_dir / "cache" / "blob").read_text() == "blob"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE] (removed 1).',
+            f'Removed "{system_dir}/stale.json".',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_symlink_with_filter_links_files(tmp_path, monkeypatch, terminal):
+    """--apply --mode symlink links included files one by one instead of the directory."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+    (fragments_dir / "notes.md").write_text("notes")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", exclude = ["*.md"] }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--mode", "symlink"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert not system_dir.is_symlink()
+    assert os.listdir(system_dir) == ["settings.json"]
+    assert (system_dir / "settings.json").is_symlink()
+
+
+def test_invalid_patterns_are_reported(tmp_path, monkeypatch, terminal):
+    """A pattern list that is not a list of strings makes the config invalid."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "~/.testrc", exclude = "*.log" }]
+''')
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    terminal.assert_lines(["Could not read fragments config file."])
@@ -0,0 +1,145 @@
+import os
+import sys
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+@pytest.fixture
+def split_repo(tmp_path):
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".gitconfig").write_text("gitconfig")
+    (home / ".vimrc").write_text("vimrc")
+    (home / ".zshrc").write_text("zshrc")
+
+    repo = tmp_path / "repo"
+    (repo / "fragments.d" / "shells").mkdir(parents=True)
+    (repo / "fragments.toml").write_text(f'''
+include = ["fragments.d/*.toml", "fragments.d/**/*.toml"]
+
+[git]
+targets = [{{ src = "{home}/.gitconfig" }}]
+''')
+    (repo / "fragments.d" / "editors.toml").write_text(f'''
+[vim]
+targets = [{{ src = "{home}/.vimrc" }}]
+depends_on = ["git"]
+''')
+    (repo / "fragments.d" / "shells" / "zsh.toml").write_text(f'''
+[zsh]
+targets = [{{ src = "{home}/.zshrc" }}]
+''')
+    return repo
+
+
+@pytest.fixture
+def read_files(monkeypatch):
+    paths = []
+    read_included_file = src.nastrajacz.read_included_file
+
+    def recording_read_included_file(working_dir_path, path):
+        paths.append(path)
+        return read_included_file(working_dir_path, path)
+
+    monkeypatch.setattr(
+        src.nastrajacz, "read_included_file", recording_read_included_file
+    )
+    return paths
+
+
+def test_list_includes_fragments_of_included_files(
+    split_repo, monkeypatch, terminal
+):
+    """Fragments of files matching include patterns are added to the configuration."""
+
+    # Given
+    monkeypatch.chdir(split_repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    terminal.assert_lines(
+        [
+            "Fragments defined in configuration file:",
+            "git, vim, zsh",
+        ]
+    )
+
+
+def test_select_reads_only_files_of_selected_fragments(
+    split_repo, monkeypatch, capsys, read_files
+):
+    """With --select only included files defining the selected fragments are parsed."""
+
+    # Given
+    monkeypatch.chdir(split_repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--select", "git"])
+    main()
+    capsys.readouterr()
+    read_files.clear()
+
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--select", "vim"])
+
+    # When
+    exit_code = main()
+
+    # Then
+    assert exit_code == 0
+    assert read_files == [os.path.join("fragments.d", "editors.toml")]
+    assert (split_repo / "fragments" / "vim" / ".vimrc").read_text() == "vimrc"
+    assert not (split_repo / "fragments" / "zsh").exists()
+
+
+def test_select_reads_changed_included_files(
+    split_repo, tmp_path, monkeypatch, capsys, read_files
+):
+    """Included files that changed since the index was built are parsed again."""
+
+    # Given
+    monkeypatch.chdir(split_repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+    main()
+    capsys.readouterr()
+    read_files.clear()
+
+    (tmp_path / "home" / ".bashrc").write_text("bashrc")
+    (split_repo / "fragments.d" / "shells" / "bash.toml").write_text(f'''
+[bash]
+targets = [{{ src = "{tmp_path}/home/.bashrc" }}]
+''')
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--select", "bash"])
+
+    # When
+    exit_code = main()
+
+    # Then
+    assert exit_code == 0
+    assert read_files == [os.path.join("fragments.d", "shells", "bash.toml")]
+    assert (split_repo / "fragments" / "bash" / ".bashrc").read_text() == "bashrc"
+
+
+def test_fragment_defined_in_two_files(split_repo, monkeypatch, terminal):
+    """A fragment defined in more than one file makes the configuration invalid."""
+
+    # Given
+    (split_repo / "fragments.d" / "more.toml").write_text("""
+[git]
+targets = []
+""")
+    monkeypatch.chdir(split_repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--list"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 2
+    terminal.assert_lines(["Could not read fragments config file."])
@@ -0,0 +1,107 @@
+import sys
+
+import pytest
+
+from src.nastrajacz import main
+
+
+def test_apply_with_jobs_copies_directory_in_parallel(
+    tmp_path, monkeypatch, terminal
+):
+    """--apply --jobs copies every file of a directory target using a thread pool."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    for i in range(10):
+        (fragments_dir / f"dir_{i}").mkdir(parents=True)
+        for j in range(10):
+            (fragments_dir / f"dir_{i}" / f"file_{j}.txt").write_text(f"{i}-{j}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/testapp" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--jobs", "4"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    for i in range(10):
+        for j in range(10):
+            applied = home / "testapp" / f"dir_{i}" / f"file_{j}.txt"
+            assert applied.read_text() == f"{i}-{j}"
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{home}/testapp" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_fetch_with_jobs_and_incremental_reports_counts(
+    tmp_path, monkeypatch, terminal
+):
+    """--fetch --jobs --incremental reports copied and skipped files of all workers."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    config_dir.mkdir(parents=True)
+    for i in range(20):
+        (config_dir / f"file_{i}.txt").write_text(str(i))
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(
+        sys, "argv", ["nastrajacz", "--fetch", "--incremental", "--jobs", "8"]
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    assert len(list(fetched_dir.iterdir())) == 20
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}" to "./fragments/test_fragment_1/testapp" [ DONE] (copied 20, skipped 0).',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_jobs_must_be_positive(tmp_path, monkeypatch, capsys):
+    """--jobs rejects values lower than 1."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--jobs", "0"])
+
+    # When
+    with pytest.raises(SystemExit):
+        main()
+
+    # Then
+    assert "--jobs must be at least 1" in capsys.readouterr().err
@@ -0,0 +1,132 @@
+import os
+import sys
+
+from src.nastrajacz import main
+
+
+def test_apply_mirror_removes_files_missing_in_repo(tmp_path, monkeypatch, terminal):
+    """--apply with mirror removes files and directories that are not in the repo."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    (system_dir / "cache" / "nested").mkdir(parents=True)
+    (system_dir / "cache" / "nested" / "blob").write_text("blob")
+    (system_dir / "subdir").mkdir()
+    (system_dir / "subdir" / "stale.txt").write_text("stale")
+    (system_dir / "stale.json").write_text("stale")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    (fragments_dir / "subdir").mkdir(parents=True)
+    (fragments_dir / "subdir" / "nested.txt").write_text("nested")
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", mirror = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert sorted(os.listdir(system_dir)) == ["settings.json", "subdir"]
+    assert os.listdir(system_dir / "subdir") == ["nested.txt"]
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE] (removed 3).',
+            f'Removed "{system_dir}/cache".',
+            f'Removed "{system_dir}/stale.json".',
+            f'Removed "{system_dir}/subdir/stale.txt".',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_fetch_mirror_removes_stale_files_from_repo(tmp_path, monkeypatch, terminal):
+    """--fetch --incremental with mirror removes files deleted on the system from the repo."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    config_dir.mkdir(parents=True)
+    (config_dir / "settings.json").write_text("{}")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "deleted.json").write_text("deleted")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}", mirror = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch", "--incremental"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.listdir(fragments_dir) == ["settings.json"]
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}" to "./fragments/test_fragment_1/testapp" [ DONE] (copied 1, skipped 0, removed 1).',
+            'Removed "./fragments/test_fragment_1/testapp/deleted.json".',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_mirror_with_swap(tmp_path, monkeypatch, terminal):
+    """--apply with mirror and swap swaps in a directory containing only files from the repo."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "stale.json").write_text("stale")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}", mirror = true, swap = true }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert os.listdir(system_dir) == ["settings.json"]
+    assert os.listdir(system_dir.parent) == ["testapp"]
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/testapp" to "{system_dir}" [ DONE] (removed 1).',
+            f'Removed "{system_dir}/stale.json".',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
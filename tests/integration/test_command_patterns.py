@@ -0,0 +1,165 @@
+import os
+import shutil
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_fetch_copies_files_matching_patterns(tmp_path, monkeypatch, terminal):
+    """--fetch copies every path matched by a pattern as a target of its own."""
+
+    # Given
+    config_dir = tmp_path / "home" / ".config"
+    for app in ["app_a", "app_b", "app_c"]:
+        (config_dir / app).mkdir(parents=True)
+    (config_dir / "app_a" / "settings.json").write_text("a")
+    (config_dir / "app_b" / "settings.json").write_text("b")
+    (config_dir / "app_c" / "other.json").write_text("c")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}/*/settings.json" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / ".config"
+    assert sorted(os.listdir(fetched_dir)) == ["app_a", "app_b"]
+    assert (fetched_dir / "app_a" / "settings.json").read_text() == "a"
+    assert (fetched_dir / "app_b" / "settings.json").read_text() == "b"
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "{config_dir}/app_a/settings.json" to "./fragments/test_fragment_1/.config/app_a" [ DONE].',
+            f'Copying "{config_dir}/app_b/settings.json" to "./fragments/test_fragment_1/.config/app_b" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_apply_matches_patterns_in_repository(tmp_path, monkeypatch, capsys):
+    """--apply matches patterns against the repository and copies matched directories whole."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / ".ssh" / "config.d" / "work").mkdir(parents=True)
+    (home / ".ssh" / "config.d" / "personal").write_text("personal")
+    (home / ".ssh" / "config.d" / "work" / "hosts").write_text("hosts")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.ssh/config.d/**" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+    main()
+    shutil.rmtree(home / ".ssh")
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+
+    # Then
+    assert sorted(os.listdir(repo / "fragments" / "test_fragment_1")) == ["config.d"]
+    assert (home / ".ssh" / "config.d" / "personal").read_text() == "personal"
+    assert (home / ".ssh" / "config.d" / "work" / "hosts").read_text() == "hosts"
+    assert f'Copying "./fragments/test_fragment_1/config.d" to "{home}/.ssh/config.d"' in (
+        capsys.readouterr().out
+    )
+
+
+def test_patterns_of_fragment_share_directory_listings(
+    tmp_path, monkeypatch, capsys
+):
+    """Directories are listed once for all patterns of a fragment looking into them."""
+
+    # Given
+    config_dir = tmp_path / "home" / ".config"
+    for app in ["app_a", "app_b"]:
+        (config_dir / app).mkdir(parents=True)
+        (config_dir / app / "settings.json").write_text(app)
+        (config_dir / app / "keys.json").write_text(app)
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{config_dir}/*/settings.json" }},
+    {{ src = "{config_dir}/app_?/keys.json" }},
+]
+''')
+
+    listed = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        listed.append(os.fspath(path))
+        return scandir(path)
+
+    monkeypatch.setattr(src.nastrajacz.os, "scandir", recording_scandir)
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1" / ".config"
+    assert sorted(os.listdir(fetched_dir / "app_a")) == ["keys.json", "settings.json"]
+    assert sorted(os.listdir(fetched_dir / "app_b")) == ["keys.json", "settings.json"]
+    assert listed.count(str(config_dir)) == 1
+    assert listed.count(str(config_dir / "app_a")) == 1
+
+
+def test_fetch_matches_relative_patterns(tmp_path, monkeypatch, terminal):
+    """--fetch matches a pattern without a directory against the working directory, not the filesystem root."""
+
+    # Given
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "a.ini").write_text("a")
+    (repo / "b.ini").write_text("b")
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+targets = [{ src = "*.ini" }]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    fetched_dir = repo / "fragments" / "test_fragment_1"
+    assert sorted(os.listdir(fetched_dir)) == ["a.ini", "b.ini"]
+    assert (fetched_dir / "a.ini").read_text() == "a"
+
+    terminal.assert_lines(
+        [
+            "Performing fetch for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            'Copying "a.ini" to "./fragments/test_fragment_1" [ DONE].',
+            'Copying "b.ini" to "./fragments/test_fragment_1" [ DONE].',
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
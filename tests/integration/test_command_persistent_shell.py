@@ -0,0 +1,157 @@
+import subprocess
+import sys
+
+import pytest
+
+from src.nastrajacz import main
+
+
+@pytest.fixture
+def started_processes(monkeypatch):
+    commands = []
+    popen = subprocess.Popen
+
+    class RecordingPopen(popen):
+        def __init__(self, args, *rest, **kwargs):
+            commands.append(args)
+            super().__init__(args, *rest, **kwargs)
+
+    monkeypatch.setattr(subprocess, "Popen", RecordingPopen)
+    return commands
+
+
+def test_apply_runs_actions_in_one_shell(
+    tmp_path, monkeypatch, terminal, started_processes
+):
+    """--persistent-shell runs all actions in one shell, each in a clean environment."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("testrc")
+    (fragments_dir / ".otherrc").write_text("otherrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+actions = {{ after_apply = "echo ${{LEAK:-none}} > leak.txt" }}
+targets = [
+    {{ src = "{home}/.testrc", actions = {{ after_apply = "cd /; export LEAK=1; exit 3" }} }},
+    {{ src = "{home}/.otherrc", actions = {{ after_apply = "pwd > cwd.txt && echo $TARGET_PATH > dest_path.txt" }} }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--persistent-shell"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert started_processes == [["/bin/sh"]]
+    assert (fragments_dir / "leak.txt").read_text() == "none\n"
+    assert (fragments_dir / "cwd.txt").read_text().strip() == str(fragments_dir)
+    assert (fragments_dir / "dest_path.txt").read_text().strip() == str(
+        home / ".otherrc"
+    )
+
+    terminal.assert_lines(
+        [
+            "Performing apply for test_fragment_1 fragments.",
+            "",
+            "Processing fragment test_fragment_1.",
+            f'Copying "./fragments/test_fragment_1/.testrc" to "{home}/.testrc" [ DONE].',
+            "Running after_apply for test_fragment_1/.testrc [󰚌 FAIL] (exit code 3).",
+            f'Copying "./fragments/test_fragment_1/.otherrc" to "{home}/.otherrc" [ DONE].',
+            "Running after_apply for test_fragment_1/.otherrc [ DONE] (exit code 0).",
+            "Running after_apply for test_fragment_1 [ DONE] (exit code 0).",
+            "Finished processing fragment test_fragment_1 [ DONE].",
+        ]
+    )
+
+
+def test_fetch_captures_output_of_actions_with_fragment_jobs(
+    tmp_path, monkeypatch, terminal
+):
+    """--persistent-shell keeps output of actions together with their fragment's output."""
+
+    # Given
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+actions = { after_fetch = "echo fetched 1" }
+targets = []
+
+[test_fragment_2]
+actions = { after_fetch = "echo fetched 2 >&2; false" }
+targets = []
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["nastrajacz", "--fetch", "--persistent-shell", "--fragment-jobs", "2"],
+    )
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    lines = terminal.lines
+    assert "Running after_fetch for test_fragment_1fetched 1" in lines
+    assert "Running after_fetch for test_fragment_2fetched 2" in lines
+    assert "[󰚌 FAIL] (exit code 1)." in lines
+
+
+def test_persistent_shell_requires_apply_or_fetch(tmp_path, monkeypatch, capsys):
+    """--persistent-shell is rejected for commands that don't run actions."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status", "--persistent-shell"])
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert (
+        "--persistent-shell can only be used with --apply or --fetch"
+        in capsys.readouterr().err
+    )
+
+
+def test_actions_cannot_write_exit_codes(tmp_path, monkeypatch, terminal):
+    """--persistent-shell doesn't let actions write to the channel of exit codes."""
+
+    # Given
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments.toml").write_text('''
+[test_fragment_1]
+actions = { before_apply = "echo 7 >&3; true", after_apply = "exit 3" }
+targets = []
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--persistent-shell"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert "Running before_apply for test_fragment_1 [ DONE] (exit code 0)." in (
+        terminal.lines
+    )
+    assert "Running after_apply for test_fragment_1 [󰚌 FAIL] (exit code 3)." in (
+        terminal.lines
+    )
@@ -0,0 +1,235 @@
+import json
+import os
+import sys
+
+import pytest
+
+from src.nastrajacz import main
+
+
+def test_rollback_restores_latest_backup(tmp_path, monkeypatch, capsys, terminal):
+    """--rollback restores overwritten files and removes files created by the run."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("previous")
+    os.chmod(home / ".testrc", 0o600)
+    os.utime(home / ".testrc", ns=(0, 1_000_000_000))
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("applied")
+    (fragments_dir / ".newrc").write_text("new")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/.testrc" }},
+    {{ src = "{home}/.newrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    main()
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    assert os.listdir(home) == [".testrc"]
+    assert (home / ".testrc").read_text() == "previous"
+    assert (home / ".testrc").stat().st_mode & 0o777 == 0o600
+    assert (home / ".testrc").stat().st_mtime_ns == 1_000_000_000
+
+    (index_name,) = os.listdir(tmp_path / "state" / "nastrajacz" / "runs")
+    run_id = index_name.removesuffix(".json")
+    terminal.assert_lines(
+        [
+            f"Rolling back backup {run_id}.",
+            "",
+            f'Removed "{home}/.newrc".',
+            f'Restored "{home}/.testrc".',
+            "",
+            f"Rolled back backup {run_id} [ DONE].",
+        ]
+    )
+
+
+def test_rollback_restores_given_run(tmp_path, monkeypatch, capsys):
+    """--rollback RUN_ID restores files to their versions from before that run."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("first")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    (fragments_dir / ".testrc").write_text("second")
+    main()
+    (first_index,) = os.listdir(tmp_path / "state" / "nastrajacz" / "runs")
+    (fragments_dir / ".testrc").write_text("third")
+    main()
+    capsys.readouterr()
+
+    run_id = first_index.removesuffix(".json")
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback", run_id])
+
+    # When
+    exit_code = main()
+    capsys.readouterr()
+
+    # Then
+    assert exit_code == 0
+    assert (home / ".testrc").read_text() == "first"
+
+
+def test_rollback_restores_removed_files_and_links(
+    tmp_path, monkeypatch, capsys
+):
+    """--rollback recreates files removed by mirror and files replaced by links."""
+
+    # Given
+    home = tmp_path / "home"
+    system_dir = home / "testapp"
+    (system_dir / "old").mkdir(parents=True)
+    (system_dir / "old" / "stale.txt").write_text("stale")
+    (home / "target").write_text("target")
+    (home / ".testrc").symlink_to(home / "target")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{system_dir}", mirror = true }},
+    {{ src = "{home}/.testrc", mode = "symlink" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    main()
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback"])
+
+    # When
+    exit_code = main()
+    capsys.readouterr()
+
+    # Then
+    assert exit_code == 0
+    assert os.listdir(system_dir) == ["old"]
+    assert (system_dir / "old" / "stale.txt").read_text() == "stale"
+    assert os.readlink(home / ".testrc") == str(home / "target")
+
+
+def test_rollback_without_backups(tmp_path, monkeypatch, terminal):
+    """--rollback reports that there is nothing to restore."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback", "missing"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 2
+    terminal.assert_lines(['There is no backup "missing".'])
+
+
+def test_rollback_with_broken_config(tmp_path, monkeypatch, capsys):
+    """--rollback works when fragments.toml can no longer be read."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("previous")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    main()
+    capsys.readouterr()
+
+    (repo / "fragments.toml").write_text("[test_fragment_1\n")
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback"])
+
+    # When
+    exit_code = main()
+
+    # Then
+    assert exit_code == 0
+    assert (home / ".testrc").read_text() == "previous"
+    assert "Could not read fragments config file." not in capsys.readouterr().out
+
+
+def test_rollback_restores_files_of_failed_apply(tmp_path, monkeypatch, capsys):
+    """--rollback restores files replaced by an apply that failed before finishing."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("previous")
+    (home / "blocker").write_text("a file where a directory is expected")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "settings.json").write_text("{}")
+    (fragments_dir / ".testrc").write_text("applied")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/.testrc" }},
+    {{ src = "{home}/blocker/testapp" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--backup"])
+    with pytest.raises(OSError):
+        main()
+    assert (home / ".testrc").read_text() == "applied"
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--rollback"])
+
+    # When
+    exit_code = main()
+
+    # Then
+    assert exit_code == 0
+    assert (home / ".testrc").read_text() == "previous"
@@ -0,0 +1,253 @@
+import os
+import sys
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def test_status_reports_identical_files(tmp_path, monkeypatch, capsys, terminal):
+    """--status returns 0 when the system matches the repository."""
+
+    # Given
+    home = tmp_path / "home"
+    (home / "testapp").mkdir(parents=True)
+    (home / "testapp" / "settings.json").write_text("{}")
+    (home / ".testrc").write_text("testrc")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/testapp" }},
+    {{ src = "{home}/.testrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--fetch"])
+    main()
+    capsys.readouterr()
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+
+    terminal.assert_lines(
+        [
+            "Checking status of test_fragment_1 fragments.",
+            "",
+            "Checking fragment test_fragment_1.",
+            f'Comparing "./fragments/test_fragment_1/testapp" with "{home}/testapp" [ DONE] (identical 1, modified 0, missing on system 0, missing in repo 0).',
+            f'Comparing "./fragments/test_fragment_1/.testrc" with "{home}/.testrc" [ DONE] (identical 1, modified 0, missing on system 0, missing in repo 0).',
+            "",
+            "All files are identical.",
+        ]
+    )
+
+
+def test_status_reports_drift(tmp_path, monkeypatch, terminal):
+    """--status lists modified and missing files and returns 1."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "same.txt").write_text("same")
+    (system_dir / "changed.txt").write_text("system")
+    (system_dir / "extra.txt").write_text("extra")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "same.txt").write_text("same")
+    (fragments_dir / "changed.txt").write_text("repo")
+    (fragments_dir / "new.txt").write_text("new")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            "Checking status of test_fragment_1 fragments.",
+            "",
+            "Checking fragment test_fragment_1.",
+            f'Comparing "./fragments/test_fragment_1/testapp" with "{system_dir}" [ DONE] (identical 1, modified 1, missing on system 1, missing in repo 1).',
+            f'Modified "{system_dir}/changed.txt".',
+            f'Missing in repo "{system_dir}/extra.txt".',
+            f'Missing on system "{system_dir}/new.txt".',
+            "",
+            "Found 3 files that differ.",
+        ]
+    )
+
+
+def test_status_reads_contents_only_when_mtime_differs(
+    tmp_path, monkeypatch, terminal
+):
+    """--status compares contents of files with the same size and a different mtime."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".samerc").write_text("same")
+    (home / ".touchedrc").write_text("same")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".samerc").write_text("same")
+    (fragments_dir / ".touchedrc").write_text("same")
+    same_stat = (home / ".samerc").stat()
+    os.utime(
+        fragments_dir / ".samerc", ns=(same_stat.st_atime_ns, same_stat.st_mtime_ns)
+    )
+    os.utime(fragments_dir / ".touchedrc", ns=(0, 0))
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/.samerc" }},
+    {{ src = "{home}/.touchedrc" }},
+]
+''')
+
+    compared = []
+    same_contents = src.nastrajacz.same_contents
+
+    def recording_same_contents(a, b):
+        compared.append(os.path.basename(a))
+        return same_contents(a, b)
+
+    monkeypatch.setattr(src.nastrajacz, "same_contents", recording_same_contents)
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 0
+    assert compared == [".touchedrc"]
+
+
+def test_status_deep_hashes_files_with_same_metadata(
+    tmp_path, monkeypatch, terminal
+):
+    """--status --deep detects changed contents hidden behind unchanged size and mtime."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".testrc").write_text("host")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / ".testrc").write_text("repo")
+    host_stat = (home / ".testrc").stat()
+    os.utime(
+        fragments_dir / ".testrc", ns=(host_stat.st_atime_ns, host_stat.st_mtime_ns)
+    )
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status", "--deep"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            "Checking status of test_fragment_1 fragments.",
+            "",
+            "Checking fragment test_fragment_1.",
+            f'Comparing "./fragments/test_fragment_1/.testrc" with "{home}/.testrc" [ DONE] (identical 0, modified 1, missing on system 0, missing in repo 0).',
+            f'Modified "{home}/.testrc".',
+            "",
+            "Found 1 files that differ.",
+        ]
+    )
+
+
+def test_deep_requires_status(tmp_path, monkeypatch, capsys):
+    """--deep is rejected without --status."""
+
+    # Given
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--deep"])
+
+    # When
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+
+    # Then
+    assert exc_info.value.code == 2
+    assert "--deep can only be used with --status" in capsys.readouterr().err
+
+
+def test_status_reports_dangling_links_as_missing(tmp_path, monkeypatch, terminal):
+    """--status reports a dangling symbolic link as a missing file instead of failing."""
+
+    # Given
+    system_dir = tmp_path / "home" / "testapp"
+    system_dir.mkdir(parents=True)
+    (system_dir / "settings.json").symlink_to(tmp_path / "nowhere")
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "settings.json").write_text("{}")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{system_dir}" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--status"])
+
+    # When
+    exit_code = main()
+    terminal.render()
+
+    # Then
+    assert exit_code == 1
+
+    terminal.assert_lines(
+        [
+            "Checking status of test_fragment_1 fragments.",
+            "",
+            "Checking fragment test_fragment_1.",
+            f'Comparing "./fragments/test_fragment_1/testapp" with "{system_dir}" [ DONE] (identical 0, modified 0, missing on system 1, missing in repo 0).',
+            f'Missing on system "{system_dir}/settings.json".',
+            "",
+            "Found 1 files that differ.",
+        ]
+    )
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+
+import pytest
+
+import src.nastrajacz
+from src.nastrajacz import Options, read_fragments_config, watch_fragments
+
+
+def start_watch(repo, options=None):
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch_fragments,
+        args=(read_fragments_config(str(repo)), options or Options(), stop),
+    )
+    thread.start()
+    # Gives the watcher time to register its watches.
+    time.sleep(0.3)
+    return thread, stop
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition was not met in time")
+        time.sleep(0.02)
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def watcher(request, monkeypatch):
+    monkeypatch.setattr(src.nastrajacz, "WATCH_TIMEOUT", 0.05)
+    monkeypatch.setattr(src.nastrajacz, "WATCH_DEBOUNCE", 0.05)
+    monkeypatch.setattr(src.nastrajacz, "WATCH_POLL_INTERVAL", 0.05)
+    if request.param == "polling":
+        monkeypatch.setattr(
+            src.nastrajacz.InotifyWatcher, "create", staticmethod(lambda: None)
+        )
+    return request.param
+
+
+def test_watch_fetches_changed_files(tmp_path, monkeypatch, terminal, watcher):
+    """--watch copies only files that changed into the repository."""
+
+    # Given
+    home = tmp_path / "home"
+    config_dir = home / "testapp"
+    (config_dir / "subdir").mkdir(parents=True)
+    (config_dir / "settings.json").write_text("{}")
+    (config_dir / "untouched.json").write_text("[]")
+    (home / ".testrc").write_text("testrc")
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{config_dir}" }},
+    {{ src = "{home}/.testrc" }},
+]
+''')
+    monkeypatch.chdir(repo)
+    fragment_dir = repo / "fragments" / "test_fragment_1"
+
+    thread, stop = start_watch(repo)
+
+    # When
+    (config_dir / "subdir" / "nested.json").write_text('{"key": "value"}')
+    (home / ".testrc").write_text("changed")
+    wait_until(
+        lambda: (fragment_dir / ".testrc").exists()
+        and (fragment_dir / "testapp" / "subdir" / "nested.json").exists()
+    )
+    stop.set()
+    thread.join()
+    terminal.render()
+
+    # Then
+    assert (fragment_dir / ".testrc").read_text() == "changed"
+    assert (fragment_dir / "testapp" / "subdir" / "nested.json").read_text() == (
+        '{"key": "value"}'
+    )
+    assert not (fragment_dir / "testapp" / "settings.json").exists()
+    assert not (fragment_dir / "testapp" / "untouched.json").exists()
+
+    lines = terminal.lines
+    assert lines[0] == "Watching test_fragment_1 fragments for changes."
+    assert lines[-1] == "Stopped watching."
+
+
+def test_watch_creates_watches_for_new_directories(
+    tmp_path, monkeypatch, terminal, watcher
+):
+    """--watch fetches files in directories created while watching."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    config_dir.mkdir(parents=True)
+
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}" }}]
+''')
+    monkeypatch.chdir(repo)
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+
+    thread, stop = start_watch(repo)
+
+    # When
+    (config_dir / "themes").mkdir()
+    (config_dir / "themes" / "dark.toml").write_text("dark")
+    wait_until(lambda: (fetched_dir / "themes" / "dark.toml").exists())
+
+    (config_dir / "themes" / "light.toml").write_text("light")
+    wait_until(lambda: (fetched_dir / "themes" / "light.toml").exists())
+    stop.set()
+    thread.join()
+    terminal.render()
+
+    # Then
+    assert (fetched_dir / "themes" / "dark.toml").read_text() == "dark"
+    assert (fetched_dir / "themes" / "light.toml").read_text() == "light"
+
+
+def test_watch_respects_filters_and_mirror(tmp_path, monkeypatch, terminal, watcher):
+    """--watch skips excluded files and removes deleted files of mirrored targets."""
+
+    # Given
+    config_dir = tmp_path / "home" / "testapp"
+    config_dir.mkdir(parents=True)
+    (config_dir / "old.json").write_text("old")
+
+    repo = tmp_path / "repo"
+    fetched_dir = repo / "fragments" / "test_fragment_1" / "testapp"
+    fetched_dir.mkdir(parents=True)
+    (fetched_dir / "old.json").write_text("old")
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{config_dir}", mirror = true, exclude = ["*.log"] }}]
+''')
+    monkeypatch.chdir(repo)
+
+    thread, stop = start_watch(repo)
+
+    # When
+    (config_dir / "debug.log").write_text("log")
+    os.unlink(config_dir / "old.json")
+    (config_dir / "new.json").write_text("new")
+    wait_until(
+        lambda: (fetched_dir / "new.json").exists()
+        and not (fetched_dir / "old.json").exists()
+    )
+    stop.set()
+    thread.join()
+    terminal.render()
+
+    # Then
+    assert os.listdir(fetched_dir) == ["new.json"]
@@ -0,0 +1,124 @@
+import errno
+import os
+import re
+import sys
+
+import src.nastrajacz
+from src.nastrajacz import main
+
+
+def fail_with(error: int):
+    def fail(*args, **kwargs):
+        raise OSError(error, os.strerror(error))
+
+    return fail
+
+
+def test_apply_zero_copy_reports_copy_methods(tmp_path, monkeypatch, terminal):
+    """--apply --zero-copy copies files inside the kernel and reports the methods used."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    (fragments_dir / "testapp").mkdir(parents=True)
+    (fragments_dir / "testapp" / "large.bin").write_bytes(os.urandom(3 * 1024 * 1024))
+    (fragments_dir / "testapp" / "empty").write_bytes(b"")
+    (fragments_dir / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [
+    {{ src = "{home}/testapp" }},
+    {{ src = "{home}/.testrc" }},
+]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--zero-copy"])
+    monkeypatch.setattr(src.nastrajacz.fcntl, "ioctl", fail_with(errno.EOPNOTSUPP))
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    large = fragments_dir / "testapp" / "large.bin"
+    assert (home / "testapp" / "large.bin").read_bytes() == large.read_bytes()
+    assert (home / "testapp" / "large.bin").stat().st_mtime_ns == large.stat().st_mtime_ns
+    assert (home / "testapp" / "empty").read_bytes() == b""
+    assert (home / ".testrc").read_text() == "testrc"
+
+    assert terminal.lines[-1] in (
+        "Copied files using copy_file_range 3.",
+        "Copied files using sendfile 3.",
+        "Copied files using userspace 3.",
+    )
+
+
+def test_zero_copy_falls_back_when_kernel_copy_fails(tmp_path, monkeypatch, capsys):
+    """--zero-copy falls back to sendfile and then userspace copying when faster methods fail."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    fragments_dir = repo / "fragments" / "test_fragment_1"
+    fragments_dir.mkdir(parents=True)
+    (fragments_dir / "large.bin").write_bytes(os.urandom(1024 * 1024 + 7))
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/large.bin" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply", "--zero-copy"])
+    monkeypatch.setattr(src.nastrajacz.fcntl, "ioctl", fail_with(errno.EOPNOTSUPP))
+    monkeypatch.setattr(os, "copy_file_range", fail_with(errno.EXDEV))
+
+    # When
+    main()
+    monkeypatch.setattr(os, "sendfile", fail_with(errno.EINVAL))
+    (home / "large.bin").unlink()
+    main()
+
+    # Then
+    output = re.sub(r"\x1b\[\d+m", "", capsys.readouterr().out)
+    assert "Copied files using sendfile 1." in output
+    assert "Copied files using userspace 1." in output
+    assert (home / "large.bin").read_bytes() == (fragments_dir / "large.bin").read_bytes()
+
+
+def test_apply_without_zero_copy_does_not_report_methods(
+    tmp_path, monkeypatch, terminal
+):
+    """--apply without --zero-copy keeps the usual output."""
+
+    # Given
+    home = tmp_path / "home"
+    home.mkdir()
+
+    repo = tmp_path / "repo"
+    (repo / "fragments" / "test_fragment_1").mkdir(parents=True)
+    (repo / "fragments" / "test_fragment_1" / ".testrc").write_text("testrc")
+
+    (repo / "fragments.toml").write_text(f'''
+[test_fragment_1]
+targets = [{{ src = "{home}/.testrc" }}]
+''')
+
+    monkeypatch.chdir(repo)
+    monkeypatch.setattr(sys, "argv", ["nastrajacz", "--apply"])
+
+    # When
+    main()
+    terminal.render()
+
+    # Then
+    assert terminal.lines[-1] == (
+        "Finished processing fragment test_fragment_1 [ DONE]."
+    )
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "src", "nastrajacz.py")
+BIN_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "nastrajacz")
+
+
+def imported_modules(command, cwd):
+    result = subprocess.run(
+        command,
+        cwd=cwd,
+        env={**os.environ, "PYTHONPROFILEIMPORTTIME": "1"},
+        capture_output=True,
+        text=True,
+    )
+    modules = {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    return result, modules
+
+
+def test_version_is_printed_without_importing_modules(tmp_path):
+    """--version prints the version before the modules used by commands are imported."""
+
+    # When
+    result, modules = imported_modules([sys.executable, SCRIPT_PATH, "--version"], tmp_path)
+
+    # Then
+    assert result.returncode == 0
+    assert result.stdout.startswith("nastrajacz ")
+    assert "argparse" not in modules
+    assert "dataclasses" not in modules
+
+
+def test_list_does_not_import_modules_of_other_commands(tmp_path):
+    """--list doesn't import modules needed only for running actions, bundles or status."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("""
+[test_fragment_1]
+targets = []
+""")
+
+    # When
+    result, modules = imported_modules([BIN_PATH, "--list"], tmp_path)
+
+    # Then
+    assert result.returncode == 0
+    assert result.stdout.splitlines() == [
+        "Fragments defined in configuration file:",
+        "test_fragment_1",
+    ]
+    assert "tomllib" in modules
+    for module in [
+        "concurrent.futures",
+        "ctypes",
+        "difflib",
+        "socket",
+        "subprocess",
+        "tarfile",
+    ]:
+        assert module not in modules
+
+
+def test_list_reads_cached_config_without_toml_parser(tmp_path):
+    """--list doesn't import the TOML parser when the configuration is cached."""
+
+    # Given
+    (tmp_path / "fragments.toml").write_text("""
+[test_fragment_1]
+targets = []
+""")
+    subprocess.run([BIN_PATH, "--list"], cwd=tmp_path, capture_output=True)
+
+    # When
+    result, modules = imported_modules([BIN_PATH, "--list"], tmp_path)
+
+    # Then
+    assert result.returncode == 0
+    assert "tomllib" not in modules